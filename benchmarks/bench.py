@@ -0,0 +1,477 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark kubediff against a synthetic repository and a fake kubectl.
+
+Generates a repository of Deployments, ConfigMaps, custom resources and List
+documents, along with the "live" versions of those objects, some of them
+changed or missing. kubectl is replaced by a stand-in that serves the live
+objects after a configurable delay, so no cluster is needed.
+
+Each phase reports its wall time, throughput and memory use, and results
+can be saved as JSON and compared against an earlier run:
+
+    python benchmarks/bench.py --save before.json
+    python benchmarks/bench.py --baseline before.json
+"""
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from kubedifflib import _kube, check_files, compare_image_indexes, index_images  # noqa: E402
+from kubedifflib._diff import diff, iter_file_objects, iter_yaml_files, make_fetcher  # noqa: E402
+from kubedifflib._kube import BatchFetcher, KubeObject, fetch_errors  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+clock = getattr(time, "perf_counter", time.time)
+
+CRD_GROUP = "bench.example.com"
+
+
+def _dump_all(documents):
+    return yaml.dump_all(documents, Dumper=Dumper, default_flow_style=False)
+
+
+def _sidecar(index, env_size):
+    """Return a sidecar container that is the same in every Deployment."""
+    return {
+        "name": "sidecar-%d" % index,
+        "image": "registry.example.com/sidecar-%d:v1" % index,
+        "env": [{"name": "SIDECAR_%d" % i, "value": "shared-%d" % i} for i in range(env_size)],
+        "resources": {"requests": {"cpu": "10m", "memory": "32Mi"}},
+    }
+
+
+def _containers(rng, name, env_size, sidecars=0):
+    return [{
+        "name": name,
+        "image": "registry.example.com/%s:v%d" % (name, rng.randint(1, 50)),
+        "env": [{"name": "VAR_%d" % i, "value": "value-%d" % rng.randint(0, 1000)} for i in range(env_size)],
+        "ports": [{"containerPort": 8080 + i, "protocol": "TCP"} for i in range(3)],
+        "resources": {"requests": {"cpu": "100m", "memory": "128Mi"}},
+    }] + [_sidecar(i, env_size) for i in range(sidecars)]
+
+
+def make_deployment(rng, name, namespace, env_size, sidecars=0):
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {"name": name, "namespace": namespace, "labels": {"app": name}},
+        "spec": {
+            "replicas": rng.randint(1, 5),
+            "selector": {"matchLabels": {"app": name}},
+            "template": {
+                "metadata": {"labels": {"app": name}},
+                "spec": {"containers": _containers(rng, name, env_size, sidecars)},
+            },
+        },
+    }
+
+
+def make_config_map(rng, name, namespace, blob_lines):
+    blob = "".join("line %d: %08x\n" % (i, rng.getrandbits(32)) for i in range(blob_lines))
+    return {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": name, "namespace": namespace},
+        "data": {"config.ini": blob, "mode": "production"},
+    }
+
+
+def make_custom_resource(rng, name, namespace, list_size):
+    return {
+        "apiVersion": "%s/v1" % CRD_GROUP,
+        "kind": "Widget",
+        "metadata": {"name": name, "namespace": namespace},
+        "spec": {
+            "rules": [{"host": "host-%d.example.com" % i, "weight": rng.randint(0, 100)} for i in range(list_size)],
+        },
+    }
+
+
+def make_crd():
+    return {
+        "apiVersion": "apiextensions.k8s.io/v1",
+        "kind": "CustomResourceDefinition",
+        "metadata": {"name": "widgets.%s" % CRD_GROUP},
+        "spec": {
+            "group": CRD_GROUP,
+            "names": {"kind": "Widget", "plural": "widgets"},
+            "scope": "Namespaced",
+            "versions": [{"name": "v1", "served": True, "storage": True}],
+        },
+    }
+
+
+def drift(rng, data):
+    """Return a copy of 'data' as it might have drifted in a cluster."""
+    live = json.loads(json.dumps(data))
+    live["metadata"]["resourceVersion"] = str(rng.randint(1, 10 ** 6))
+    kind = live["kind"]
+    if kind == "Deployment":
+        container = live["spec"]["template"]["spec"]["containers"][0]
+        choice = rng.randint(0, 2)
+        if choice == 0:
+            live["spec"]["replicas"] += 1
+        elif choice == 1 and container["env"]:
+            container["env"][rng.randrange(len(container["env"]))]["value"] = "drifted"
+        else:
+            container["image"] = container["image"].rsplit(":", 1)[0] + ":drifted"
+    elif kind == "ConfigMap":
+        lines = live["data"]["config.ini"].splitlines(True)
+        if lines:
+            lines[rng.randrange(len(lines))] = "drifted\n"
+        live["data"]["config.ini"] = "".join(lines)
+    elif kind == "Widget":
+        rng.shuffle(live["spec"]["rules"])
+        if live["spec"]["rules"]:
+            live["spec"]["rules"][0]["weight"] = -1
+    return live
+
+
+def with_defaults(data):
+    """Return a copy of 'data' with fields filled in as an API server would.
+
+    The defaulted fields aren't in the manifests, so list elements that
+    have them can't be paired with their manifests by fingerprint alone.
+    """
+    if data["kind"] != "Deployment":
+        return data
+    live = json.loads(json.dumps(data))
+    for container in live["spec"]["template"]["spec"]["containers"]:
+        container.setdefault("imagePullPolicy", "IfNotPresent")
+        container.setdefault("terminationMessagePath", "/dev/termination-log")
+        container.setdefault("terminationMessagePolicy", "File")
+    return live
+
+
+def generate_repo(directory, objects=1000, env_size=20, list_size=200, blob_lines=200,
+                  drift_ratio=0.1, missing_ratio=0.02, per_file=5, seed=0, sidecars=2):
+    """Write a synthetic repository to 'directory'.
+
+    Writes the manifests to '<directory>/manifests', and for compare-images
+    writes them again, one per file, to '<directory>/source' and the live
+    objects, one per file, to '<directory>/live'. 'objects' is split between
+    Deployments, ConfigMaps and Widget custom resources; every tenth manifest
+    file is written as a List document rather than as separate documents.
+
+    :return: A list of the live objects' data.
+    """
+    rng = random.Random(seed)
+    manifests = os.path.join(directory, "manifests")
+    os.makedirs(manifests)
+
+    wanted = [make_crd()]
+    for i in range(objects):
+        namespace = "team-%d" % (i % 10)
+        name = "object-%05d" % i
+        if i % 3 == 0:
+            wanted.append(make_deployment(rng, name, namespace, env_size, sidecars))
+        elif i % 3 == 1:
+            wanted.append(make_config_map(rng, name, namespace, blob_lines))
+        else:
+            wanted.append(make_custom_resource(rng, name, namespace, list_size))
+
+    live = []
+    for data in wanted:
+        roll = rng.random()
+        if roll < missing_ratio:
+            continue
+        live.append(with_defaults(drift(rng, data) if roll < missing_ratio + drift_ratio else data))
+
+    for (index, start) in enumerate(range(0, len(wanted), per_file)):
+        documents = wanted[start:start + per_file]
+        if index % 10 == 9:
+            documents = [{"apiVersion": "v1", "kind": "List", "items": documents}]
+        with open(os.path.join(manifests, "manifests-%05d.yaml" % index), "w") as stream:
+            stream.write(_dump_all(documents))
+    for (environment, objects) in [("source", wanted), ("live", live)]:
+        os.makedirs(os.path.join(directory, environment))
+        for (index, data) in enumerate(objects):
+            with open(os.path.join(directory, environment, "%s-%05d.yaml" % (environment, index)), "w") as stream:
+                stream.write(_dump_all([data]))
+    return live
+
+
+class FakeKubectl(object):
+    """Stand-in for 'subprocess.check_output' that serves canned objects.
+
+    Each call sleeps 'latency' seconds first, like a call to a remote API
+    server would. Objects are serialized up front, so that the stand-in's
+    own cost isn't measured.
+    """
+
+    def __init__(self, objects, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+        self._objects = {}
+        self._groups = {}
+        for data in objects:
+            for kube_obj in KubeObject.from_dict(data, "default"):
+                key = (kube_obj.kind, kube_obj.namespace)
+                self._objects[key + (kube_obj.name,)] = _dump_all([data]).encode('utf-8')
+                self._groups.setdefault(key, []).append(data)
+        self._lists = dict(
+            (key, _dump_all([{"apiVersion": "v1", "kind": "List", "items": items}]).encode('utf-8'))
+            for (key, items) in self._groups.items())
+
+    def __call__(self, command, stderr=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        namespace = [arg for arg in command if arg.startswith("--namespace=")][0].split("=", 1)[1]
+        positional = [arg for arg in command[2:] if not arg.startswith("-")]
+        if len(positional) == 1:
+            return self._lists.get((positional[0], namespace), b"apiVersion: v1\nitems: []\nkind: List\n")
+        [kind, name] = positional
+        try:
+            return self._objects[(kind, namespace, name)]
+        except KeyError:
+            output = 'Error from server (NotFound): %s "%s" not found\n' % (kind, name)
+            raise subprocess.CalledProcessError(1, command, output.encode('utf-8'))
+
+
+class CountingPrinter(object):
+    """A printer that only counts what it is given."""
+
+    def __init__(self):
+        self.objects = 0
+        self.differences = 0
+
+    def add(self, path, kube_obj):
+        self.objects += 1
+
+    def diff(self, path, difference):
+        self.differences += 1
+
+    def finish(self):
+        pass
+
+
+def _max_rss():
+    """Return the process's peak resident set size in bytes, if known."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class Phases(object):
+    """Runs and records benchmark phases."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def run(self, name, function, *args):
+        """Run 'function(*args)', which returns the number of items it handled."""
+        if self.trace_memory:
+            tracemalloc.start()
+        start = clock()
+        items = function(*args)
+        elapsed = clock() - start
+        result = {"phase": name, "seconds": elapsed, "items": items,
+                  "per_second": items / elapsed if elapsed else None, "max_rss": _max_rss()}
+        if self.trace_memory:
+            result["peak_traced"] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.results.append(result)
+        return result
+
+
+def parse_phase(paths, config, parsed):
+    for path in iter_yaml_files(paths):
+        parsed.extend(iter_file_objects(path, config))
+    return len(parsed)
+
+
+def fetch_phase(parsed, config, fetched):
+    fetcher = make_fetcher(config)
+    if isinstance(fetcher, BatchFetcher):
+        for kube_obj in parsed:
+            fetcher.want(kube_obj)
+
+    def fetch(kube_obj):
+        try:
+            return fetcher.get(kube_obj)
+        except fetch_errors:
+            return None
+
+    with ThreadPoolExecutor(config.get("jobs", 1)) as executor:
+        fetched.extend(zip(parsed, executor.map(fetch, parsed)))
+    return len(fetched)
+
+
+def diff_phase(fetched):
+    count = 0
+    for (kube_obj, live) in fetched:
+        if live is not None:
+            count += 1
+            list(diff((), kube_obj.data, live))
+    return count
+
+
+def check_phase(paths, config, printer):
+    check_files(paths, printer, config)
+    return printer.objects
+
+
+def images_phase(source, target):
+    source_env = index_images(source)
+    target_env = index_images(target)
+    compare_image_indexes(source_env, target_env)
+    return len(source_env) + len(target_env)
+
+
+def run_benchmark(directory, options):
+    """Run all phases against a repository generated in 'directory'."""
+    phases = Phases(options.trace_memory)
+    live = []
+
+    def generate():
+        live.extend(generate_repo(directory, options.objects, options.env_size, options.list_size,
+                                  options.blob_lines, options.drift, options.missing, seed=options.seed,
+                                  sidecars=options.sidecars))
+        return len(live)
+
+    phases.run("generate", generate)
+
+    kubectl = FakeKubectl(live, options.latency)
+    real_check_output, _kube.subprocess.check_output = _kube.subprocess.check_output, kubectl
+    try:
+        paths = [os.path.join(directory, "manifests")]
+        config = {"kubeconfig": None, "context": None, "namespace": "default",
+                  "jobs": options.jobs, "batch": options.batch, "parse_jobs": options.parse_jobs}
+        parsed, fetched = [], []
+        phases.run("parse", parse_phase, paths, config, parsed)
+        phases.run("fetch", fetch_phase, parsed, config, fetched)
+        phases.run("diff", diff_phase, fetched)
+        printer = CountingPrinter()
+        phases.run("check", check_phase, paths, config, printer)
+        phases.run("images", images_phase, os.path.join(directory, "source"), os.path.join(directory, "live"))
+    finally:
+        _kube.subprocess.check_output = real_check_output
+    return {
+        "python": sys.version.split()[0],
+        "options": vars(options),
+        "differences": printer.differences,
+        "kubectl_calls": kubectl.calls,
+        "phases": phases.results,
+    }
+
+
+def _megabytes(value):
+    return None if value is None else "%.1f" % (value / 2 ** 20)
+
+
+def format_results(results, baseline=None):
+    """Format benchmark results as a table, with ratios to 'baseline' if given."""
+    before = dict((phase["phase"], phase) for phase in (baseline or {}).get("phases", []))
+    headers = ["Phase", "Seconds", "Items", "Items/s", "Max RSS (MiB)"]
+    if any("peak_traced" in phase for phase in results["phases"]):
+        headers.append("Peak traced (MiB)")
+    if baseline is not None:
+        headers.append("vs baseline")
+    rows = []
+    for phase in results["phases"]:
+        row = [phase["phase"], "%.3f" % phase["seconds"], phase["items"],
+               "%.0f" % phase["per_second"] if phase["per_second"] else "", _megabytes(phase["max_rss"])]
+        if "Peak traced (MiB)" in headers:
+            row.append(_megabytes(phase.get("peak_traced")))
+        if baseline is not None:
+            old = before.get(phase["phase"])
+            row.append("%.2fx" % (phase["seconds"] / old["seconds"]) if old and old["seconds"] else "")
+        rows.append(row)
+    return "%s\n\n%d differences, %d kubectl calls" % (
+        tabulate(rows, headers=headers), results["differences"], results["kubectl_calls"])
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--objects", type=positive_int, default=1000,
+                        help="number of objects in the repository")
+    parser.add_argument("--env-size", type=int, default=20,
+                        help="environment variables per Deployment")
+    parser.add_argument("--sidecars", type=int, default=2,
+                        help="sidecar containers, the same in every Deployment, per Deployment")
+    parser.add_argument("--list-size", type=int, default=200,
+                        help="list entries per custom resource")
+    parser.add_argument("--blob-lines", type=int, default=200,
+                        help="lines in each ConfigMap's multi-line value")
+    parser.add_argument("--drift", type=float, default=0.1,
+                        help="fraction of live objects that differ from their manifests")
+    parser.add_argument("--missing", type=float, default=0.02,
+                        help="fraction of objects missing from the cluster")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds each fake kubectl call takes")
+    parser.add_argument("--jobs", type=positive_int, default=1,
+                        help="number of objects to fetch concurrently")
+    parser.add_argument("--batch", action="store_true",
+                        help="fetch with one list call per kind and namespace")
+    parser.add_argument("--parse-jobs", type=positive_int, default=1,
+                        help="number of processes to parse files on in the check phase")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed for generating the repository")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="also report each phase's peak traced allocations (slower; Python 3 only)")
+    parser.add_argument("--save", metavar="FILE", help="write results to FILE as JSON")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with results saved by an earlier --save")
+    options = parser.parse_args()
+    if options.trace_memory and tracemalloc is None:
+        parser.error("--trace-memory needs Python 3")
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as stream:
+            baseline = json.load(stream)
+
+    directory = tempfile.mkdtemp(prefix="kubediff-bench-")
+    try:
+        results = run_benchmark(directory, options)
+    finally:
+        shutil.rmtree(directory)
+
+    print(format_results(results, baseline))
+    if options.save:
+        with open(options.save, "w") as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
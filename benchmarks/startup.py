@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Check that kubediff starts within its import time budget.
+
+Runs kubediff under ``python -X importtime`` for a few scenarios, such as
+'kubediff --help' and a run over a tree without YAML files, and adds up the
+time spent importing modules. Fails if the median of a scenario's runs goes
+over its budget, or if it imports a module it shouldn't need, e.g. PyYAML
+for --help:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --scale 2  # on a slower machine
+"""
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from tabulate import tabulate
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Modules that only some code paths need.
+ON_DEMAND = [
+    "asyncio",
+    "difflib",
+    "http.server",
+    "multiprocessing",
+    "kubedifflib._async",
+    "kubedifflib._client",
+    "kubedifflib._images",
+    "kubedifflib._metrics",
+    "kubedifflib._orphans",
+    "kubedifflib._snapshot",
+    "kubedifflib._watch",
+]
+
+# (name, kubediff arguments, budget in milliseconds, modules not to import).
+# '{empty}' is replaced by a directory without YAML files. Budgets leave
+# about a third of headroom over the scenarios' medians on a typical laptop.
+SCENARIOS = [
+    ("help", ["--help"], 60, ON_DEMAND + ["yaml", "attr", "future", "kubedifflib._diff", "kubedifflib._kube"]),
+    ("empty tree", ["--no-cache", "{empty}"], 120, ON_DEMAND + ["yaml"]),
+]
+
+
+def import_times(arguments):
+    """Run kubediff with 'arguments', and return the microseconds spent importing each module."""
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    process = subprocess.Popen([sys.executable, "-X", "importtime", os.path.join(ROOT, "kubediff")] + arguments,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+    _, stderr = process.communicate()
+    times = {}
+    for line in stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # the header
+        times[fields[2].strip()] = int(fields[0])
+    return times
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2]
+
+
+def run_scenarios(runs, scale, empty):
+    """Run each scenario 'runs' times.
+
+    :return: (rows, failures) for a table of results, and the reasons for
+        failing, if any.
+    """
+    rows, failures = [], []
+    for (name, arguments, budget, forbidden) in SCENARIOS:
+        arguments = [argument.format(empty=empty) for argument in arguments]
+        results = [import_times(arguments) for _ in range(runs)]
+        total = median(sum(times.values()) for times in results) / 1000.0
+        budget = budget * scale
+        imported = sorted(set(module for module in forbidden for times in results
+                              if module in times or any(m.startswith(module + ".") for m in times)))
+        slowest = sorted(results[0].items(), key=lambda item: -item[1])[:3]
+        rows.append([name, total, budget, "over" if total > budget else "ok",
+                     ", ".join("%s %.1f" % (module, t / 1000.0) for (module, t) in slowest)])
+        if total > budget:
+            failures.append("%s: imports took %.1f ms, over the budget of %.1f ms" % (name, total, budget))
+        if imported:
+            failures.append("%s: imported %s" % (name, ", ".join(imported)))
+    return rows, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5,
+                        help="runs of each scenario, of which the median is taken")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply the budgets by this, e.g. for a slower machine")
+    options = parser.parse_args()
+
+    empty = tempfile.mkdtemp(prefix="kubediff-startup-")
+    try:
+        rows, failures = run_scenarios(options.runs, options.scale, empty)
+    finally:
+        shutil.rmtree(empty)
+
+    print(tabulate(rows, headers=["Scenario", "Imports (ms)", "Budget (ms)", "", "Slowest imports (ms, self)"],
+                   floatfmt=".1f"))
+    for failure in failures:
+        print("FAIL: %s" % (failure,), file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
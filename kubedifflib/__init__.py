@@ -1,21 +1,77 @@
 """Routines for comparing Kubernetes deployments and config."""
 
-from ._diff import (
-    check_files,
-    JSONPrinter,
-    QuietTextPrinter,
-    StdoutPrinter
-)
-from ._images import (
-    get_differing_images,
-    load_config,
-)
-
-__all__ = [
-    check_files,
-    JSONPrinter,
-    QuietTextPrinter,
-    StdoutPrinter,
-    load_config,
-    get_differing_images,
-]
+import sys
+from importlib import import_module
+
+# Where each public name is defined. Modules are only imported when one of
+# their names is first used, so that e.g. 'kubediff --help' doesn't load
+# YAML, the watch server or asyncio.
+_EXPORTS = {
+    "check_contexts": "._diff",
+    "check_files": "._diff",
+    "expand_contexts": "._diff",
+    "in_shard": "._diff",
+    "JSONPrinter": "._diff",
+    "load_tolerations": "._diff",
+    "merge_json_reports": "._diff",
+    "NDJSONPrinter": "._diff",
+    "QuietTextPrinter": "._diff",
+    "register_toleration": "._diff",
+    "set_text_diff_limits": "._diff",
+    "StdoutPrinter": "._diff",
+    "default_cache_dir": "._cache",
+    "ParseCache": "._cache",
+    "ResultCache": "._cache",
+    "LabelSelector": "._scope",
+    "Scope": "._scope",
+    "DEFAULT_ORPHAN_IGNORES": "._orphans",
+    "find_orphans": "._orphans",
+    "SnapshotError": "._snapshot",
+    "SnapshotFetcher": "._snapshot",
+    "take_snapshot": "._snapshot",
+    "LATENCY_BUCKETS": "._metrics",
+    "Metrics": "._metrics",
+    "format_timings": "._timings",
+    "Timings": "._timings",
+    "make_watcher": "._watch",
+    "serve_report": "._watch",
+    "Watcher": "._watch",
+    "compare_image_indexes": "._images",
+    "environment_names": "._images",
+    "get_differing_images": "._images",
+    "image_matrix": "._images",
+    "index_images": "._images",
+    "load_config": "._images",
+}
+
+if sys.version_info >= (3, 5):
+    # Coroutines are a syntax error on older Pythons.
+    _EXPORTS.update({
+        "AsyncKubectlFetcher": "._async",
+        "check_files_async": "._async",
+        "check_object_async": "._async",
+        "make_async_fetcher": "._async",
+        "ThreadedFetcher": "._async",
+    })
+
+__all__ = sorted(_EXPORTS)
+
+
+def _load(name):
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _EXPORTS:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+        return _load(name)
+
+    def __dir__():
+        return sorted(set(globals()) | set(_EXPORTS))
+else:
+    # Module __getattr__ is only called from Python 3.7 on.
+    for _name in _EXPORTS:
+        _load(_name)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""An asyncio API for checking manifests, for embedding kubediff in services.
+
+Only importable on Python 3.5 and later.
+"""
+
+import asyncio
+import collections
+import inspect
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from ._diff import (
+    ERROR,
+    Difference,
+    diff,
+    in_shard,
+    iter_file_objects,
+    iter_yaml_files,
+    make_fetcher,
+    open_parse_cache,
+)
+from ._kube import _kubectl_args, fetch_errors, load_yaml
+from ._scope import in_scope
+
+
+class AsyncKubectlFetcher(object):
+    """Fetch running objects with kubectl, run as asyncio subprocesses.
+
+    Fails exactly as ``KubectlFetcher`` does. A kubectl that is still
+    running when its fetch is cancelled, or times out, is killed.
+    """
+
+    def __init__(self, kubeconfig=None, context=None):
+        self.kubeconfig = kubeconfig
+        self.context = context
+
+    async def get(self, kube_obj):
+        """Return the running data for 'kube_obj'.
+
+        :raise subprocess.CalledProcessError: If the object can't be fetched.
+        """
+        command = ["kubectl", "get"] + _kubectl_args(kube_obj.namespace, self.kubeconfig, self.context) + [
+            kube_obj.kind, kube_obj.name]
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            output, _ = await process.communicate()
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                # Reap it while the loop still runs, so that its pipes are closed.
+                await process.wait()
+            raise
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command, output)
+        return load_yaml(output)
+
+
+class ThreadedFetcher(object):
+    """Run the calls of a blocking fetcher on threads, off the event loop.
+
+    :param executor: Where calls are run; the loop's default executor if None.
+    """
+
+    def __init__(self, fetcher, executor=None):
+        self.fetcher = fetcher
+        self.executor = executor
+
+    async def get(self, kube_obj):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.fetcher.get, kube_obj)
+
+
+def make_async_fetcher(config, executor=None):
+    """Return an async fetcher for what 'config' asks for.
+
+    Plain kubectl fetches run as asyncio subprocesses. Other backends, and
+    batched fetches, run the blocking fetcher on 'executor'.
+    """
+    if config.get("backend", "kubectl") == "kubectl" and not config.get("batch") and not config.get("snapshot"):
+        return AsyncKubectlFetcher(config["kubeconfig"], config["context"])
+    return ThreadedFetcher(make_fetcher(config), executor)
+
+
+async def check_object_async(fetcher, kube_obj, timeout=None):
+    """Compare 'kube_obj' to its running state, like ``check_object``.
+
+    :param fetcher: An async fetcher, e.g. from ``make_async_fetcher``.
+    :param float timeout: Seconds to wait for the running state, or None to
+        wait as long as it takes. A timeout is reported as an error.
+    :return: A list of ``Difference``s.
+    """
+    try:
+        running = await asyncio.wait_for(fetcher.get(kube_obj), timeout)
+    except fetch_errors as e:
+        return [Difference(ERROR, None, e.output.decode('utf-8'))]
+    except asyncio.TimeoutError:
+        return [Difference(ERROR, None, "Timed out fetching %s '%s' after %s seconds\n" % (
+            kube_obj.kind, kube_obj.namespaced_name, timeout))]
+    return list(diff((), kube_obj.data, running))
+
+
+async def _call(method, *args):
+    """Call a printer method, which may or may not be a coroutine function."""
+    result = method(*args)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def check_files_async(paths, printer, config, timeout=None):
+    """Check all files in 'paths' for differences to a Kubernetes cluster.
+
+    The asyncio counterpart of ``check_files``, reporting the same
+    differences in the same order. Files are parsed on a thread, one at a
+    time, and at most ``config["jobs"]`` objects are fetched at once.
+    Cancelling the returned coroutine cancels the fetches in flight, and
+    only ends once their kubectl processes have been killed and reaped.
+
+    :param printer: Where differences are reported to. Its 'add', 'diff'
+        and 'finish' methods may be coroutine functions, or plain functions
+        as for ``check_files``.
+    :param dict config: As for ``check_files``; timings and the result
+        cache aren't supported.
+    :param float timeout: Seconds to wait for each object, as for
+        ``check_object_async``.
+    :return: True if there are differences, False otherwise.
+    """
+    loop = asyncio.get_event_loop()
+    jobs = config.get("jobs", 1)
+    executor = ThreadPoolExecutor(jobs + 1)
+    cache = open_parse_cache(config)
+    fetcher = make_async_fetcher(config, executor)
+
+    def parse(path):
+        if cache is None:
+            return list(iter_file_objects(path, config))
+        return cache.load(path, config["namespace"], lambda: iter_file_objects(path, config))
+
+    pending = collections.deque()
+    differences = 0
+
+    async def report_next():
+        path, kube_obj, task = pending[0]
+        found = await task
+        pending.popleft()
+        await _call(printer.add, path, kube_obj)
+        for difference in found:
+            await _call(printer.diff, path, difference)
+        return len(found)
+
+    try:
+        for path in await loop.run_in_executor(executor, lambda: list(iter_yaml_files(paths, config.get("scope")))):
+            for kube_obj in await loop.run_in_executor(executor, parse, path):
+                if not (in_shard(kube_obj, config.get("shard")) and in_scope(kube_obj, config.get("scope"))):
+                    continue
+                pending.append((path, kube_obj, loop.create_task(check_object_async(fetcher, kube_obj, timeout))))
+                if len(pending) >= jobs:
+                    differences += await report_next()
+        while pending:
+            differences += await report_next()
+        await _call(printer.finish)
+    finally:
+        tasks = [task for (_, _, task) in pending]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            # Let the fetches kill and reap their kubectl processes before
+            # returning, while the loop is sure to still be running.
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if cache is not None:
+            executor.submit(cache.prune)
+        executor.shutdown(wait=False)
+    return bool(differences)
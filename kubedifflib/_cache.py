@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from builtins import object
+
+
+# Bump when what is stored in cache entries changes.
+CACHE_FORMAT = 2
+
+
+def default_cache_dir():
+    """Return where kubediff keeps its caches by default."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "kubediff")
+
+
+def _write_atomically(path, data):
+    directory = os.path.dirname(path)
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            stream.write(data)
+        getattr(os, "replace", os.rename)(temporary, path)
+    except Exception:
+        os.remove(temporary)
+        raise
+
+
+# Entries are stored as JSON, and never pickled: anyone who can write to
+# the cache directory, which may be shared, mustn't be able to run code as
+# whoever reads it.
+def _read_entry(entry_path):
+    try:
+        with open(entry_path, 'rb') as stream:
+            entry = json.loads(stream.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+    return entry if isinstance(entry, dict) else None
+
+
+def _write_entry(entry_path, entry):
+    """Write 'entry' if it comes back the same from JSON.
+
+    Values that don't, e.g. the dates or non-string keys YAML allows, would
+    make cached results differ from fresh ones, so they aren't cached.
+    """
+    try:
+        encoded = json.dumps(entry, separators=(',', ':'))
+    except (TypeError, ValueError) as e:
+        logging.debug("Not writing cache entry %s: %s", entry_path, e)
+        return
+    if json.loads(encoded) != entry:
+        logging.debug("Not writing cache entry %s: it doesn't survive JSON", entry_path)
+        return
+    try:
+        _write_atomically(entry_path, encoded.encode('utf-8'))
+    except (IOError, OSError) as e:
+        logging.debug("Failed to write cache entry %s: %s", entry_path, e)
+
+
+def _touch(entry_path):
+    try:
+        os.utime(entry_path, None)
+    except OSError:
+        pass
+
+
+def _prune(directory, max_entries):
+    """Remove the least recently used entries in 'directory' beyond 'max_entries'."""
+    entries = []
+    for name in os.listdir(directory):
+        entry_path = os.path.join(directory, name)
+        try:
+            entries.append((os.stat(entry_path).st_mtime, entry_path))
+        except OSError:
+            continue
+    entries.sort(reverse=True)
+    for (_, entry_path) in entries[max_entries:]:
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+
+
+class _LogCounter(logging.Handler):
+    """Counts the records logged by the current thread."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.thread = threading.current_thread().ident
+        self.count = 0
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.count += 1
+
+
+class ParseCache(object):
+    """An on-disk cache of the ``KubeObject``s parsed from manifest files.
+
+    Entries are keyed by the file's path and the namespace objects default
+    to, and hold the file's content hash. A file whose size and mtime
+    haven't changed since it was cached isn't read at all; one whose stat
+    changed is hashed, and parsed again only if its content changed.
+
+    Files that log errors while being parsed aren't cached, so that the
+    errors are logged on every run. At most 'max_entries' entries are kept;
+    ``prune`` removes the ones used least recently.
+    """
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = os.path.join(directory, "manifests")
+        self.max_entries = max_entries
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _entry_path(self, path, namespace):
+        key = "%d\0%s\0%s" % (CACHE_FORMAT, os.path.abspath(path), namespace)
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def load(self, path, namespace, parse):
+        """Return the objects in file 'path', parsing it only if it changed.
+
+        :param str namespace: The namespace objects default to.
+        :param parse: A function returning an iterable of the objects in the
+            file, called if it isn't cached.
+        :return: A list of ``KubeObject``s.
+        """
+        entry_path = self._entry_path(path, namespace)
+        stat = os.stat(path)
+        stamp = [stat.st_ino, stat.st_size, getattr(stat, "st_mtime_ns", stat.st_mtime)]
+        entry = _read_entry(entry_path)
+        cached = None if entry is None else _decode_objects(entry.get("objects"))
+        # Like git, don't trust an mtime too close to when the entry was
+        # written: the file could have changed again within the same tick.
+        if cached is not None and entry.get("stamp") == stamp and stat.st_mtime < entry.get("written", 0) - 1:
+            _touch(entry_path)
+            return cached
+
+        with open(path, 'rb') as stream:
+            digest = hashlib.sha256(stream.read()).hexdigest()
+        if cached is not None and entry.get("digest") == digest:
+            objects = cached
+        else:
+            counter = _LogCounter()
+            logging.getLogger().addHandler(counter)
+            try:
+                objects = list(parse())
+            finally:
+                logging.getLogger().removeHandler(counter)
+            if counter.count:
+                return objects
+        _write_entry(entry_path, {
+            "stamp": stamp,
+            "digest": digest,
+            "written": time.time(),
+            "objects": [[o.namespace, o.kind, o.name, o.data] for o in objects],
+        })
+        return objects
+
+    def prune(self):
+        """Remove the least recently used entries beyond 'max_entries'."""
+        _prune(self.directory, self.max_entries)
+
+
+def _decode_objects(objects):
+    """Return the ``KubeObject``s of a parse cache entry, or None if it is malformed."""
+    from ._kube import KubeObject
+    try:
+        return [KubeObject(namespace, kind, name, data) for (namespace, kind, name, data) in objects]
+    except (TypeError, ValueError):
+        return None
+
+
+def _decode_differences(differences):
+    """Return the ``Difference``s of a result cache entry, or None if it is malformed."""
+    from ._diff import Difference
+    try:
+        return [Difference(op, None if path is None else tuple(path), want, have)
+                for (op, path, want, have) in differences]
+    except (TypeError, ValueError):
+        return None
+
+
+def _manifest_digest(data, settings):
+    encoded = json.dumps([data, settings], sort_keys=True, default=repr)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _cacheable(kube_obj):
+    return not kube_obj.kind.startswith("Secret.")
+
+
+class ResultCache(object):
+    """An on-disk cache of the differences found for each object.
+
+    Entries are keyed by the cluster and the object's kind, namespace and
+    name, and hold the running object's resourceVersion, a digest of its
+    manifest and of the diff 'settings', and the differences found. An
+    entry is only used while both still match: the running version is
+    read from one metadata-only list per (kind, namespace), through the
+    fetcher's ``versions``, so that unchanged objects are neither fetched
+    nor diffed again.
+
+    Objects that couldn't be fetched aren't cached, and neither are ones
+    without a resourceVersion, or Secrets: their differences hold the
+    running secret values, which reports mask. At most 'max_entries' entries are kept;
+    ``prune`` removes the ones used least recently.
+
+    :param str cluster: Identifies the cluster the differences are to.
+    :param str settings: Identifies everything besides the two objects that
+        the differences depend on, e.g. the tolerations.
+    """
+
+    def __init__(self, directory, cluster, settings, max_entries=10000):
+        self.directory = os.path.join(directory, "results")
+        self.cluster = cluster
+        self.settings = settings
+        self.max_entries = max_entries
+        self._versions = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _entry_path(self, kube_obj):
+        key = "%d\0%s\0%s\0%s\0%s" % (CACHE_FORMAT, self.cluster, kube_obj.kind, kube_obj.namespace, kube_obj.name)
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _running_versions(self, fetcher, kind, namespace):
+        """Return a dict mapping names to resourceVersions, listed once per run."""
+        # Not imported with the module, which the CLI needs before parsing
+        # its arguments, only for the default cache directory.
+        from ._kube import fetch_errors
+        key = (kind, namespace)
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._versions:
+                try:
+                    self._versions[key] = fetcher.versions(kind, namespace)
+                except fetch_errors as e:
+                    output = getattr(e, "stderr", None) or e.output or b""
+                    logging.debug("Failed to list versions of %s in %s: %s",
+                                  kind, namespace, output.decode('utf-8').strip())
+                    self._versions[key] = {}
+        return self._versions[key]
+
+    def lookup(self, fetcher, kube_obj):
+        """Return the differences cached for 'kube_obj', if they are still current.
+
+        :param fetcher: Where running versions are listed from.
+        :return: A list of ``Difference``s, or None.
+        """
+        if not _cacheable(kube_obj):
+            return None
+        version = self._running_versions(fetcher, kube_obj.kind, kube_obj.namespace).get(kube_obj.name)
+        if version is None:
+            return None
+        entry_path = self._entry_path(kube_obj)
+        entry = _read_entry(entry_path)
+        if entry is None or entry.get("version") != version:
+            return None
+        if entry.get("manifest") != _manifest_digest(kube_obj.data, self.settings):
+            return None
+        differences = _decode_differences(entry.get("differences"))
+        if differences is not None:
+            _touch(entry_path)
+        return differences
+
+    def store(self, kube_obj, running, differences):
+        """Cache the 'differences' found between 'kube_obj' and its 'running' data."""
+        version = (running.get("metadata") or {}).get("resourceVersion")
+        if version is None or not _cacheable(kube_obj):
+            return
+        _write_entry(self._entry_path(kube_obj), {
+            "version": version,
+            "manifest": _manifest_digest(kube_obj.data, self.settings),
+            "differences": [[d.op, None if d.path is None else list(d.path), d.want, d.have] for d in differences],
+        })
+
+    def prune(self):
+        """Remove the least recently used entries beyond 'max_entries'."""
+        _prune(self.directory, self.max_entries)
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import base64
+import json
+import os
+import socket
+import ssl
+import tempfile
+import threading
+from future.moves.http import client as http_client
+from future.moves.queue import Empty, Full, LifoQueue
+from future.moves.urllib.parse import quote, urlparse
+from builtins import object
+
+from ._kube import FetchError, load_yaml
+
+
+class ConfigError(Exception):
+    """Raised when a kubeconfig can't be used by this client."""
+
+
+def _kubeconfig_paths(kubeconfig=None):
+    if kubeconfig is not None:
+        return [kubeconfig]
+    env = os.environ.get("KUBECONFIG")
+    if env:
+        return [path for path in env.split(os.pathsep) if path]
+    return [os.path.join(os.path.expanduser("~"), ".kube", "config")]
+
+
+def _merge_kubeconfigs(paths):
+    """Merge kubeconfig files the way kubectl does.
+
+    The first file to set a value wins, and named entries (contexts, clusters
+    and users) are taken from the first file that defines them. Missing files
+    are skipped, unless none of them exist.
+
+    :return: (data, directories) where 'directories' maps each named entry,
+        as ('clusters', name), to the directory its relative paths are
+        relative to.
+    """
+    merged, directories, found = {}, {}, False
+    for path in paths:
+        if not os.path.exists(path) and len(paths) > 1:
+            continue
+        found = True
+        with open(path, 'r') as stream:
+            data = load_yaml(stream) or {}
+        directory = os.path.dirname(os.path.abspath(path))
+        if data.get("current-context"):
+            merged.setdefault("current-context", data["current-context"])
+        for section in ("contexts", "clusters", "users"):
+            entries = merged.setdefault(section, [])
+            names = set(entry.get("name") for entry in entries)
+            for entry in data.get(section) or []:
+                if entry.get("name") not in names:
+                    entries.append(entry)
+                    names.add(entry.get("name"))
+                    directories[(section, entry.get("name"))] = directory
+    if not found:
+        raise ConfigError("none of the kubeconfig files exist: %s" % os.pathsep.join(paths))
+    return merged, directories
+
+
+def _named(entries, name, what):
+    for entry in entries or []:
+        if entry.get("name") == name:
+            return entry.get(what) or {}
+    raise ConfigError("%s %r not found in kubeconfig" % (what, name))
+
+
+def load_kubeconfig(kubeconfig=None, context=None):
+    """Return the cluster and user settings for a kubeconfig context.
+
+    :param str kubeconfig: Path to a kubeconfig file. Defaults to what kubectl
+        would use, merging all the files in ``$KUBECONFIG``.
+    :param str context: The context to use. Defaults to the current context.
+    :return: (cluster, user, directories) where 'cluster' and 'user' are
+        dicts from the kubeconfig, and 'directories' are what relative paths
+        in each of them are relative to.
+    """
+    data, directories = _merge_kubeconfigs(_kubeconfig_paths(kubeconfig))
+    if context is None:
+        context = data.get("current-context")
+    if not context:
+        raise ConfigError("no context given and no current-context in kubeconfig")
+    settings = _named(data.get("contexts"), context, "context")
+    cluster = _named(data.get("clusters"), settings.get("cluster"), "cluster")
+    user = {}
+    if settings.get("user"):
+        user = _named(data.get("users"), settings["user"], "user")
+    return cluster, user, (directories.get(("clusters", settings.get("cluster")), ""),
+                           directories.get(("users", settings.get("user")), ""))
+
+
+def list_contexts(kubeconfig=None):
+    """Return the names of the contexts in a kubeconfig, as kubectl would see them."""
+    data, _ = _merge_kubeconfigs(_kubeconfig_paths(kubeconfig))
+    return [entry.get("name") for entry in data.get("contexts") or [] if entry.get("name")]
+
+
+def _data_file(data):
+    """Write base64 'data' to a temporary file and return its path."""
+    fd, path = tempfile.mkstemp(prefix="kubediff-")
+    with os.fdopen(fd, 'wb') as stream:
+        stream.write(base64.b64decode(data))
+    return path
+
+
+def _ssl_context(cluster, user, cluster_directory, user_directory):
+    if cluster.get("insecure-skip-tls-verify"):
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif cluster.get("certificate-authority-data"):
+        cadata = base64.b64decode(cluster["certificate-authority-data"]).decode('ascii')
+        context = ssl.create_default_context(cadata=cadata)
+    elif cluster.get("certificate-authority"):
+        context = ssl.create_default_context(cafile=os.path.join(cluster_directory, cluster["certificate-authority"]))
+    else:
+        context = ssl.create_default_context()
+
+    cert, key = user.get("client-certificate"), user.get("client-key")
+    temporary = []
+    if user.get("client-certificate-data"):
+        cert = _data_file(user["client-certificate-data"])
+        temporary.append(cert)
+    if user.get("client-key-data"):
+        key = _data_file(user["client-key-data"])
+        temporary.append(key)
+    try:
+        if cert:
+            context.load_cert_chain(os.path.join(user_directory, cert), key and os.path.join(user_directory, key))
+    finally:
+        for path in temporary:
+            os.remove(path)
+    return context
+
+
+def _auth_headers(user, directory):
+    if "exec" in user or "auth-provider" in user:
+        raise ConfigError("kubeconfig credential plugins are not supported; use the kubectl backend")
+    token = user.get("token")
+    if not token and user.get("tokenFile"):
+        with open(os.path.join(directory, user["tokenFile"]), 'r') as stream:
+            token = stream.read().strip()
+    if token:
+        return {"Authorization": "Bearer %s" % token}
+    if user.get("username"):
+        credentials = "%s:%s" % (user["username"], user.get("password", ""))
+        return {"Authorization": "Basic %s" % base64.b64encode(credentials.encode('utf-8')).decode('ascii')}
+    return {}
+
+
+class ConnectionPool(object):
+    """A pool of persistent HTTP connections to one server.
+
+    Connections are taken from the pool for a request and put back once the
+    response has been read, so that they are kept alive between requests.
+    """
+
+    def __init__(self, server, ssl_context=None, maxsize=10, timeout=60):
+        url = urlparse(server)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.prefix = url.path.rstrip("/")
+        self.ssl_context = ssl_context
+        self.timeout = timeout
+        self._pool = LifoQueue(maxsize)
+
+    def connect(self):
+        """Return a new connection to the server, outside the pool."""
+        if self.scheme == "https":
+            return http_client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.ssl_context)
+        return http_client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _send(self, connection, method, path, headers):
+        """Make a request on 'connection', and put it back in the pool once done."""
+        done = False
+        try:
+            connection.request(method, self.prefix + path, headers=headers)
+            response = connection.getresponse()
+            result = response.status, response.read()
+            done = True
+            return result
+        finally:
+            if done:
+                try:
+                    self._pool.put_nowait(connection)
+                except Full:
+                    connection.close()
+            else:
+                connection.close()
+
+    def request(self, method, path, headers=None):
+        """Make a request, returning (status, body).
+
+        :raise FetchError: If the server can't be reached.
+        """
+        try:
+            try:
+                connection = self._pool.get_nowait()
+            except Empty:
+                return self._send(self.connect(), method, path, headers or {})
+            try:
+                return self._send(connection, method, path, headers or {})
+            except http_client.BadStatusLine:
+                # The server closed an idle connection; retry once on a
+                # fresh one.
+                return self._send(self.connect(), method, path, headers or {})
+        except (http_client.HTTPException, socket.error) as e:
+            raise FetchError(("Unable to connect to the server: %s\n" % (e,)).encode('utf-8'))
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except Empty:
+                return
+
+
+def _error_output(status, body):
+    """Return what kubectl prints for a failed API request."""
+    try:
+        details = json.loads(body.decode('utf-8'))
+        message, reason = details["message"], details.get("reason")
+    except (ValueError, KeyError, TypeError):
+        message, reason = body.decode('utf-8', 'replace').strip() or "HTTP %d" % status, None
+    if reason:
+        return ("Error from server (%s): %s\n" % (reason, message)).encode('utf-8')
+    return ("Error from server: %s\n" % message).encode('utf-8')
+
+
+class KubeClient(object):
+    """Read objects from the Kubernetes API.
+
+    Kinds are given as in ``KubeObject.kind``, e.g. "Deployment.v1.apps", and
+    mapped to REST paths through API discovery, which is done once per group
+    and version.
+    """
+
+    def __init__(self, pool, headers=None):
+        self.pool = pool
+        self.headers = dict(headers or {})
+        self.headers.setdefault("Accept", "application/json")
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_kubeconfig(cls, kubeconfig=None, context=None, maxsize=10):
+        """Make a client for a kubeconfig context, as kubectl would."""
+        cluster, user, (cluster_directory, user_directory) = load_kubeconfig(kubeconfig, context)
+        server = cluster.get("server")
+        if not server:
+            raise ConfigError("cluster has no server in kubeconfig")
+        ssl_context = None
+        if server.startswith("https:"):
+            ssl_context = _ssl_context(cluster, user, cluster_directory, user_directory)
+        return cls(ConnectionPool(server, ssl_context, maxsize), _auth_headers(user, user_directory))
+
+    def _get(self, path, headers=None):
+        status, body = self.pool.request("GET", path, headers or self.headers)
+        if status != 200:
+            raise FetchError(_error_output(status, body))
+        return json.loads(body.decode('utf-8'))
+
+    def _discover(self, group, version):
+        """Return a dict mapping kinds to (resource, namespaced) for a group version."""
+        key = (group, version)
+        with self._lock:
+            if key not in self._resources:
+                prefix = "/apis/%s/%s" % (group, version) if group else "/api/%s" % version
+                status, body = self.pool.request("GET", prefix, self.headers)
+                if status == 404:
+                    # The group version isn't served; remember that.
+                    resources = []
+                elif status == 200:
+                    resources = json.loads(body.decode('utf-8'))["resources"]
+                else:
+                    raise FetchError(_error_output(status, body))
+                self._resources[key] = dict(
+                    (resource["kind"], (prefix + "/" + resource["name"], resource.get("namespaced", False)))
+                    for resource in resources if "/" not in resource["name"])
+            return self._resources[key]
+
+    def resource_path(self, kind, namespace, name=None):
+        """Return the REST path for objects of 'kind', or for one of them.
+
+        :raise FetchError: If the server doesn't serve 'kind'.
+        """
+        short_kind, version, group = kind.split(".", 2)
+        try:
+            path, namespaced = self._discover(group, version)[short_kind]
+        except KeyError:
+            raise FetchError(('error: the server doesn\'t have a resource type "%s"\n' % kind).encode('utf-8'))
+        if namespaced:
+            collection, resource = path.rsplit("/", 1)
+            path = "%s/namespaces/%s/%s" % (collection, quote(namespace, safe=""), resource)
+        if name is not None:
+            path = "%s/%s" % (path, quote(name, safe=""))
+        return path
+
+    def get(self, kind, namespace, name):
+        """Return the data for one object."""
+        return self._get(self.resource_path(kind, namespace, name))
+
+    def list(self, kind, namespace):
+        """Return a dict mapping names to data for all objects of 'kind' in 'namespace'."""
+        return self.list_versioned(kind, namespace)[0]
+
+    def list_versioned(self, kind, namespace):
+        """Like ``list``, but also return the resourceVersion of the list.
+
+        :return: (items, resource_version)
+        """
+        data = self._get(self.resource_path(kind, namespace))
+        # List items don't carry their kind and version; fill them in as kubectl does.
+        item_kind = data.get("kind", "")
+        if item_kind.endswith("List"):
+            item_kind = item_kind[:-len("List")]
+        items = {}
+        for item in data.get("items") or []:
+            item.setdefault("apiVersion", data.get("apiVersion"))
+            item.setdefault("kind", item_kind)
+            items[item["metadata"]["name"]] = item
+        return items, (data.get("metadata") or {}).get("resourceVersion")
+
+    def list_versions(self, kind, namespace):
+        """Return a dict mapping names to resourceVersions for all objects of 'kind' in 'namespace'.
+
+        Only the objects' metadata is asked for, where the server supports it.
+        Objects without a resourceVersion map to None.
+        """
+        headers = dict(self.headers, Accept=(
+            "application/json;as=PartialObjectMetadataList;v=v1;g=meta.k8s.io,application/json"))
+        data = self._get(self.resource_path(kind, namespace), headers)
+        versions = {}
+        for item in data.get("items") or []:
+            metadata = item.get("metadata") or {}
+            versions[metadata["name"]] = metadata.get("resourceVersion")
+        return versions
+
+    def watch(self, kind, namespace, resource_version, timeout=300):
+        """Yield (type, object) for changes to objects of 'kind' in 'namespace'.
+
+        Watches use a connection of their own, outside the pool, which is
+        closed when the server ends the watch after 'timeout' seconds.
+        """
+        path = "%s?watch=1&resourceVersion=%s&timeoutSeconds=%d" % (
+            self.resource_path(kind, namespace), quote(resource_version or "", safe=""), timeout)
+        connection = self.pool.connect()
+        connection.timeout = timeout + 30
+        try:
+            connection.request("GET", self.pool.prefix + path, headers=self.headers)
+            response = connection.getresponse()
+            if response.status != 200:
+                raise FetchError(_error_output(response.status, response.read()))
+            while True:
+                line = response.readline()
+                if not line:
+                    return
+                if line.strip():
+                    event = json.loads(line.decode('utf-8'))
+                    yield event["type"], event["object"]
+        except (http_client.HTTPException, socket.error) as e:
+            raise FetchError(("Unable to connect to the server: %s\n" % (e,)).encode('utf-8'))
+        finally:
+            connection.close()
+
+    def close(self):
+        self.pool.close()
+
+
+class APIFetcher(object):
+    """Fetch running objects through a ``KubeClient``."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, kube_obj):
+        """Return the running data for 'kube_obj'.
+
+        :raise FetchError: If the object can't be fetched.
+        """
+        return self.client.get(kube_obj.kind, kube_obj.namespace, kube_obj.name)
+
+    def list(self, kind, namespace):
+        """Return a dict mapping names to data for all objects of 'kind' in 'namespace'."""
+        return self.client.list(kind, namespace)
+
+    def versions(self, kind, namespace):
+        """Return a dict mapping names to resourceVersions for all objects of 'kind' in 'namespace'."""
+        return self.client.list_versions(kind, namespace)
@@ -2,19 +2,29 @@
 
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
+from ._cache import ParseCache, ResultCache
+from ._timings import NO_TIMINGS
 from ._kube import (
+    BatchFetcher,
     KubeObject,
+    KubectlFetcher,
+    fetch_errors,
     iter_files,
+    load_all_yaml,
+    load_yaml,
+    map_files,
 )
-import yaml
+import logging
 import sys
-import subprocess
 import os
+import hashlib
+import itertools
 import operator
+import re
 import numbers
 import json
-import difflib
 import collections
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from fnmatch import fnmatchcase
 from future.utils import listitems, viewitems
@@ -30,23 +40,76 @@ def mask(x):
         return x
 
 
+#: Operations of ``Difference``s: what kind of difference each one is.
+MISSING = "missing"
+MISSING_ELEMENT = "missing-element"
+NOT_EQUAL = "not-equal"
+LENGTH = "length"
+TEXT_DIFF = "text-diff"
+ERROR = "error"
+
+
+def path_text(path):
+    """Render a path of keys, e.g. ('spec', 'replicas'), as ".spec.replicas"."""
+    return "".join(".%s" % (key,) for key in path)
+
+
 class Difference(object):
-    """An observed difference."""
+    """An observed difference.
+
+    Differences keep what was compared rather than text, which is only
+    rendered when a printer asks for it.
+
+    :param str op: One of MISSING, MISSING_ELEMENT, NOT_EQUAL, LENGTH,
+        TEXT_DIFF or ERROR.
+    :param tuple path: The keys leading from the object to the difference.
+        For MISSING and MISSING_ELEMENT, the last key is the missing key or
+        list index. None for ERROR, which is about the whole object.
+    :param want: The value in the config file; the message for ERROR.
+    :param have: The running value, if any. For LENGTH, 'want' and 'have'
+        are lengths.
+    """
+
+    __slots__ = ('op', 'path', 'want', 'have')
 
-    def __init__(self, message, path, *args):
-        self.message = message
+    def __init__(self, op, path, want=None, have=None):
+        self.op = op
         self.path = path
-        self.args = args
+        self.want = want
+        self.have = have
 
-    def to_text(self, kind=''):
-        if kind.startswith('Secret.') and len(self.args) == 2:
-            message = self.message % (mask(self.args[0]), mask(self.args[1]))
+    def __repr__(self):
+        return "Difference(%r, %r, %r, %r)" % (self.op, self.path, self.want, self.have)
 
-        else:
-            message = self.message % self.args
+    def path_text(self):
+        """Return where the difference is, e.g. ".spec.replicas", or None."""
+        if self.path is None:
+            return None
+        if self.op in (MISSING, MISSING_ELEMENT):
+            return path_text(self.path[:-1])
+        return path_text(self.path)
+
+    def message_text(self, kind=''):
+        """Return the message, without the path, masking secret values."""
+        if self.op == MISSING:
+            return "'%s' missing" % (self.path[-1],)
+        if self.op == MISSING_ELEMENT:
+            return "'element [%d]' missing" % (self.path[-1],)
+        if self.op == TEXT_DIFF:
+            return "Diff:\n%s" % (unified_diff(self.path_text(), self.want, self.have),)
+        if self.op == ERROR:
+            return self.want
+        if self.op == LENGTH:
+            return "Unequal lengths: %d != %d" % (self.want, self.have)
+        if kind.startswith('Secret.'):
+            return "'%s' != '%s'" % (mask(self.want), mask(self.have))
+        return "'%s' != '%s'" % (self.want, self.have)
+
+    def to_text(self, kind=''):
+        message = self.message_text(kind)
         if self.path is None:
             return message
-        return '%s: %s' % (self.path, message)
+        return '%s: %s' % (self.path_text(), message)
 
 
 def cpus_equal(a, b):
@@ -80,35 +143,396 @@ tolerations = {
 }
 
 
-def different_lengths(path, want, have):
-    return Difference("Unequal lengths: %d != %d", path, len(want), len(have))
+def always_equal(want, have):
+    """Tolerates any difference."""
+    return True
+
+
+# Checks that tolerations can be registered with by name, e.g. from a file.
+toleration_checks = {
+    "ignore": always_equal,
+    "cpu": cpus_equal,
+    "creation-timestamp": creation_timestamp_equal,
+}
+
+
+def register_toleration(pattern, check):
+    """Tolerate differences at paths matching 'pattern'.
+
+    :param str pattern: A glob pattern over paths like ".spec.replicas".
+    :param check: A function taking (want, have) that returns True if the
+        difference is tolerated, or the name of one in ``toleration_checks``.
+    """
+    if not callable(check):
+        try:
+            check = toleration_checks[check]
+        except KeyError:
+            raise ValueError("Unknown toleration check %r, expected one of: %s" % (
+                check, ", ".join(sorted(toleration_checks))))
+    tolerations[pattern] = check
+
+
+def load_tolerations(path):
+    """Register the tolerations in YAML file 'path'.
+
+    The file maps path patterns to names of checks in ``toleration_checks``.
+    """
+    with open(path, 'r') as stream:
+        data = load_yaml(stream) or {}
+    if not isinstance(data, dict):
+        raise ValueError("%s: expected a mapping of path patterns to checks" % (path,))
+    for (pattern, check) in viewitems(data):
+        register_toleration(pattern, check)
+
+
+_STAR = object()
+
+
+def _compile_glob(pattern):
+    """Split a glob pattern into tokens that each match one character, or '*'.
+
+    Character tokens are functions; the syntax is that of ``fnmatch``.
+    """
+    tokens = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        j = i + 1
+        if c == '*':
+            if not tokens or tokens[-1] is not _STAR:
+                tokens.append(_STAR)
+            i = j
+            continue
+        if c == '[':
+            if j < n and pattern[j] == '!':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j < n:
+                j += 1
+            else:
+                j = i + 1  # no closing bracket: a literal '['
+        tokens.append(partial(fnmatchcase, pat=pattern[i:j]))
+        i = j
+    return tokens
+
+
+class _MatchState(object):
+    """Where a path is in each toleration pattern, after some keys.
+
+    Children are built lazily and memoized, so walking down a key that has
+    been seen before is a single dict lookup.
+    """
+
+    _max_children = 10000
+
+    __slots__ = ('matcher', 'positions', '_children', 'checks')
+
+    def __init__(self, matcher, positions):
+        self.matcher = matcher
+        self.positions = positions
+        self._children = {}
+        # The checks of patterns that match the path so far.
+        self.checks = [matcher.checks[p] for (p, pos) in positions if pos == len(matcher.patterns[p])]
+
+    def child(self, key):
+        """Return the state after appending '.key' to the path."""
+        try:
+            return self._children[key]
+        except KeyError:
+            pass
+        if self.positions:
+            state = self.matcher.step(self.positions, "." + "%s" % (key,))
+        else:
+            state = self  # no pattern can match any more
+        if len(self._children) < self._max_children:
+            self._children[key] = state
+        return state
+
+
+class TolerationMatcher(object):
+    """Compiled form of a toleration table.
+
+    Matches paths against all patterns at once, a key at a time, as ``diff``
+    walks down an object. States are shared between paths that are at the
+    same place in every pattern.
+
+    Also keeps whether list elements are equal under these tolerations, by
+    the fingerprints of the elements, for ``diff_lists``. Once it holds
+    'max_equalities' results they are dropped, so that long runs, e.g. with
+    --watch, keep memoizing the elements they see now.
+    """
+
+    max_equalities = 10000
+
+    def __init__(self, items):
+        self.items = items
+        self.patterns = [_compile_glob(pattern) for (pattern, _) in items]
+        self.checks = [check for (_, check) in items]
+        self._states = {}
+        self.equalities = {}
+        self.root = self._state(self._advance((p, 0) for p in range(len(items))))
+
+    def _advance(self, positions):
+        """Add the positions reached by letting a '*' match nothing."""
+        closed = set()
+        for (p, pos) in positions:
+            tokens = self.patterns[p]
+            while pos < len(tokens) and tokens[pos] is _STAR:
+                closed.add((p, pos))
+                pos += 1
+            closed.add((p, pos))
+        return frozenset(closed)
+
+    def _state(self, positions):
+        try:
+            return self._states[positions]
+        except KeyError:
+            state = self._states[positions] = _MatchState(self, positions)
+            return state
+
+    def step(self, positions, text):
+        """Return the state after matching 'text' from 'positions'."""
+        for c in text:
+            following = []
+            for (p, pos) in positions:
+                tokens = self.patterns[p]
+                if pos == len(tokens):
+                    continue
+                if tokens[pos] is _STAR:
+                    following.append((p, pos))
+                elif tokens[pos](c):
+                    following.append((p, pos + 1))
+            positions = self._advance(following)
+        return self._state(positions)
+
+    def state(self, path):
+        """Return the state for a whole path."""
+        return self.step(self.root.positions, path) if path else self.root
+
+
+_matcher = [None]
+
+
+def toleration_matcher():
+    """Return the compiled form of ``tolerations``, recompiling it if it changed."""
+    items = listitems(tolerations)
+    matcher = _matcher[0]
+    if matcher is None or matcher.items != items:
+        matcher = _matcher[0] = TolerationMatcher(items)
+    return matcher
+
+
+# Limits on the diffs of multi-line strings: strings longer than 'max_size'
+# characters are only compared by digest, and diffs show 'context' lines
+# around each change and stop after 'max_lines' lines.
+text_diff_limits = {
+    "max_size": 1 << 20,
+    "context": 3,
+    "max_lines": 500,
+}
+
+
+def set_text_diff_limits(max_size=None, context=None, max_lines=None):
+    """Change ``text_diff_limits``. Limits given as None are left as they are."""
+    for (name, value) in [("max_size", max_size), ("context", context), ("max_lines", max_lines)]:
+        if value is not None:
+            text_diff_limits[name] = value
+
+
+def _digest(text):
+    return "%d lines, sha256 %s" % (len(text.splitlines()), hashlib.sha256(text.encode('utf-8')).hexdigest()[:16])
+
+
+def _format_range(start, stop):
+    """Format lines [start, stop) as a unified diff hunk header does."""
+    length = stop - start
+    if length == 1:
+        return "%d" % (start + 1)
+    return "%d,%d" % (start + 1 if length else start, length)
+
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@$")
 
 
-missing_item = partial(Difference, "'%s' missing")
-not_equal = partial(Difference, "'%s' != '%s'")
+def _shift_hunks(lines, offset):
+    """Add 'offset' to the line numbers in unified diff hunk headers."""
+    for line in lines:
+        match = _HUNK_HEADER.match(line) if line.startswith("@@") else None
+        if match:
+            line = "@@ -%d%s +%d%s @@" % (int(match.group(1)) + offset, match.group(2) or "",
+                                          int(match.group(3)) + offset, match.group(4) or "")
+        yield line
 
 
-def diff_not_equal(path, want, have):
-    want_lines, have_lines = want.splitlines(), have.splitlines()
-    diff = "\n".join(difflib.unified_diff(want_lines, have_lines, fromfile=path, tofile="running", lineterm=""))
-    return Difference("Diff:\n%s", path, diff)
+def _paired_hunks(want_lines, have_lines, changed, offset, context):
+    """Yield unified diff hunks for lines paired by position.
 
+    :param changed: The positions at which 'want_lines' and 'have_lines',
+        which are as long as each other, differ.
+    """
+    groups = []
+    for i in changed:
+        # Changes no more than 2 * context lines apart share a hunk, as in difflib.
+        if groups and i - groups[-1][1] - 1 <= 2 * context:
+            groups[-1][1] = i
+        else:
+            groups.append([i, i])
+    for (first, last) in groups:
+        start, stop = max(first - context, 0), min(last + context + 1, len(want_lines))
+        lines = _format_range(start + offset, stop + offset)
+        yield "@@ -%s +%s @@" % (lines, lines)
+        i = start
+        while i < stop:
+            if want_lines[i] == have_lines[i]:
+                yield " " + want_lines[i]
+                i += 1
+                continue
+            j = i
+            while j < stop and want_lines[j] != have_lines[j]:
+                j += 1
+            for k in range(i, j):
+                yield "-" + want_lines[k]
+            for k in range(i, j):
+                yield "+" + have_lines[k]
+            i = j
+
+
+def _iter_unified_diff(path, want_lines, have_lines, context):
+    # Only the lines between the common prefix and suffix need diffing.
+    prefix = 0
+    for (want_line, have_line) in zip(want_lines, have_lines):
+        if want_line != have_line:
+            break
+        prefix += 1
+    suffix = 0
+    limit = min(len(want_lines), len(have_lines)) - prefix
+    while suffix < limit and want_lines[-suffix - 1] == have_lines[-suffix - 1]:
+        suffix += 1
+    if prefix == len(want_lines) == len(have_lines):
+        return
+    start = max(prefix - context, 0)
+    tail = max(suffix - context, 0)
+    want_window = want_lines[start:len(want_lines) - tail]
+    have_window = have_lines[start:len(have_lines) - tail]
+
+    yield "--- %s" % (path,)
+    yield "+++ running"
+    if len(want_window) == len(have_window):
+        # Lines were changed in place, unless some look moved by one: then
+        # pairing lines by position would show more changes than difflib.
+        changed = [i for i in range(len(want_window)) if want_window[i] != have_window[i]]
+        n = len(want_window)
+        if not any(i + 1 < n and (want_window[i] == have_window[i + 1] or want_window[i + 1] == have_window[i])
+                   for i in changed):
+            for line in _paired_hunks(want_window, have_window, changed, start, context):
+                yield line
+            return
+    # Only imported for the diffs that pairing lines can't do.
+    import difflib
+    hunks = difflib.unified_diff(want_window, have_window, n=context, lineterm="")
+    for line in _shift_hunks(itertools.islice(hunks, 2, None), start):
+        yield line
 
-def diff_lists(path, want, have):
+
+def unified_diff(path, want, have):
+    """Return a unified diff of multi-line strings 'want' and 'have'.
+
+    Bounded by ``text_diff_limits``: strings that are too large are only
+    described by their digests, and long diffs are cut short with a marker.
+    """
+    if max(len(want), len(have)) > text_diff_limits["max_size"]:
+        return "%s: %s != running: %s (too large to diff)" % (path, _digest(want), _digest(have))
+    max_lines = text_diff_limits["max_lines"]
+    lines = _iter_unified_diff(path, want.splitlines(), have.splitlines(), text_diff_limits["context"])
+    shown = list(itertools.islice(lines, max_lines))
+    if next(lines, None) is not None:
+        shown.append("... (diff truncated after %d lines)" % (max_lines,))
+    return "\n".join(shown)
+
+
+def _elements_equal(root, want, have):
+    """Return whether ``diff`` finds no differences between two list elements.
+
+    'want' and 'have' are (fingerprint, element) pairs. The comparison stops
+    at the first difference, and its result is memoized by the pair of
+    fingerprints, so that elements shared by many objects, e.g. sidecar
+    containers, are compared once.
+
+    :param root: The toleration state elements are compared from. Results
+        are kept on its matcher, which is replaced whenever the tolerations
+        change.
+    """
+    equalities = root.matcher.equalities
+    key = (want[0], have[0])
+    try:
+        return equalities[key]
+    except KeyError:
+        pass
+    equal = next(diff((), want[1], have[1], root), None) is None
+    if len(equalities) >= root.matcher.max_equalities:
+        equalities.clear()
+    equalities[key] = equal
+    return equal
+
+
+def diff_lists(path, want, have, _root=None):
     if not len(want) == len(have):
-        yield different_lengths(path, want, have)
+        yield Difference(LENGTH, path, len(want), len(have))
+
+    # Elements are compared from the empty path.
+    root = _root or toleration_matcher().root
 
-    def eq(x, y):
-        return len(list(diff('', x, y))) == 0
+    wanted = [(fingerprint(x), x) for x in want]
+    running = [(fingerprint(y), y) for y in have]
+    for i in list_subtract(wanted, running, partial(_elements_equal, root), operator.itemgetter(0)):
+        yield Difference(MISSING_ELEMENT, path + (i,), want[i])
 
-    for i in list_subtract(want, have, eq):
-        yield missing_item(path, "element [%d]" % i)
 
+def fingerprint(value):
+    """Return a hashable canonical form of 'value'.
 
-def list_subtract(xs, ys, equality=operator.eq):
-    """Return items in 'xs' but not in 'ys'."""
+    Values with equal fingerprints never differ according to ``diff``, so
+    list elements can be paired by fingerprint before falling back to a full
+    comparison. The converse doesn't hold: ``diff`` ignores extra keys in the
+    running object, and tolerations make more values equal, so unequal
+    fingerprints are left for ``diff`` to decide.
+    """
+    value = normalize(value)
+    if isinstance(value, dict):
+        return (dict, frozenset((k, fingerprint(v)) for (k, v) in viewitems(value)))
+    if isinstance(value, list):
+        # diff_lists ignores order, so compare as multisets
+        return (list, frozenset(viewitems(collections.Counter(fingerprint(x) for x in value))))
+    return value
+
+
+def list_subtract(xs, ys, equality=operator.eq, key=None):
+    """Return items in 'xs' but not in 'ys'.
+
+    :param equality: Decides whether an item of 'xs' matches one of 'ys'.
+    :param key: Optional function such that items with equal keys are
+        always equal. Items are then paired through a hash index of their
+        keys first, and 'equality' is only tried on the items left over.
+    """
     matched = set()
-    for i, x in enumerate(xs):
+    unmatched = range(len(xs))
+    if key is not None:
+        index = collections.defaultdict(collections.deque)
+        for j, y in enumerate(ys):
+            index[key(y)].append(j)
+        unmatched = []
+        for i, x in enumerate(xs):
+            candidates = index.get(key(x))
+            if candidates:
+                matched.add(candidates.popleft())
+            else:
+                unmatched.append(i)
+
+    for i in unmatched:
+        x = xs[i]
         for j, y in enumerate(ys):
             if j in matched:
                 continue
@@ -119,14 +543,13 @@ def list_subtract(xs, ys, equality=operator.eq):
             yield i
 
 
-def diff_dicts(path, want, have):
+def diff_dicts(path, want, have, _state=None):
+    state = _state or toleration_matcher().state(path_text(path))
     for (k, want_v) in viewitems(want):
-        key_path = "%s.%s" % (path, k)
-
         if k not in have:
-            yield missing_item(path, k)
+            yield Difference(MISSING, path + (k,), want_v)
         else:
-            for difference in diff(key_path, want_v, have[k]):
+            for difference in diff(path + (k,), want_v, have[k], state.child(k)):
                 yield difference
 
 
@@ -138,68 +561,330 @@ def normalize(value):
     return value
 
 
-def diff(path, want, have):
+def diff(path, want, have, _state=None):
+    """Yield the ``Difference``s between 'want' and the running 'have'.
+
+    :param tuple path: The keys leading to 'want' and 'have'; () for whole
+        objects.
+    """
     want = normalize(want)
     have = normalize(have)
 
-    for (toleration_path, toleration_check) in listitems(tolerations):
-        if fnmatchcase(path, toleration_path) and toleration_check(want, have):
+    state = _state or toleration_matcher().state(path_text(path))
+    for toleration_check in state.checks:
+        if toleration_check(want, have):
             return
 
     if isinstance(want, dict) and isinstance(have, dict):
-        for difference in diff_dicts(path, want, have):
+        for difference in diff_dicts(path, want, have, state):
             yield difference
 
     elif isinstance(want, list) and isinstance(have, list):
-        for difference in diff_lists(path, want, have):
+        for difference in diff_lists(path, want, have, state.matcher.root):
             yield difference
 
     elif isinstance(want, str) and isinstance(have, str):
         if want != have:
             if "\n" in want:
-                yield diff_not_equal(path, want, have)
+                yield Difference(TEXT_DIFF, path, want, have)
             else:
-                yield not_equal(path, want, have)
+                yield Difference(NOT_EQUAL, path, want, have)
 
     elif want != have:
-        yield not_equal(path, want, have)
-
-
-def check_file(printer, path, config):
-    """Check YAML file 'path' for differences.
-
-    :param printer: Where we report differences to.
-    :param str path: The YAML file to test.
+        yield Difference(NOT_EQUAL, path, want, have)
+
+
+def make_fetcher(config):
+    """Return the fetcher that 'config' asks for."""
+    if config.get("snapshot"):
+        # Everything is read from the snapshot's index; nothing to batch.
+        from ._snapshot import SnapshotFetcher
+        return SnapshotFetcher(config["snapshot"])
+    if config.get("backend", "kubectl") == "api":
+        # Only load the HTTP and TLS machinery when it is asked for.
+        from ._client import APIFetcher, KubeClient
+        fetcher = APIFetcher(KubeClient.from_kubeconfig(config["kubeconfig"], config["context"]))
+    else:
+        fetcher = KubectlFetcher(config["kubeconfig"], config["context"])
+    if config.get("batch"):
+        fetcher = BatchFetcher(fetcher)
+    return fetcher
+
+
+def check_object(fetcher, kube_obj, timings=NO_TIMINGS, results=None):
+    """Compare 'kube_obj' to its running state.
+
+    :param fetcher: Where the running state is fetched from.
+    :param KubeObject kube_obj: The object as it is defined in a config file.
+    :param timings: Where the time spent fetching and diffing is recorded.
+    :param ResultCache results: Where the differences found on earlier runs
+        are kept, if anywhere. Objects that haven't changed since aren't
+        fetched or diffed again.
+    :return: A list of ``Difference``s.
+    """
+    if results is not None:
+        with timings.measure("fetch", kube_obj.kind) as looking:
+            cached = results.lookup(fetcher, kube_obj)
+        if cached is not None:
+            timings.record_object(kube_obj, looking.wall)
+            return cached
+    error = None
+    with timings.measure("fetch", kube_obj.kind) as fetching:
+        try:
+            running = fetcher.get(kube_obj)
+        except fetch_errors as e:
+            error = e
+    if error is not None:
+        timings.record_object(kube_obj, fetching.wall)
+        return [Difference(ERROR, None, error.output.decode('utf-8'))]
+    with timings.measure("diff", kube_obj.kind) as diffing:
+        differences = timings.profile(lambda: list(diff((), kube_obj.data, running)))
+    timings.record_object(kube_obj, fetching.wall + diffing.wall)
+    if results is not None:
+        results.store(kube_obj, running, differences)
+    return differences
+
+
+def iter_file_objects(path, config):
+    """Yield the ``KubeObject``s defined in YAML file 'path'.
+
+    :param str path: The YAML file to parse.
     :param dict config: Contains Kubernetes parsing and access configuration.
-    :return: Number of differences found.
     """
     with open(path, 'r') as stream:
-        expected = yaml.safe_load_all(stream)
-
-        differences = 0
-        for data in expected:
+        for data in load_all_yaml(stream):
             # data can be None, e.g. in cases where the doc ends with a '---'
             if not data:
                 continue
             try:
                 for kube_obj in KubeObject.from_dict(data, config["namespace"]):
-                    printer.add(path, kube_obj)
-
-                    try:
-                        running = kube_obj.get_from_cluster(config["kubeconfig"], config["context"])
-                    except subprocess.CalledProcessError as e:
-                        printer.diff(path, Difference(e.output.decode('utf-8'), None))
-                        differences += 1
-                        continue
-
-                    for difference in diff("", kube_obj.data, running):
-                        differences += 1
-                        printer.diff(path, difference)
+                    yield kube_obj
             except Exception:
                 print("Failed parsing %s." % (path))
                 raise
 
-        return differences
+
+def iter_cached_file_objects(path, config, cache):
+    """Like ``iter_file_objects``, but skip parsing if 'path' is in 'cache'.
+
+    :param ParseCache cache: Where parsed files are kept.
+    """
+    parsed = []
+
+    def parse():
+        for kube_obj in iter_file_objects(path, config):
+            parsed.append(kube_obj)
+            yield kube_obj
+
+    try:
+        objects = cache.load(path, config["namespace"], parse)
+    except Exception:
+        # Still yield what was parsed before the error, as iter_file_objects does.
+        for kube_obj in parsed:
+            yield kube_obj
+        raise
+    for kube_obj in objects:
+        yield kube_obj
+
+
+def parse_file(path, config):
+    """Return (path, objects) for YAML file 'path'.
+
+    Runs in a parse worker process, so uses a cache of its own if 'config'
+    asks for one.
+    """
+    cache = open_parse_cache(config)
+    if cache is None:
+        return path, list(iter_file_objects(path, config))
+    return path, cache.load(path, config["namespace"], lambda: iter_file_objects(path, config))
+
+
+def open_parse_cache(config):
+    """Return the ``ParseCache`` that 'config' asks for, or None.
+
+    A cache directory that can't be created, e.g. on a read-only file
+    system, is logged and the run goes on without the cache.
+    """
+    if not config.get("cache_dir"):
+        return None
+    try:
+        return ParseCache(config["cache_dir"], config.get("cache_entries", 10000))
+    except OSError as e:
+        logging.warning("Not caching parsed manifests, can't use the cache directory: %s", e)
+        return None
+
+
+def diff_settings():
+    """Return a string that identifies the tolerations ``diff`` applies.
+
+    Checks are identified by their module and name, so a check that is
+    changed without being renamed isn't noticed.
+    """
+    return repr(sorted((pattern, "%s.%s" % (getattr(check, "__module__", ""), getattr(check, "__name__", repr(check))))
+                       for (pattern, check) in viewitems(tolerations)))
+
+
+def cluster_identity(config):
+    """Return a string that identifies the cluster 'config' describes.
+
+    The cluster's server is read from the kubeconfig, so that switching the
+    current context switches cluster too. If the kubeconfig can't be read,
+    the kubeconfig and context names stand for the cluster.
+    """
+    from ._client import ConfigError, load_kubeconfig
+    try:
+        cluster, _, _ = load_kubeconfig(config["kubeconfig"], config["context"])
+    except (ConfigError, IOError, OSError) as e:
+        logging.debug("Failed to read kubeconfig, identifying the cluster by context: %s", e)
+        return "%s\0%s" % (config["kubeconfig"] or "", config["context"] or "")
+    return "%s\0%s" % (cluster.get("server") or "", config.get("backend", "kubectl"))
+
+
+def open_result_cache(config):
+    """Return the ``ResultCache`` that 'config' asks for, or None.
+
+    As for ``open_parse_cache``, runs go on without a cache that can't be
+    created.
+    """
+    if not config.get("result_cache") or not config.get("cache_dir") or config.get("snapshot"):
+        return None
+    try:
+        return ResultCache(config["cache_dir"], cluster_identity(config), diff_settings(),
+                           config.get("cache_entries", 10000))
+    except OSError as e:
+        logging.warning("Not caching results, can't use the cache directory: %s", e)
+        return None
+
+
+def iter_yaml_files(paths, scope=None):
+    """Yield the YAML files in 'paths'.
+
+    :param Scope scope: If given with path globs, only the files under
+        directories that match them.
+    """
+    globs = scope.path_globs if scope is not None and scope.path_globs else None
+    for path in iter_files(paths, globs):
+        _, extension = os.path.splitext(path)
+        if extension in [".yaml", ".yml"]:
+            yield path
+
+
+def _checked(path, kube_obj, call, *args):
+    try:
+        return call(*args)
+    except Exception:
+        print("Failed checking %s '%s' from %s." % (kube_obj.kind, kube_obj.namespaced_name, path))
+        raise
+
+
+def iter_checks(objects, fetcher, jobs=1, timings=NO_TIMINGS, results=None):
+    """Check objects against their running state.
+
+    :param objects: An iterable of (path, KubeObject) pairs.
+    :param fetcher: Where the running state is fetched from.
+    :param int jobs: How many objects to fetch and diff at once.
+    :param timings: Where the time spent fetching and diffing is recorded.
+    :param ResultCache results: As for ``check_object``.
+    :return: An iterator of (path, KubeObject, differences), in the same
+        order as 'objects'.
+    """
+    if jobs <= 1:
+        for (path, kube_obj) in objects:
+            yield path, kube_obj, _checked(path, kube_obj, check_object, fetcher, kube_obj, timings, results)
+        return
+
+    executor = ThreadPoolExecutor(jobs)
+    pending = collections.deque()
+    error = None
+    try:
+        try:
+            for (path, kube_obj) in objects:
+                pending.append((path, kube_obj, executor.submit(check_object, fetcher, kube_obj, timings, results)))
+                # Parse only a little ahead of what has been reported, so that
+                # memory stays bounded on large trees.
+                if len(pending) > 2 * jobs:
+                    path, kube_obj, future = pending.popleft()
+                    yield path, kube_obj, _checked(path, kube_obj, future.result)
+        except Exception as e:
+            # Report what was read before the error, as the serial path does.
+            error = e
+        while pending:
+            path, kube_obj, future = pending.popleft()
+            yield path, kube_obj, _checked(path, kube_obj, future.result)
+        if error is not None:
+            raise error
+    finally:
+        for (_, _, future) in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def in_shard(kube_obj, shard):
+    """Return whether 'kube_obj' belongs to 'shard'.
+
+    Objects are spread over shards by a hash of their kind, namespace and
+    name, which is the same in every process and on every run.
+
+    :param shard: (index, count), with 0 <= index < count; or None, for
+        the one shard that has every object.
+    """
+    if shard is None:
+        return True
+    (index, count) = shard
+    key = "%s\0%s\0%s" % (kube_obj.kind, kube_obj.namespace, kube_obj.name)
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest()[:15], 16) % count == index
+
+
+def announce_objects(fetcher, objects):
+    """Read all of 'objects' and announce them to a ``BatchFetcher``.
+
+    Lists can then be cut down to the objects that the manifests define. If
+    reading stops on an error, the objects read so far are still yielded
+    before the error is raised.
+    """
+    read, error = [], None
+    try:
+        for (path, kube_obj) in objects:
+            fetcher.want(kube_obj)
+            read.append((path, kube_obj))
+    except Exception as e:
+        error = e
+    for item in read:
+        yield item
+    if error is not None:
+        raise error
+
+
+def report_checks(printer, checks, timings=NO_TIMINGS):
+    """Report the results of 'iter_checks' to 'printer'.
+
+    :param timings: Where the time spent printing is recorded.
+    :return: Number of differences found.
+    """
+    differences = 0
+    for (path, kube_obj, found) in checks:
+        with timings.measure("print"):
+            printer.add(path, kube_obj)
+            for difference in found:
+                differences += 1
+                printer.diff(path, difference)
+    return differences
+
+
+def check_file(printer, path, config, fetcher=None):
+    """Check YAML file 'path' for differences.
+
+    :param printer: Where we report differences to.
+    :param str path: The YAML file to test.
+    :param dict config: Contains Kubernetes parsing and access configuration.
+    :param fetcher: Where running objects are fetched from. Defaults to the
+        one described by 'config'.
+    :return: Number of differences found.
+    """
+    if fetcher is None:
+        fetcher = make_fetcher(config)
+    objects = ((path, kube_obj) for kube_obj in iter_file_objects(path, config))
+    return report_checks(printer, iter_checks(objects, fetcher, config.get("jobs", 1)))
 
 
 class StdoutPrinter(object):
@@ -223,7 +908,6 @@ class QuietTextPrinter(object):
     def _write(self, msg, *args):
         self._stream.write(msg % args)
         self._stream.write('\n')
-        self._stream.flush()
 
     def add(self, _, kube_obj):
         self._current = kube_obj
@@ -235,13 +919,15 @@ class QuietTextPrinter(object):
             self._write('## UNKNOWN')
         self._write('')
         self._write('%s', difference.to_text(self._current.kind))
+        self._stream.flush()
 
     def finish(self):
-        pass
+        self._stream.flush()
 
 
 class JSONPrinter(object):
-    def __init__(self):
+    def __init__(self, stream=None):
+        self._stream = stream if stream else sys.stdout
         self.data = collections.defaultdict(list)
 
     def add(self, path, kube_obj):
@@ -251,22 +937,193 @@ class JSONPrinter(object):
         self.data[path].append(difference.to_text())
 
     def finish(self):
-        print(json.dumps(self.data, sort_keys=True, indent=2, separators=(',', ': ')))
+        print(json.dumps(self.data, sort_keys=True, indent=2, separators=(',', ': ')), file=self._stream)
+
+
+def merge_json_reports(reports):
+    """Merge reports written by ``JSONPrinter``, e.g. by the shards of a run.
+
+    :param reports: The reports, as parsed JSON.
+    :return: A report with the differences of every file in all of them.
+    """
+    merged = collections.defaultdict(list)
+    for report in reports:
+        for (path, differences) in viewitems(report):
+            merged[path].extend(differences)
+    return merged
+
+
+class NDJSONPrinter(object):
+    """Write one JSON record per line, as soon as each object or difference is found.
+
+    Object records have "type": "object", and difference records have
+    "type": "difference" along with the difference's operation, path and
+    message. Both carry the file, kind, namespace and name of the object,
+    and the 'context' of the cluster checked, if one is given.
+    """
+
+    def __init__(self, stream=None, context=None):
+        self._stream = stream if stream else sys.stdout
+        self._context = context
+        self._current = None
+
+    def _write(self, record):
+        self._stream.write(json.dumps(record, sort_keys=True, separators=(',', ':')))
+        self._stream.write('\n')
+
+    def _record(self, record_type, path, kube_obj):
+        record = {
+            "type": record_type,
+            "file": path,
+            "kind": kube_obj.kind,
+            "namespace": kube_obj.namespace,
+            "name": kube_obj.name,
+        }
+        if self._context is not None:
+            record["context"] = self._context
+        return record
+
+    def add(self, path, kube_obj):
+        self._current = kube_obj
+        self._write(self._record("object", path, kube_obj))
+
+    def diff(self, path, difference):
+        record = self._record("difference", path, self._current)
+        record["op"] = difference.op
+        record["path"] = difference.path_text()
+        record["message"] = difference.message_text(self._current.kind)
+        self._write(record)
+
+    def finish(self):
+        self._stream.flush()
+
+
+def iter_manifest_objects(paths, config, cache=None):
+    """Yield (path, KubeObject) for the objects in the YAML files in 'paths'.
+
+    Only the objects in the shard and the scope that 'config' asks for are
+    yielded.
+
+    :param ParseCache cache: Where parsed files are kept, if anywhere.
+    """
+    timings = config.get("timings") or NO_TIMINGS
+    metrics = config.get("metrics")
+    files = timings.iterate("discover", iter_yaml_files(paths, config.get("scope")))
+    if metrics is not None:
+        files = metrics.count("files", files)
+    if config.get("parse_jobs", 1) > 1:
+        # Parse on several processes ahead of the checks. Timings and
+        # metrics stay in this process, so parsing is timed as the wait for
+        # each file.
+        parse = partial(parse_file, config=dict(config, timings=None, metrics=None))
+        parsed = timings.iterate("parse", map_files(parse, files, config["parse_jobs"]))
+        objects = ((path, kube_obj) for (path, kube_objs) in parsed for kube_obj in kube_objs)
+    elif cache is None:
+        objects = ((path, kube_obj) for path in files
+                   for kube_obj in timings.iterate("parse", iter_file_objects(path, config), path))
+    else:
+        objects = ((path, kube_obj) for path in files
+                   for kube_obj in timings.iterate("parse", iter_cached_file_objects(path, config, cache), path))
+    if metrics is not None:
+        objects = metrics.count("documents", objects)
+    if config.get("shard"):
+        objects = ((path, kube_obj) for (path, kube_obj) in objects if in_shard(kube_obj, config["shard"]))
+    if config.get("scope"):
+        objects = ((path, kube_obj) for (path, kube_obj) in objects if config["scope"].matches(kube_obj))
+    return objects
+
+
+def _check_cluster(objects, printer, config):
+    """Check 'objects' against the cluster that 'config' describes.
+
+    :return: True if there are differences, False otherwise.
+    """
+    timings = config.get("timings") or NO_TIMINGS
+    metrics = config.get("metrics")
+    if metrics is not None:
+        timings = metrics.recording(timings, config.get("context"))
+    fetcher = make_fetcher(config)
+    results = open_result_cache(config)
+    if isinstance(fetcher, BatchFetcher):
+        objects = announce_objects(fetcher, objects)
+    checks = iter_checks(objects, fetcher, config.get("jobs", 1), timings, results)
+    if metrics is not None:
+        checks = metrics.record_checks(checks, config.get("context"))
+    try:
+        differences = report_checks(printer, checks, timings)
+    finally:
+        if results is not None:
+            results.prune()
+    with timings.measure("print"):
+        printer.finish()
+    return bool(differences)
 
 
 def check_files(paths, printer, config):
     """Check all files in 'paths' for differences to a Kubernetes cluster.
 
     :param printer: Where differences are reported to as they are found.
-    :param dict config: Contains Kubernetes parsing and access configuration.
+    :param dict config: Contains Kubernetes parsing and access configuration,
+        and optionally a ``Timings`` to record where the time goes in, and
+        ``Metrics`` to record what was found in.
     :return: True if there are differences, False otherwise.
     """
-    differences = 0
-    for path in iter_files(paths):
-        _, extension = os.path.splitext(path)
-        if extension not in [".yaml", ".yml"]:
-            continue
-        differences += check_file(printer, path, config)
+    cache = open_parse_cache(config)
+    try:
+        return _check_cluster(iter_manifest_objects(paths, config, cache), printer, config)
+    finally:
+        if cache is not None:
+            cache.prune()
 
-    printer.finish()
-    return bool(differences)
+
+def check_contexts(paths, make_printer, config, contexts):
+    """Check all files in 'paths' against each of several clusters.
+
+    The files are parsed once, and the clusters checked concurrently.
+
+    :param make_printer: Called with each context, returns the printer that
+        context's differences are reported to.
+    :param dict config: As for ``check_files``; its context is ignored.
+    :param contexts: Names of the kubeconfig contexts of the clusters.
+    :return: An ``OrderedDict`` mapping each context, in order, to whether
+        there are differences in its cluster.
+    """
+    cache = open_parse_cache(config)
+    try:
+        objects = list(iter_manifest_objects(paths, config, cache))
+    finally:
+        if cache is not None:
+            cache.prune()
+
+    def check(context):
+        return _check_cluster(iter(objects), make_printer(context), dict(config, context=context))
+
+    with ThreadPoolExecutor(max(len(contexts), 1)) as executor:
+        return collections.OrderedDict(zip(contexts, executor.map(check, contexts)))
+
+
+def expand_contexts(patterns, kubeconfig=None):
+    """Return the contexts named by 'patterns', in order and without repeats.
+
+    Patterns with glob characters, e.g. "prod-*", stand for the contexts in
+    the kubeconfig that they match; others are taken as they are.
+
+    :raise ValueError: If a pattern matches no context.
+    """
+    contexts, available = [], None
+    for pattern in patterns:
+        if not any(c in pattern for c in "*?["):
+            matched = [pattern]
+        else:
+            if available is None:
+                # Only load the kubeconfig reader when it is needed.
+                from ._client import ConfigError, list_contexts
+                try:
+                    available = list_contexts(kubeconfig)
+                except ConfigError as e:
+                    raise ValueError("can't list kubeconfig contexts: %s" % (e,))
+            matched = [context for context in available if fnmatchcase(context, pattern)]
+            if not matched:
+                raise ValueError("no kubeconfig context matches %r" % (pattern,))
+        contexts.extend(context for context in matched if context not in contexts)
+    return contexts
@@ -6,29 +6,45 @@ from __future__ import (division, absolute_import, print_function,
 from ._kube import (
     KubeObject,
     iter_files,
+    load_all_yaml,
+    map_files,
 )
-import yaml
 import os
 import attr
-from future.utils import viewitems
+from future.utils import string_types
 from builtins import object
-from builtins import map
 
 
-def load_config(*paths):
+def _iter_yaml_files(paths):
+    return (path for path in iter_files(paths) if os.path.splitext(path)[1] in [".yaml", ".yml"])
+
+
+def _iter_documents(path):
+    with open(path, 'r') as stream:
+        for data in load_all_yaml(stream):
+            # data can be None, e.g. in cases where the doc ends with a '---'
+            if data:
+                yield data
+
+
+def _load_file(path):
+    return [(kube_obj.kind, kube_obj.namespace, kube_obj.name, kube_obj.data)
+            for data in _iter_documents(path) for kube_obj in KubeObject.from_dict(data)]
+
+
+def load_config(*paths, **options):
     """Load configuration for a Kubernetes environment from disk.
 
-    :return: a dict mapping KubeObjects to data.
+    Every document of every file is loaded, and List documents are split
+    into their items.
+
+    :param int jobs: Number of processes to parse files on (default 1).
+    :return: a dict mapping (kind, namespace, name) to data.
     """
     objects = {}
-    for path in iter_files(paths):
-        _, extension = os.path.splitext(path)
-        if extension not in [".yaml", ".yml"]:
-            continue
-        with open(path, 'r') as stream:
-            data = yaml.safe_load(stream)
-        kube_obj = KubeObject.from_dict(data)
-        objects[kube_obj] = data
+    for loaded in map_files(_load_file, _iter_yaml_files(paths), options.get("jobs", 1)):
+        for (kind, namespace, name, data) in loaded:
+            objects[(kind, namespace, name)] = data
     return objects
 
 
@@ -44,46 +60,133 @@ class Image(object):
 
     @classmethod
     def parse(cls, image_name):
-        try:
-            [name, label] = image_name.split(':', 1)
-        except ValueError:
-            name = image_name
-            label = "latest"
-        return cls(name, label)
+        """Split 'image_name' into a name, and a digest or tag.
+
+        A colon is only taken as the start of a tag after the last '/', so
+        that registry ports, as in "localhost:5000/app", stay in the name.
+        """
+        (name, _, digest) = image_name.partition('@')
+        (repository, colon, tag) = name.rpartition(':')
+        if not colon or '/' in tag:
+            repository, tag = name, "latest"
+        return cls(repository, digest or tag)
+
+
+def add_images(index, data):
+    """Add the images in Kubernetes object 'data' to 'index'.
+
+    :param Dict[str, Set[str]] index: Maps image names to their labels.
+    """
+    for image_name in iter_images(data):
+        image = Image.parse(image_name)
+        index.setdefault(image.name, set()).add(image.label)
+    return index
+
+
+def _index_file(path):
+    index = {}
+    for data in _iter_documents(path):
+        add_images(index, data)
+    return index
+
+
+def index_images(*paths, **options):
+    """Index the images used by the Kubernetes configuration in 'paths'.
+
+    Documents are indexed as they are read, so only the index is kept in
+    memory.
+
+    :param int jobs: Number of processes to parse files on (default 1).
+    :return: A dict mapping image names to the set of their labels.
+    :rtype: Dict[str, Set[str]]
+    """
+    index = {}
+    for file_index in map_files(_index_file, _iter_yaml_files(paths), options.get("jobs", 1)):
+        for (name, labels) in file_index.items():
+            index.setdefault(name, set()).update(labels)
+    return index
+
+
+def _format_labels(labels):
+    return None if not labels else ", ".join(sorted(labels))
+
+
+def image_matrix(indexes, differing_only=False):
+    """Return the labels of every image in each of several environments.
+
+    :param indexes: One index from ``index_images`` per environment.
+    :param bool differing_only: Leave out images whose labels are the same
+        in every environment.
+    :return: A dictionary mapping image names to a tuple with the image's
+        label in each environment, or None where it isn't used. Images used
+        with several labels have them joined by ", ".
+    :rtype: Dict[str, Tuple[str, ...]]
+    """
+    names = set()
+    for index in indexes:
+        names.update(index)
+    matrix = {}
+    for name in names:
+        labels = [index.get(name) for index in indexes]
+        if differing_only and all(other == labels[0] for other in labels[1:]):
+            continue
+        matrix[name] = tuple(_format_labels(label) for label in labels)
+    return matrix
+
+
+def environment_names(paths):
+    """Return a name for each environment in 'paths', for labelling columns.
+
+    Each environment is named by the last component of its path, e.g.
+    "prod", or by as many of the last components as it takes to tell it
+    apart from the others, e.g. "eu/prod" and "us/prod".
+
+    :rtype: List[str]
+    """
+    parts = [[part for part in os.path.normpath(path).split(os.sep) if part] or [path] for path in paths]
+    lengths = [1] * len(parts)
+    while True:
+        names = ["/".join(components[-length:]) for (components, length) in zip(parts, lengths)]
+        clashing = [i for (i, name) in enumerate(names) if lengths[i] < len(parts[i]) and any(
+            other == name and parts[j] != parts[i] for (j, other) in enumerate(names))]
+        if not clashing:
+            break
+        for i in clashing:
+            lengths[i] += 1
+    # The same environment given twice keeps its place in the order.
+    return [name if names.count(name) == 1 else "%s (%d)" % (name, names[:i].count(name) + 1)
+            for (i, name) in enumerate(names)]
+
+
+def compare_image_indexes(source_index, target_index):
+    """Return the images that differ between two indexes from ``index_images``.
+
+    :return: A dictionary mapping image names to source label and target
+        label, as for ``image_matrix``.
+    :rtype: Dict[str, (str, str)]
+    """
+    return image_matrix([source_index, target_index], differing_only=True)
 
 
 def get_differing_images(source_env, target_env):
     """Return the images that differ between Kubernetes environments.
 
-    :param Dict[KubeObject, Dict] source_env: The Kubernetes objects in the
-        source environment.
-    :param Dict[KubeObject, Dict] target_env: The Kubernetes objects in the
+    Images are compared across each whole environment, so images of objects
+    that exist on one side only are reported too.
+
+    :param Dict[Any, Dict] source_env: The Kubernetes objects in the
+        source environment, as returned by ``load_config``.
+    :param Dict[Any, Dict] target_env: The Kubernetes objects in the
         target environment.
-    :return: A dictionary mapping image names to source label and target label.
+    :return: As for ``compare_image_indexes``.
     :rtype: Dict[str, (str, str)]
     """
-    source_objs = frozenset(source_env)
-    target_objs = frozenset(target_env)
-    # XXX: What about missing objects?
-    diffs = {}
-    for obj in source_objs & target_objs:
-        source_images = list(map(Image.parse, sorted(iter_images(source_env[obj]))))
-        target_images = list(map(Image.parse, sorted(iter_images(target_env[obj]))))
-        while source_images and target_images:
-            source, target = source_images[0], target_images[0]
-            if source.name == target.name:
-                if source.label != target.label:
-                    diffs[source.name] = (source.label, target.label)
-                source_images, target_images = source_images[1:], target_images[1:]
-            elif source.name < target.name:
-                # XXX: What about images that are in the source env but not in the
-                # target env?
-                source_images, target_images = source_images[1:], target_images
-            else:
-                # XXX: What about images that are in the target env but not in the
-                # source env?
-                source_images, target_images = source_images, target_images[1:]
-    return diffs
+    source_index, target_index = {}, {}
+    for data in source_env.values():
+        add_images(source_index, data)
+    for data in target_env.values():
+        add_images(target_index, data)
+    return compare_image_indexes(source_index, target_index)
 
 
 def iter_images(data):
@@ -91,16 +194,16 @@ def iter_images(data):
 
     Expects 'data' to be Kubernetes object.
     """
-    if isinstance(data, dict):
-        for (key, value) in viewitems(data):
-            if key == 'image':
-                yield value
-            else:
-                for image in iter_images(value):
-                    yield image
-    elif isinstance(data, list):
-        for item in data:
-            for image in iter_images(item):
-                yield image
-    else:
-        pass
+    # Walk with a stack of our own rather than nested generators, which
+    # cost a step per level of nesting for every image yielded.
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for (key, item) in value.items():
+                if key == 'image' and isinstance(item, string_types):
+                    yield item
+                else:
+                    stack.append(item)
+        elif isinstance(value, list):
+            stack.extend(value)
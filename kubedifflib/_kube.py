@@ -3,27 +3,86 @@
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 import logging
-import yaml
 import subprocess
 import os
+import threading
 import attr
 from builtins import object
 
 
-def iter_files(paths):
+_yaml = []
+
+
+def _yaml_loader():
+    """Return PyYAML and its fastest safe loader, importing them on first use.
+
+    Runs that parse nothing, e.g. 'kubediff --help', don't pay for PyYAML.
+    """
+    if not _yaml:
+        import yaml
+        # libyaml's loader returns the same data as the pure-Python one, many
+        # times faster; it is only missing when PyYAML was built without libyaml.
+        _yaml.append((yaml, getattr(yaml, "CSafeLoader", yaml.SafeLoader)))
+    return _yaml[0]
+
+
+def load_yaml(stream):
+    """Like ``yaml.safe_load``, but with libyaml when it is available."""
+    (yaml, loader) = _yaml_loader()
+    return yaml.load(stream, Loader=loader)
+
+
+def load_all_yaml(stream):
+    """Like ``yaml.safe_load_all``, but with libyaml when it is available."""
+    (yaml, loader) = _yaml_loader()
+    return yaml.load_all(stream, Loader=loader)
+
+
+def map_files(function, paths, jobs=1):
+    """Yield 'function(path)' for each of 'paths', in order.
+
+    With more than one job, calls are spread over a pool of 'jobs'
+    processes, so 'function' and its results must be picklable.
+    """
+    if jobs <= 1:
+        for path in paths:
+            yield function(path)
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap(function, paths, chunksize=4):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+
+
+def iter_files(paths, globs=None):
     """Yield absolute paths to all the files in 'paths'.
 
     'paths' is expected to be an iterable of paths to files or directories.
     Paths to files are yielded as is, paths to directories are recursed into.
 
     Equivalent to ``find "$paths[@]" -type f``.
+
+    :param globs: If given, only yield files under directories whose paths,
+        relative to the directory, match one of these globs, as split by
+        ``_scope.split_path``. Subdirectories that no glob could match files
+        in aren't walked.
     """
     # XXX: Copied from service/monitoring/lint
+    if globs is not None:
+        from ._scope import match_path_glob, split_path
     for path in paths:
         if os.path.isfile(path):
             yield path
         else:
-            for root, _, filenames in os.walk(path):
+            for root, dirnames, filenames in os.walk(path):
+                if globs is not None:
+                    parts = split_path(os.path.relpath(root, path))
+                    dirnames[:] = [d for d in dirnames if any(match_path_glob(g, parts + [d], True) for g in globs)]
+                    filenames = [f for f in filenames if any(match_path_glob(g, parts + [f]) for g in globs)]
                 for filename in filenames:
                     yield os.path.join(root, filename)
 
@@ -80,11 +139,163 @@ class KubeObject(object):
             fetches data from the default cluster.
         :return: A dict of data for this Kubernetes object.
         """
-        args = ["--namespace=%s" % self.namespace, "-o=yaml"]
-        if kubeconfig is not None:
-            args.append("--kubeconfig=%s" % kubeconfig)
-        if context is not None:
-            args.append("--context=%s" % context)
-
+        args = _kubectl_args(self.namespace, kubeconfig, context)
         running = subprocess.check_output(["kubectl", "get"] + args + [self.kind, self.name], stderr=subprocess.STDOUT)
-        return yaml.safe_load(running)
+        return load_yaml(running)
+
+
+def _kubectl_args(namespace, kubeconfig=None, context=None, output="yaml"):
+    """Return the common arguments for a 'kubectl get' call."""
+    args = ["--namespace=%s" % namespace, "-o=%s" % output]
+    if kubeconfig is not None:
+        args.append("--kubeconfig=%s" % kubeconfig)
+    if context is not None:
+        args.append("--context=%s" % context)
+    return args
+
+
+def list_from_cluster(kind, namespace, kubeconfig=None, context=None):
+    """Fetch all objects of one kind in a namespace with a single call.
+
+    :param str kind: The fully-qualified kind, as in ``KubeObject.kind``.
+    :param str namespace: The namespace to list. Ignored by Kubernetes for
+        cluster-scoped kinds.
+    :return: A dict mapping object names to data.
+    """
+    args = _kubectl_args(namespace, kubeconfig, context)
+    running = subprocess.check_output(["kubectl", "get"] + args + [kind], stderr=subprocess.PIPE)
+    items = (load_yaml(running) or {}).get("items") or []
+    return dict((item["metadata"]["name"], item) for item in items)
+
+
+def list_versions_from_cluster(kind, namespace, kubeconfig=None, context=None):
+    """Fetch the resourceVersions of all objects of one kind in a namespace.
+
+    Only names and versions are printed, so much less is sent and decoded
+    than for ``list_from_cluster``.
+
+    :return: A dict mapping object names to resourceVersions, or to None
+        for objects without one.
+    """
+    args = _kubectl_args(namespace, kubeconfig, context,
+                         "custom-columns=NAME:.metadata.name,VERSION:.metadata.resourceVersion")
+    running = subprocess.check_output(["kubectl", "get"] + args + ["--no-headers", kind], stderr=subprocess.PIPE)
+    versions = {}
+    for line in running.decode('utf-8').splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            versions[fields[0]] = None if fields[1] == "<none>" else fields[1]
+    return versions
+
+
+class FetchError(Exception):
+    """Raised when an object can't be fetched from a cluster.
+
+    Like ``subprocess.CalledProcessError``, 'output' holds the bytes kubectl
+    prints for the same failure.
+    """
+
+    def __init__(self, output):
+        super(FetchError, self).__init__(output)
+        self.output = output
+
+
+#: What fetchers raise for objects they can't fetch.
+fetch_errors = (subprocess.CalledProcessError, FetchError)
+
+
+class KubectlFetcher(object):
+    """Fetch running objects with kubectl."""
+
+    def __init__(self, kubeconfig=None, context=None):
+        self.kubeconfig = kubeconfig
+        self.context = context
+
+    def get(self, kube_obj):
+        """Return the running data for 'kube_obj'.
+
+        :raise subprocess.CalledProcessError: If the object can't be fetched.
+        """
+        return kube_obj.get_from_cluster(self.kubeconfig, self.context)
+
+    def list(self, kind, namespace):
+        """Return a dict mapping names to data for all objects of 'kind' in 'namespace'."""
+        return list_from_cluster(kind, namespace, self.kubeconfig, self.context)
+
+    def versions(self, kind, namespace):
+        """Return a dict mapping names to resourceVersions for all objects of 'kind' in 'namespace'."""
+        return list_versions_from_cluster(kind, namespace, self.kubeconfig, self.context)
+
+
+class BatchFetcher(object):
+    """Fetch running objects with one list call per kind and namespace.
+
+    Each (kind, namespace) group is listed the first time one of its objects
+    is asked for, and the result is indexed by name. Objects that are missing
+    from the list, or whose list call failed, are fetched on their own so
+    that errors are reported exactly as the wrapped fetcher reports them.
+
+    Objects announced with ``want`` bound memory use: a list keeps only the
+    wanted objects, and each of them is dropped once it has been served.
+    """
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+        self._index = {}
+        self._wanted = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def want(self, kube_obj):
+        """Announce that 'kube_obj' will be asked for."""
+        wanted = self._wanted.setdefault((kube_obj.kind, kube_obj.namespace), {})
+        wanted[kube_obj.name] = wanted.get(kube_obj.name, 0) + 1
+
+    def _list(self, kind, namespace):
+        key = (kind, namespace)
+        # One lock per group, so that concurrent callers list each group
+        # only once without waiting on each other's groups.
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._index:
+                try:
+                    items = self.fetcher.list(kind, namespace)
+                except fetch_errors as e:
+                    output = getattr(e, "stderr", None) or e.output or b""
+                    logging.warning("Failed to list %s in %s, fetching objects one by one: %s",
+                                    kind, namespace, output.decode('utf-8').strip())
+                    items = {}
+                wanted = self._wanted.get(key)
+                if wanted is not None:
+                    items = dict((name, items[name]) for name in wanted if name in items)
+                self._index[key] = items
+        return self._index[key]
+
+    def _serve(self, kube_obj):
+        key = (kube_obj.kind, kube_obj.namespace)
+        items = self._list(*key)
+        with self._lock:
+            wanted = self._wanted.get(key)
+            if wanted is None or kube_obj.name not in wanted:
+                return items.get(kube_obj.name)
+            wanted[kube_obj.name] -= 1
+            if wanted[kube_obj.name]:
+                return items.get(kube_obj.name)
+            del wanted[kube_obj.name]
+            return items.pop(kube_obj.name, None)
+
+    def get(self, kube_obj):
+        running = self._serve(kube_obj)
+        if running is None:
+            return self.fetcher.get(kube_obj)
+        return running
+
+    def list(self, kind, namespace):
+        items = self._list(kind, namespace)
+        # '_serve' drops served objects from the same dict, under this lock.
+        with self._lock:
+            return dict(items)
+
+    def versions(self, kind, namespace):
+        return self.fetcher.versions(kind, namespace)
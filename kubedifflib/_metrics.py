@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import binascii
+import bisect
+import io
+import os
+import threading
+from builtins import object
+
+from ._diff import ERROR
+from ._timings import _Measurement
+
+
+#: Upper bounds of the latency histograms' buckets, in seconds. Diffs
+#: mostly take well under a millisecond, fetches tens of milliseconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (name, type, help) of each metric, in the order they are written.
+METRICS = (
+    ("kubediff_object_differences", "gauge",
+     "Differences between the manifest of an object and its running state, when it was last checked."),
+    ("kubediff_fetch_errors_total", "counter", "Objects whose running state couldn't be fetched, including missing ones."),
+    ("kubediff_fetch_duration_seconds", "histogram", "Time taken to fetch the running state of objects."),
+    ("kubediff_diff_duration_seconds", "histogram", "Time taken to diff objects against their running state."),
+    ("kubediff_parsed_files_total", "counter", "Manifest files parsed."),
+    ("kubediff_parsed_documents_total", "counter", "Objects parsed from manifest files, counting each item of a List."),
+)
+
+# Timings phases whose calls are observed in a histogram.
+_HISTOGRAMS = {
+    "fetch": "kubediff_fetch_duration_seconds",
+    "diff": "kubediff_diff_duration_seconds",
+}
+
+
+def _labels(*pairs):
+    # Prometheus treats empty labels as missing ones.
+    return tuple((name, value) for (name, value) in pairs if value)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % (",".join('%s="%s"' % (name, _escape(value)) for (name, value) in labels),)
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return "%d" % (value,)
+
+
+class _Histogram(object):
+
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        # One count per bucket, and one for above the last.
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+
+
+class Metrics(object):
+    """Prometheus metrics about the objects kubediff checks.
+
+    Records how many differences each object has, which objects couldn't be
+    fetched, how long fetching and diffing take per kind, and how many files
+    and objects were parsed. Safe to use from several threads. Series carry
+    a 'context' label when the cluster is given by a kubeconfig context.
+
+    Put one in a config as "metrics" to have ``check_files``,
+    ``check_contexts`` and ``Watcher`` record into it, and ``render`` or
+    ``write`` it when they are done.
+    """
+
+    def __init__(self):
+        self._values = {}       # (metric, labels) -> number
+        self._histograms = {}   # (metric, labels) -> _Histogram
+        self._lock = threading.Lock()
+
+    def observe(self, phase, kind, seconds, context=None):
+        """Observe a call in Timings 'phase' that took 'seconds', if it has a histogram."""
+        metric = _HISTOGRAMS.get(phase)
+        if metric is None or kind is None:
+            return
+        key = (metric, _labels(("context", context), ("kind", kind)))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def record_object(self, kube_obj, differences, context=None):
+        """Record the differences found when checking 'kube_obj'.
+
+        As in reports, an object whose running state couldn't be fetched,
+        e.g. because it doesn't exist, has one difference: the error. It
+        also counts as a fetch error.
+        """
+        labels = _labels(("context", context), ("kind", kube_obj.kind), ("namespace", kube_obj.namespace),
+                         ("name", kube_obj.name))
+        with self._lock:
+            self._values[("kubediff_object_differences", labels)] = len(differences)
+            if any(difference.op == ERROR for difference in differences):
+                key = ("kubediff_fetch_errors_total", labels[:-1])
+                self._values[key] = self._values.get(key, 0) + 1
+
+    def forget_object(self, kube_obj, context=None):
+        """Stop reporting the differences of 'kube_obj', e.g. once its manifest is gone."""
+        labels = _labels(("context", context), ("kind", kube_obj.kind), ("namespace", kube_obj.namespace),
+                         ("name", kube_obj.name))
+        with self._lock:
+            self._values.pop(("kubediff_object_differences", labels), None)
+
+    def record_checks(self, checks, context=None):
+        """Yield from the (path, KubeObject, differences) of 'checks', recording each."""
+        for (path, kube_obj, differences) in checks:
+            self.record_object(kube_obj, differences, context)
+            yield path, kube_obj, differences
+
+    def count(self, name, iterable):
+        """Yield from 'iterable', counting its items as parsed 'name', e.g. "files"."""
+        key = ("kubediff_parsed_%s_total" % (name,), ())
+        items = 0
+        try:
+            for item in iterable:
+                items += 1
+                yield item
+        finally:
+            with self._lock:
+                self._values[key] = self._values.get(key, 0) + items
+
+    def recording(self, timings, context=None):
+        """Return a timings recorder that also observes fetch and diff latencies here.
+
+        :param timings: Where everything is recorded as well, e.g. a
+            ``Timings`` or ``NO_TIMINGS``.
+        """
+        return _Recorder(self, timings, context)
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        series = {}
+        with self._lock:
+            for ((metric, labels), value) in self._values.items():
+                series.setdefault(metric, []).append((labels, value))
+            for ((metric, labels), histogram) in self._histograms.items():
+                series.setdefault(metric, []).append((labels, (list(histogram.counts), histogram.sum)))
+        lines = []
+        for (metric, metric_type, help_text) in METRICS:
+            lines.append("# HELP %s %s" % (metric, help_text))
+            lines.append("# TYPE %s %s" % (metric, metric_type))
+            for (labels, value) in sorted(series.get(metric, ())):
+                if metric_type != "histogram":
+                    lines.append("%s%s %s" % (metric, _format_labels(labels), _format_value(value)))
+                    continue
+                counts, total = value
+                cumulative = 0
+                for (bound, count) in zip(LATENCY_BUCKETS + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("%s_bucket%s %d" % (metric, _format_labels(labels + (("le", le),)), cumulative))
+                lines.append("%s_sum%s %s" % (metric, _format_labels(labels), repr(total)))
+                lines.append("%s_count%s %d" % (metric, _format_labels(labels), cumulative))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to 'path', replacing it at once.
+
+        Suits e.g. the node exporter's textfile collector, which mustn't
+        read half-written files. The file gets the mode new files get, not
+        the owner-only one of temporary files, so that collectors running
+        as other users can read it.
+        """
+        temporary = os.path.join(os.path.dirname(os.path.abspath(path)),
+                                 ".tmp-%s" % (binascii.hexlify(os.urandom(8)).decode('ascii'),))
+        # Unlike mkstemp, leaves the kernel to apply the umask to 0666.
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with io.open(fd, 'w', encoding='utf-8') as stream:
+                stream.write(self.render())
+            getattr(os, "replace", os.rename)(temporary, path)
+        except Exception:
+            os.remove(temporary)
+            raise
+
+
+class _Recorder(object):
+    """Passes timings on to another recorder, observing latencies in ``Metrics`` on the way."""
+
+    def __init__(self, metrics, timings, context):
+        self.metrics = metrics
+        self.timings = timings
+        self.context = context
+
+    def add(self, phase, kind, wall, cpu, count=1):
+        self.metrics.observe(phase, kind, wall, self.context)
+        self.timings.add(phase, kind, wall, cpu, count)
+
+    def measure(self, phase, kind=None):
+        return _Measurement(self, phase, kind)
+
+    def iterate(self, phase, iterable, path=None):
+        return self.timings.iterate(phase, iterable, path)
+
+    def record_object(self, kube_obj, wall):
+        self.timings.record_object(kube_obj, wall)
+
+    def profile(self, function, *args):
+        return self.timings.profile(function, *args)
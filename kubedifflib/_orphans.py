@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
+from ._diff import in_shard, iter_manifest_objects, make_fetcher, open_parse_cache
+from ._kube import KubeObject, fetch_errors
+
+
+#: Objects that Kubernetes creates itself, as patterns over
+#: "kind/namespace/name". Cluster-scoped objects match any namespace.
+DEFAULT_ORPHAN_IGNORES = (
+    "ServiceAccount.v1./*/default",
+    "ConfigMap.v1./*/kube-root-ca.crt",
+    "Secret.v1./*/default-token-*",
+    "Service.v1./default/kubernetes",
+    "Endpoints.v1./default/kubernetes",
+    "EndpointSlice.v1.discovery.k8s.io/default/kubernetes",
+    "Namespace.v1./*/default",
+    "Namespace.v1./*/kube-*",
+    "ClusterRole.v1.rbac.authorization.k8s.io/*/system:*",
+    "ClusterRoleBinding.v1.rbac.authorization.k8s.io/*/system:*",
+    # The user-facing roles every cluster has.
+    "ClusterRole.v1.rbac.authorization.k8s.io/*/cluster-admin",
+    "ClusterRole.v1.rbac.authorization.k8s.io/*/admin",
+    "ClusterRole.v1.rbac.authorization.k8s.io/*/edit",
+    "ClusterRole.v1.rbac.authorization.k8s.io/*/view",
+    "ClusterRoleBinding.v1.rbac.authorization.k8s.io/*/cluster-admin",
+    "Role.v1.rbac.authorization.k8s.io/*/system:*",
+    "RoleBinding.v1.rbac.authorization.k8s.io/*/system:*",
+)
+
+
+def index_manifests(paths, config):
+    """Return the names of the objects defined in 'paths', by kind and namespace.
+
+    Only identities are kept, not the objects' data.
+
+    :return: A dict mapping (kind, namespace) to a set of names.
+    """
+    index = {}
+    cache = open_parse_cache(config)
+    try:
+        # Every shard needs the whole index, to know what other shards define,
+        # and an object outside the scope still isn't an orphan.
+        for (_, kube_obj) in iter_manifest_objects(paths, dict(config, shard=None, scope=None), cache):
+            index.setdefault((kube_obj.kind, kube_obj.namespace), set()).add(kube_obj.name)
+    finally:
+        if cache is not None:
+            cache.prune()
+    return index
+
+
+def find_orphans(paths, config, ignore=DEFAULT_ORPHAN_IGNORES):
+    """Find running objects that no manifest in 'paths' defines.
+
+    Each (kind, namespace) that the manifests define objects in is listed
+    once, asking only for names where the fetcher supports that, and
+    compared to the names the manifests define there. Only the orphans in
+    the shard that 'config' asks for are returned, and only the groups
+    whose kind and namespace are in its scope are listed. The scope's label
+    selector and path globs don't apply, since only names are listed.
+
+    :param dict config: Contains Kubernetes parsing and access configuration.
+    :param ignore: Glob patterns over "kind/namespace/name", e.g.
+        "ConfigMap.v1./*/kube-root-ca.crt". Matching objects aren't reported.
+    :return: (orphans, errors): a sorted list of ``KubeObject``s without
+        data, and a dict mapping the (kind, namespace) groups that couldn't
+        be listed to the error output.
+    """
+    index = index_manifests(paths, config)
+    fetcher = make_fetcher(dict(config, batch=False))
+
+    def list_group(group):
+        names = getattr(fetcher, "versions", fetcher.list)
+        try:
+            return group, names(*group), None
+        except fetch_errors as e:
+            output = getattr(e, "stderr", None) or e.output or b""
+            logging.debug("Failed to list %s in %s: %s", group[0], group[1], output.decode('utf-8').strip())
+            return group, None, output
+
+    scope = config.get("scope")
+    groups = [group for group in sorted(index) if scope is None or scope.matches_identity(*group)]
+    orphans, errors = [], {}
+    with ThreadPoolExecutor(config.get("jobs", 1)) as executor:
+        for ((kind, namespace), running, error) in executor.map(list_group, groups):
+            if error is not None:
+                errors[(kind, namespace)] = error
+                continue
+            for name in sorted(set(running) - index[(kind, namespace)]):
+                kube_obj = KubeObject(namespace, kind, name, None)
+                identity = "%s/%s/%s" % (kind, namespace, name)
+                if in_shard(kube_obj, config.get("shard")) and not any(
+                        fnmatchcase(identity, pattern) for pattern in ignore):
+                    orphans.append(kube_obj)
+    return orphans, errors
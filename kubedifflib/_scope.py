@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import os
+import re
+from fnmatch import fnmatchcase
+from builtins import object, str
+
+
+_REQUIREMENT = re.compile(r"""
+    \s*(?:
+        (?P<absent>!)\s*(?P<absent_key>[^\s,=!()]+)
+      | (?P<set_key>[^\s,=!()]+)\s+(?P<set_op>in|notin)\s*\((?P<values>[^()]*)\)
+      | (?P<key>[^\s,=!()]+)\s*(?:(?P<op>==|=|!=)\s*(?P<value>[^\s,=!()]*))?
+    )\s*(?:,|$)""", re.VERBOSE)
+
+
+class LabelSelector(object):
+    """A label selector, as taken by 'kubectl get --selector'.
+
+    Supports equality ("app=web", "tier!=db"), set ("env in (prod,staging)",
+    "env notin (dev)") and existence ("canary", "!canary") requirements,
+    separated by commas, all of which must hold.
+
+    :raise ValueError: If 'text' isn't a valid selector.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.requirements = []
+        position = 0
+        while position < len(text):
+            match = _REQUIREMENT.match(text, position)
+            if match is None or match.end() == position:
+                raise ValueError("invalid label selector: %r" % (text,))
+            position = match.end()
+            if match.group("absent"):
+                self.requirements.append(("!", match.group("absent_key"), None))
+            elif match.group("set_key"):
+                values = frozenset(v.strip() for v in match.group("values").split(",") if v.strip())
+                self.requirements.append((match.group("set_op"), match.group("set_key"), values))
+            elif match.group("op"):
+                self.requirements.append(("!=" if match.group("op") == "!=" else "=",
+                                          match.group("key"), match.group("value")))
+            else:
+                self.requirements.append(("exists", match.group("key"), None))
+
+    def matches(self, labels):
+        """Return whether a dict of labels meets every requirement."""
+        for (op, key, values) in self.requirements:
+            value = labels.get(key)
+            if value is not None:
+                value = str(value)
+            if op == "exists" and value is None:
+                return False
+            if op == "!" and value is not None:
+                return False
+            if op == "=" and value != values:
+                return False
+            if op == "!=" and value == values:
+                return False
+            if op == "in" and value not in values:
+                return False
+            if op == "notin" and value in values:
+                return False
+        return True
+
+
+def split_path(path):
+    """Split a relative path into its components."""
+    return [part for part in path.replace(os.sep, "/").split("/") if part and part != "."]
+
+
+def match_path_glob(pattern, parts, prefix=False):
+    """Match path components against a glob's components.
+
+    Each component is matched with ``fnmatch``, except "**", which matches
+    any number of components.
+
+    :param bool prefix: Instead, return whether paths under 'parts' could
+        match, so that a directory that couldn't can be skipped.
+    """
+    if not parts:
+        return bool(pattern) if prefix else all(p == "**" for p in pattern)
+    if not pattern:
+        return False
+    if pattern[0] == "**":
+        return match_path_glob(pattern[1:], parts, prefix) or match_path_glob(pattern, parts[1:], prefix)
+    return fnmatchcase(parts[0], pattern[0]) and match_path_glob(pattern[1:], parts[1:], prefix)
+
+
+class Scope(object):
+    """Which objects to check, decided before anything is fetched.
+
+    Empty filters let everything through.
+
+    :param kinds: Kinds to check, fully qualified as in ``KubeObject.kind``
+        ("Deployment.v1.apps") or not ("Deployment"), in any case.
+    :param namespaces: Glob patterns that objects' namespaces must match.
+    :param str selector: A label selector, as for ``LabelSelector``.
+    :param path_globs: Globs over the paths of files under the directories
+        being checked, relative to those directories, e.g. "prod/**/*.yaml".
+        Directories no glob could match files in aren't walked.
+    """
+
+    def __init__(self, kinds=(), namespaces=(), selector=None, path_globs=()):
+        self.kinds = frozenset(kind.lower() for kind in kinds)
+        self.namespaces = tuple(namespaces)
+        self.selector = LabelSelector(selector) if selector else None
+        self.path_globs = [split_path(glob) for glob in path_globs]
+
+    def matches_identity(self, kind, namespace):
+        """Return whether objects of 'kind' in 'namespace' are in scope, labels aside."""
+        if self.kinds and kind.lower() not in self.kinds and kind.split(".", 1)[0].lower() not in self.kinds:
+            return False
+        return not self.namespaces or any(fnmatchcase(namespace, pattern) for pattern in self.namespaces)
+
+    def matches(self, kube_obj):
+        """Return whether 'kube_obj' is in scope."""
+        if not self.matches_identity(kube_obj.kind, kube_obj.namespace):
+            return False
+        if self.selector is None:
+            return True
+        labels = (kube_obj.data.get("metadata") or {}).get("labels") or {}
+        return self.selector.matches(labels)
+
+
+def in_scope(kube_obj, scope):
+    """Return whether 'kube_obj' is in 'scope', which may be None for everything."""
+    return scope is None or scope.matches(kube_obj)
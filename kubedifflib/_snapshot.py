@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from builtins import object
+
+from ._diff import iter_file_objects, iter_yaml_files, make_fetcher
+from ._kube import FetchError, fetch_errors
+from ._scope import in_scope
+
+
+# Bump when what is stored in snapshots changes.
+SNAPSHOT_FORMAT = 2
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE groups (kind TEXT, namespace TEXT, error BLOB, PRIMARY KEY (kind, namespace));
+CREATE TABLE objects (kind TEXT, namespace TEXT, name TEXT, data BLOB, PRIMARY KEY (kind, namespace, name));
+"""
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file can't be read."""
+
+
+# Objects are stored as compressed JSON, which is all the API serves, and
+# never pickled: snapshots are handed around, and reading one mustn't run
+# code from it.
+def _encode(data):
+    return sqlite3.Binary(zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8')))
+
+
+def _decode(blob):
+    """Return the data in 'blob'.
+
+    :raise SnapshotError: If it isn't compressed JSON.
+    """
+    try:
+        return json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
+    except (zlib.error, ValueError) as e:
+        raise SnapshotError("corrupt object in snapshot: %s" % (e,))
+
+
+def iter_groups(paths, config):
+    """Return the (kind, namespace) groups of the objects defined in 'paths'."""
+    groups = set()
+    for path in iter_yaml_files(paths, config.get("scope")):
+        for kube_obj in iter_file_objects(path, config):
+            if in_scope(kube_obj, config.get("scope")):
+                groups.add((kube_obj.kind, kube_obj.namespace))
+    return sorted(groups)
+
+
+def take_snapshot(paths, config, snapshot_path):
+    """Save the running objects of every kind and namespace in 'paths'.
+
+    Each (kind, namespace) group that the manifests define objects in is
+    listed whole, so that the snapshot also serves manifests added later
+    for the same groups. Groups whose list fails are saved with the error,
+    which reading them reports again.
+
+    :param dict config: Contains Kubernetes parsing and access configuration.
+    :param str snapshot_path: Where to write the snapshot. It is replaced
+        only once the snapshot is complete.
+    :return: Number of objects saved.
+    """
+    groups = iter_groups(paths, config)
+    fetcher = make_fetcher(dict(config, batch=False, snapshot=None))
+
+    def list_group(group):
+        try:
+            return group, fetcher.list(*group), None
+        except fetch_errors as e:
+            output = getattr(e, "stderr", None) or e.output or b""
+            logging.warning("Failed to list %s in %s: %s", group[0], group[1], output.decode('utf-8').strip())
+            return group, None, output
+
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    os.close(fd)
+    saved = 0
+    try:
+        connection = sqlite3.connect(temporary)
+        try:
+            connection.executescript(_SCHEMA)
+            connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                ("format", str(SNAPSHOT_FORMAT)),
+                ("taken", repr(time.time())),
+                ("context", config.get("context") or ""),
+            ])
+            with ThreadPoolExecutor(config.get("jobs", 1)) as executor:
+                for ((kind, namespace), items, error) in executor.map(list_group, groups):
+                    connection.execute("INSERT INTO groups VALUES (?, ?, ?)", (
+                        kind, namespace, None if error is None else sqlite3.Binary(error)))
+                    connection.executemany("INSERT INTO objects VALUES (?, ?, ?, ?)", (
+                        (kind, namespace, name, _encode(data)) for (name, data) in (items or {}).items()))
+                    saved += len(items or {})
+            connection.commit()
+        finally:
+            connection.close()
+        getattr(os, "replace", os.rename)(temporary, snapshot_path)
+    except Exception:
+        os.remove(temporary)
+        raise
+    return saved
+
+
+class SnapshotFetcher(object):
+    """Fetch running objects from a snapshot file instead of a cluster.
+
+    Objects are looked up one at a time through the file's index, so the
+    snapshot is never loaded whole. Each thread reads through a connection
+    of its own.
+    """
+
+    def __init__(self, path):
+        if not os.path.isfile(path):
+            raise SnapshotError("%s: no such snapshot" % (path,))
+        self.path = path
+        self._local = threading.local()
+        try:
+            row = self._connection().execute("SELECT value FROM meta WHERE key = 'format'").fetchone()
+        except sqlite3.DatabaseError as e:
+            raise SnapshotError("%s: not a kubediff snapshot: %s" % (path, e))
+        if row is None or row[0] != str(SNAPSHOT_FORMAT):
+            raise SnapshotError("%s: unsupported snapshot format %s" % (path, row and row[0]))
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path)
+        return connection
+
+    def _group(self, kind, namespace):
+        """Raise ``FetchError`` unless the group was listed without errors."""
+        row = self._connection().execute(
+            "SELECT error FROM groups WHERE kind = ? AND namespace = ?", (kind, namespace)).fetchone()
+        if row is None:
+            raise FetchError(('error: %s in namespace "%s" are not in snapshot %s\n' % (
+                kind, namespace, self.path)).encode('utf-8'))
+        if row[0] is not None:
+            raise FetchError(bytes(row[0]))
+
+    def get(self, kube_obj):
+        """Return the running data for 'kube_obj' as it was when the snapshot was taken.
+
+        :raise FetchError: If the object wasn't running, or wasn't captured.
+        """
+        row = self._connection().execute(
+            "SELECT data FROM objects WHERE kind = ? AND namespace = ? AND name = ?",
+            (kube_obj.kind, kube_obj.namespace, kube_obj.name)).fetchone()
+        if row is not None:
+            return _decode(row[0])
+        self._group(kube_obj.kind, kube_obj.namespace)
+        raise FetchError(('Error from server (NotFound): %s "%s" not found\n' % (
+            kube_obj.kind, kube_obj.name)).encode('utf-8'))
+
+    def list(self, kind, namespace):
+        """Return a dict mapping names to data for all objects of 'kind' in 'namespace'."""
+        self._group(kind, namespace)
+        rows = self._connection().execute(
+            "SELECT name, data FROM objects WHERE kind = ? AND namespace = ?", (kind, namespace))
+        return dict((name, _decode(data)) for (name, data) in rows)
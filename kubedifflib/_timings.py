@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import cProfile
+import heapq
+import itertools
+import math
+import threading
+import time
+from builtins import object
+
+
+wall_clock = getattr(time, "perf_counter", time.time)
+# CPU time of the calling thread where Python can tell, so that work done on
+# fetch workers isn't counted against each other.
+cpu_clock = getattr(time, "thread_time", None) or getattr(time, "process_time", None) or time.clock
+
+#: Phases in the order they happen in a run.
+PHASES = ("discover", "parse", "fetch", "diff", "print")
+
+
+class _Measurement(object):
+    """Times a 'with' block and records it in a ``Timings``."""
+
+    __slots__ = ('timings', 'phase', 'kind', 'wall', '_wall', '_cpu')
+
+    def __init__(self, timings, phase, kind):
+        self.timings = timings
+        self.phase = phase
+        self.kind = kind
+        self.wall = 0.0
+
+    def __enter__(self):
+        self._wall = wall_clock()
+        self._cpu = cpu_clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall = wall_clock() - self._wall
+        self.timings.add(self.phase, self.kind, self.wall, cpu_clock() - self._cpu)
+        return False
+
+
+def percentile(ordered, fraction):
+    """Return the nearest-rank percentile of the sorted list 'ordered'."""
+    if not ordered:
+        return None
+    rank = max(int(math.ceil(fraction * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+class Timings(object):
+    """Records where the time of a run goes.
+
+    Wall and CPU time are added up per phase (see ``PHASES``), and for
+    fetching and diffing also per object kind. Fetch latencies are kept for
+    percentiles, along with the 'slowest' objects and files. Phases run on
+    several threads at once with ``--jobs``, so their times can add up to
+    more than the run's.
+
+    :param int slowest: How many of the slowest objects and files to keep.
+    :param bool profile: Whether to run the diff engine under cProfile.
+    """
+
+    def __init__(self, slowest=10, profile=False):
+        self.slowest = slowest
+        self.started = wall_clock()
+        self._phases = {}
+        self._kinds = {}
+        self._latencies = []
+        self._slow = {"objects": [], "files": []}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._profiler = cProfile.Profile() if profile else None
+        self._profile_lock = threading.Lock()
+
+    def add(self, phase, kind, wall, cpu, count=1):
+        """Add 'count' calls taking 'wall' and 'cpu' seconds to 'phase'."""
+        with self._lock:
+            totals = self._phases.setdefault(phase, [0, 0.0, 0.0])
+            totals[0] += count
+            totals[1] += wall
+            totals[2] += cpu
+            if kind is not None:
+                totals = self._kinds.setdefault((kind, phase), [0, 0.0, 0.0])
+                totals[0] += count
+                totals[1] += wall
+                totals[2] += cpu
+                if phase == "fetch":
+                    self._latencies.append(wall)
+
+    def measure(self, phase, kind=None):
+        """Return a context manager that times its block as a call in 'phase'.
+
+        Its 'wall' attribute holds the block's wall time once it has run.
+        """
+        return _Measurement(self, phase, kind)
+
+    def iterate(self, phase, iterable, path=None):
+        """Yield from 'iterable', counting the time spent getting items as 'phase'.
+
+        With 'path', the whole iteration counts as one call, and is a
+        candidate for the slowest files; otherwise each item counts as one.
+        """
+        iterator = iter(iterable)
+        wall = cpu = 0.0
+        items = 0
+        try:
+            while True:
+                start_wall, start_cpu = wall_clock(), cpu_clock()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    wall += wall_clock() - start_wall
+                    cpu += cpu_clock() - start_cpu
+                items += 1
+                yield item
+        finally:
+            self.add(phase, None, wall, cpu, items if path is None else 1)
+            if path is not None:
+                self._keep_slow("files", wall, {"file": path})
+
+    def record_object(self, kube_obj, wall):
+        """Note that fetching and diffing 'kube_obj' took 'wall' seconds."""
+        self._keep_slow("objects", wall, {"kind": kube_obj.kind, "name": kube_obj.namespaced_name})
+
+    def _keep_slow(self, category, wall, description):
+        entry = (wall, next(self._counter), description)
+        with self._lock:
+            slow = self._slow[category]
+            if len(slow) < self.slowest:
+                heapq.heappush(slow, entry)
+            elif slow and entry > slow[0]:
+                heapq.heapreplace(slow, entry)
+
+    def profile(self, function, *args):
+        """Return 'function(*args)', run under the profiler if there is one.
+
+        cProfile only follows one thread, so profiled calls run one at a time.
+        """
+        if self._profiler is None:
+            return function(*args)
+        with self._profile_lock:
+            return self._profiler.runcall(function, *args)
+
+    def dump_profile(self, path):
+        """Write the profile of the diff engine to 'path', for ``pstats``."""
+        self._profiler.dump_stats(path)
+
+    def report(self):
+        """Return what was recorded as a JSON-serializable dict."""
+        with self._lock:
+            phases = dict((phase, {"calls": calls, "wall": wall, "cpu": cpu})
+                          for (phase, (calls, wall, cpu)) in self._phases.items())
+            kinds = {}
+            for ((kind, phase), (calls, wall, cpu)) in self._kinds.items():
+                kinds.setdefault(kind, {})[phase] = {"calls": calls, "wall": wall, "cpu": cpu}
+            latencies = sorted(self._latencies)
+            slow = dict((category, [dict(description, seconds=wall)
+                                    for (wall, _, description) in sorted(entries, reverse=True)])
+                        for (category, entries) in self._slow.items())
+        return {
+            "wall": wall_clock() - self.started,
+            "phases": phases,
+            "kinds": kinds,
+            "fetch_latency": {
+                "count": len(latencies),
+                "p50": percentile(latencies, 0.5),
+                "p90": percentile(latencies, 0.9),
+                "p99": percentile(latencies, 0.99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "slowest_objects": slow["objects"],
+            "slowest_files": slow["files"],
+        }
+
+
+def _ms(seconds):
+    return "-" if seconds is None else "%.1fms" % (seconds * 1000)
+
+
+def format_timings(report):
+    """Format a ``Timings.report()`` as text."""
+    lines = ["Timings (%.2fs total)" % report["wall"], ""]
+    lines.append("%-40s %8s %12s %12s" % ("Phase", "Calls", "Wall", "CPU"))
+    phases = report["phases"]
+    for phase in sorted(phases, key=lambda p: (PHASES.index(p) if p in PHASES else len(PHASES), p)):
+        totals = phases[phase]
+        lines.append("%-40s %8d %11.3fs %11.3fs" % (phase, totals["calls"], totals["wall"], totals["cpu"]))
+    for kind in sorted(report["kinds"]):
+        for (phase, totals) in sorted(report["kinds"][kind].items()):
+            lines.append("%-40s %8d %11.3fs %11.3fs" % (
+                "  %s %s" % (phase, kind), totals["calls"], totals["wall"], totals["cpu"]))
+    latency = report["fetch_latency"]
+    lines.append("")
+    lines.append("Fetch latency over %d objects: p50 %s, p90 %s, p99 %s, max %s" % (
+        latency["count"], _ms(latency["p50"]), _ms(latency["p90"]), _ms(latency["p99"]), _ms(latency["max"])))
+    if report["slowest_objects"]:
+        lines.extend(["", "Slowest objects (fetch and diff):"])
+        for entry in report["slowest_objects"]:
+            lines.append("  %10s  %s '%s'" % (_ms(entry["seconds"]), entry["kind"], entry["name"]))
+    if report["slowest_files"]:
+        lines.extend(["", "Slowest files (parse):"])
+        for entry in report["slowest_files"]:
+            lines.append("  %10s  %s" % (_ms(entry["seconds"]), entry["file"]))
+    return "\n".join(lines)
+
+
+class _NotMeasured(object):
+    """A context manager that measures nothing."""
+
+    wall = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NoTimings(object):
+    """Stands in for ``Timings`` when nothing is to be recorded."""
+
+    _not_measured = _NotMeasured()
+
+    def add(self, phase, kind, wall, cpu, count=1):
+        pass
+
+    def measure(self, phase, kind=None):
+        return self._not_measured
+
+    def iterate(self, phase, iterable, path=None):
+        return iterable
+
+    def record_object(self, kube_obj, wall):
+        pass
+
+    def profile(self, function, *args):
+        return function(*args)
+
+
+NO_TIMINGS = NoTimings()
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import collections
+import io
+import logging
+import os
+import threading
+import time
+from future.moves.http.server import BaseHTTPRequestHandler, HTTPServer
+from future.moves.queue import Empty, Queue
+from builtins import object
+
+from ._diff import (
+    JSONPrinter,
+    QuietTextPrinter,
+    check_object,
+    diff,
+    in_shard,
+    iter_file_objects,
+    iter_yaml_files,
+    make_fetcher,
+)
+from ._kube import KubectlFetcher, fetch_errors
+from ._scope import in_scope
+from ._timings import NO_TIMINGS
+
+
+def _resource_version(obj):
+    return (obj.get("metadata") or {}).get("resourceVersion")
+
+
+class APIWatchFeed(object):
+    """List and watch objects through the Kubernetes API."""
+
+    #: Seconds to wait after a watch ends before listing again.
+    relist_interval = 0
+
+    def __init__(self, client, timeout=300):
+        self.client = client
+        self.timeout = timeout
+
+    def list(self, kind, namespace):
+        """Return (items, resource_version) for objects of 'kind' in 'namespace'."""
+        return self.client.list_versioned(kind, namespace)
+
+    def watch(self, kind, namespace, resource_version):
+        """Yield (type, object) for changes since 'resource_version'."""
+        return self.client.watch(kind, namespace, resource_version, self.timeout)
+
+
+class PollingFeed(object):
+    """List and 'watch' objects with a fetcher that can only list.
+
+    Its watches end at once without events, so that informers list again
+    every 'period' seconds and find what changed themselves.
+    """
+
+    def __init__(self, fetcher, period=60):
+        self.fetcher = fetcher
+        self.relist_interval = period
+
+    def list(self, kind, namespace):
+        return self.fetcher.list(kind, namespace), None
+
+    def watch(self, kind, namespace, resource_version):
+        return iter(())
+
+
+class Informer(object):
+    """Keep a live copy of all objects of one kind in one namespace.
+
+    Runs list+watch on a thread of its own, and calls 'on_change' with the
+    name of each object whose resourceVersion changed. Failures are logged
+    and retried after 'retry' seconds; until a list succeeds, the group has
+    no objects.
+    """
+
+    def __init__(self, feed, kind, namespace, on_change, retry=5):
+        self.feed = feed
+        self.kind = kind
+        self.namespace = namespace
+        self.on_change = on_change
+        self.retry = retry
+        self.objects = {}
+        self.synced = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _relist(self):
+        items, resource_version = self.feed.list(self.kind, self.namespace)
+        before, self.objects = self.objects, items
+        if not self.synced.is_set():
+            # Nothing has been diffed against this group yet.
+            self.synced.set()
+            return resource_version
+        for name in set(before) | set(items):
+            old, new = before.get(name), items.get(name)
+            if old is None or new is None or _resource_version(old) != _resource_version(new) or old != new:
+                self.on_change(name)
+        return resource_version
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                resource_version = self._relist()
+                for (event_type, obj) in self.feed.watch(self.kind, self.namespace, resource_version):
+                    if self._stopped.is_set():
+                        return
+                    if event_type == "ERROR":
+                        # Usually "410 Gone": our version is too old, list again.
+                        break
+                    name = obj["metadata"]["name"]
+                    if event_type == "DELETED":
+                        self.objects.pop(name, None)
+                    else:
+                        self.objects[name] = obj
+                    self.on_change(name)
+                else:
+                    self._stopped.wait(getattr(self.feed, "relist_interval", 0))
+            except Exception as e:
+                # Malformed events and lists too, so that the group keeps
+                # being retried, and checks waiting for it go on.
+                if isinstance(e, fetch_errors):
+                    logging.warning("Failed to watch %s in %s: %s", self.kind, self.namespace,
+                                    e.output.decode('utf-8').strip())
+                else:
+                    logging.exception("Failed to watch %s in %s.", self.kind, self.namespace)
+                self.synced.set()
+                self._stopped.wait(self.retry)
+
+
+class Watcher(object):
+    """Keep the differences between manifests and a cluster up to date.
+
+    Manifests are parsed once and then again only when their file changes.
+    Live objects are kept in a cache filled by one ``Informer`` per kind and
+    namespace, and an object is diffed again only when its manifest or its
+    live version changes.
+
+    :param paths: Paths to the manifests.
+    :param dict config: Contains Kubernetes parsing and access configuration.
+    :param feed: Lists and watches live objects, e.g. an ``APIWatchFeed``.
+    :param fetcher: Fetches single objects whose list failed, so that errors
+        are reported as ``check_files`` reports them.
+
+    If 'config' has ``Metrics``, they are kept up to date with the report.
+    """
+
+    def __init__(self, paths, config, feed, fetcher):
+        self.paths = paths
+        self.config = config
+        self.feed = feed
+        self.fetcher = fetcher
+        # path -> (stat, [[kube_obj, differences]]), in the order check_files reports them
+        self._files = collections.OrderedDict()
+        self._by_id = {}       # (kind, namespace, name) -> [[kube_obj, differences]]
+        self._informers = {}
+        self._changes = Queue()
+        self._lock = threading.Lock()
+        self._metrics = config.get("metrics")
+        self._timings = NO_TIMINGS if self._metrics is None else self._metrics.recording(NO_TIMINGS, config.get("context"))
+        self.diffs = 0
+
+    def _informer(self, kind, namespace):
+        key = (kind, namespace)
+        if key not in self._informers:
+            def on_change(name):
+                self._changes.put((kind, namespace, name))
+            self._informers[key] = Informer(self.feed, kind, namespace, on_change).start()
+        return self._informers[key]
+
+    def _check(self, kube_obj):
+        self.diffs += 1
+        informer = self._informer(kube_obj.kind, kube_obj.namespace)
+        informer.synced.wait()
+        running = informer.objects.get(kube_obj.name)
+        if running is None:
+            # Reports "not found" (or why the list failed) as check_files would.
+            differences = check_object(self.fetcher, kube_obj, self._timings)
+        else:
+            with self._timings.measure("diff", kube_obj.kind):
+                differences = list(diff((), kube_obj.data, running))
+        if self._metrics is not None:
+            self._metrics.record_object(kube_obj, differences, self.config.get("context"))
+        return differences
+
+    def _forget(self, path):
+        if self._metrics is not None and path in self._files:
+            for (kube_obj, _) in self._files[path][1]:
+                self._metrics.forget_object(kube_obj, self.config.get("context"))
+
+    def _index(self):
+        self._by_id = {}
+        for (_, entries) in self._files.values():
+            for entry in entries:
+                kube_obj = entry[0]
+                self._by_id.setdefault((kube_obj.kind, kube_obj.namespace, kube_obj.name), []).append(entry)
+
+    def scan(self):
+        """Parse new and changed manifest files, and diff their objects.
+
+        :return: True if anything changed.
+        """
+        changed = False
+        seen = set()
+        paths = iter_yaml_files(self.paths, self.config.get("scope"))
+        if self._metrics is not None:
+            paths = self._metrics.count("files", paths)
+        for path in paths:
+            seen.add(path)
+            stat = os.stat(path)
+            stat = (stat.st_mtime, stat.st_size)
+            if path in self._files and self._files[path][0] == stat:
+                continue
+            try:
+                objects = iter_file_objects(path, self.config)
+                if self._metrics is not None:
+                    objects = self._metrics.count("documents", objects)
+                entries = [[kube_obj, None] for kube_obj in objects
+                           if in_shard(kube_obj, self.config.get("shard")) and in_scope(kube_obj, self.config.get("scope"))]
+            except Exception:
+                # Keep reporting what we had until the file is fixed.
+                logging.exception("Failed parsing %s.", path)
+                continue
+            self._forget(path)
+            for entry in entries:
+                entry[1] = self._check(entry[0])
+            with self._lock:
+                self._files[path] = (stat, entries)
+            changed = True
+        for path in set(self._files) - seen:
+            self._forget(path)
+            with self._lock:
+                del self._files[path]
+            changed = True
+        if changed:
+            self._index()
+        return changed
+
+    def update(self, timeout=None):
+        """Diff again the objects whose live versions changed.
+
+        Waits up to 'timeout' seconds for the first change.
+
+        :return: True if anything changed.
+        """
+        changed = set()
+        try:
+            changed.add(self._changes.get(timeout=timeout))
+            while True:
+                changed.add(self._changes.get_nowait())
+        except Empty:
+            pass
+        for key in changed:
+            for entry in self._by_id.get(key, []):
+                differences = self._check(entry[0])
+                with self._lock:
+                    entry[1] = differences
+        return bool(changed)
+
+    def report(self, printer):
+        """Report the current differences to 'printer'.
+
+        :return: Number of differences found.
+        """
+        with self._lock:
+            files = [(path, list(entries)) for (path, (_, entries)) in self._files.items()]
+        differences = 0
+        for (path, entries) in files:
+            for (kube_obj, found) in entries:
+                printer.add(path, kube_obj)
+                for difference in found:
+                    differences += 1
+                    printer.diff(path, difference)
+        printer.finish()
+        return differences
+
+    def run(self, on_change, interval=10):
+        """Keep the report up to date, calling 'on_change()' whenever it changes.
+
+        Manifest files are checked for changes every 'interval' seconds.
+        """
+        self.scan()
+        on_change()
+        next_scan = time.time() + interval
+        while True:
+            changed = self.update(timeout=max(next_scan - time.time(), 0))
+            if time.time() >= next_scan:
+                changed = self.scan() or changed
+                next_scan = time.time() + interval
+            if changed:
+                on_change()
+
+    def stop(self):
+        for informer in self._informers.values():
+            informer.stop()
+
+
+def make_watcher(paths, config, interval=60):
+    """Return a ``Watcher`` using the backend that 'config' asks for.
+
+    With the kubectl backend, live objects are listed again every
+    'interval' seconds rather than watched.
+    """
+    fetcher = make_fetcher(dict(config, batch=False))
+    if isinstance(fetcher, KubectlFetcher):
+        feed = PollingFeed(fetcher, interval)
+    else:
+        feed = APIWatchFeed(fetcher.client)
+    return Watcher(paths, config, feed, fetcher)
+
+
+def serve_report(watcher, address):
+    """Serve the current report of 'watcher' over HTTP, on a thread of its own.
+
+    "/" serves the report as text, and "/json" as JSON. If the watcher's
+    config has ``Metrics``, "/metrics" serves them for Prometheus.
+
+    :param str address: "host:port" to listen on.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            metrics = watcher.config.get("metrics")
+            if path == "/metrics":
+                if metrics is None:
+                    self.send_error(404)
+                    return
+                content_type, body = "text/plain; version=0.0.4", metrics.render().encode('utf-8')
+            else:
+                stream = io.StringIO()
+                if path == "/json":
+                    content_type, printer = "application/json", JSONPrinter(stream)
+                else:
+                    content_type, printer = "text/plain", QuietTextPrinter(stream)
+                watcher.report(printer)
+                body = stream.getvalue().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", content_type + "; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    host, port = address.rsplit(":", 1)
+    server = HTTPServer((host, int(port)), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import io
+import json
+import subprocess
+import sys
+import threading
+from future.moves.http.server import BaseHTTPRequestHandler, HTTPServer
+from future.moves.queue import Queue
+from future.moves.socketserver import ThreadingMixIn
+
+import pytest
+import yaml
+
+from kubedifflib import _kube, check_files, QuietTextPrinter
+
+
+# Coroutines are a syntax error on older Pythons.
+collect_ignore = ["test_async.py"] if sys.version_info < (3, 5) else []
+
+
+def make_deployment(name, namespace="default", replicas=1):
+    """Return the data for a minimal Deployment."""
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {"name": name, "namespace": namespace},
+        "spec": {"replicas": replicas},
+    }
+
+
+@pytest.fixture
+def deployment():
+    """Return a function that makes minimal Deployments."""
+    return make_deployment
+
+
+@pytest.fixture
+def write_manifests(tmpdir):
+    """Return a function that writes 'count' files with two Deployments each.
+
+    The function returns the directory the files were written to.
+    """
+    def write(count):
+        directory = tmpdir.mkdir("manifests")
+        for i in range(count):
+            docs = [make_deployment("app-%d-a" % i), make_deployment("app-%d-b" % i, replicas=2)]
+            directory.join("app-%03d.yaml" % i).write(yaml.safe_dump_all(docs))
+        return str(directory)
+    return write
+
+
+@pytest.fixture
+def run_check():
+    """Return a function that runs 'check_files' on a path.
+
+    The function takes config options as keyword arguments, and returns
+    whether differences were found along with the printed output.
+    """
+    def run(path, **options):
+        stream = io.StringIO()
+        config = {"kubeconfig": None, "context": None, "namespace": "default"}
+        config.update(options)
+        failed = check_files([path], QuietTextPrinter(stream), config)
+        return failed, stream.getvalue()
+    return run
+
+
+class FakeKubectl(object):
+    """Stand-in for 'subprocess.check_output' that serves canned objects.
+
+    Set 'list_error' to make list calls fail with that output. Lists asking
+    for custom columns get each object's name and resourceVersion.
+    """
+
+    def __init__(self, objects=()):
+        self.objects = list(objects)
+        self.calls = []
+        self.list_error = None
+
+    def __call__(self, command, stderr=None):
+        self.calls.append(command)
+        namespace = [arg for arg in command if arg.startswith("--namespace=")][0].split("=", 1)[1]
+        positional = [arg for arg in command[2:] if not arg.startswith("-")]
+        items = [obj for obj in self.objects if obj["metadata"]["namespace"] == namespace]
+        if len(positional) == 1:
+            if self.list_error is not None:
+                raise subprocess.CalledProcessError(1, command, self.list_error.encode('utf-8'))
+            if any(arg.startswith("-o=custom-columns=") for arg in command):
+                return "".join("%s   %s\n" % (obj["metadata"]["name"], obj["metadata"].get("resourceVersion", "<none>"))
+                               for obj in items).encode('utf-8')
+            return yaml.safe_dump({"apiVersion": "v1", "kind": "List", "items": items}).encode('utf-8')
+        [_, name] = positional
+        for item in items:
+            if item["metadata"]["name"] == name:
+                return yaml.safe_dump(item).encode('utf-8')
+        output = 'Error from server (NotFound): deployments.apps "%s" not found\n' % name
+        raise subprocess.CalledProcessError(1, command, output.encode('utf-8'))
+
+
+@pytest.fixture
+def kubectl(monkeypatch):
+    """Replace kubectl with a 'FakeKubectl' with no objects."""
+    fake = FakeKubectl()
+    monkeypatch.setattr(_kube.subprocess, "check_output", fake)
+    return fake
+
+
+@pytest.fixture
+def fake_kubectl():
+    """Return a function that makes 'FakeKubectl's, for tests needing several clusters."""
+    return FakeKubectl
+
+
+class FakeFeed(object):
+    """A watch feed serving canned objects, and the events put in 'events'."""
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.events = Queue()
+        self.lists = 0
+
+    def list(self, kind, namespace):
+        self.lists += 1
+        return dict((obj["metadata"]["name"], obj) for obj in self.objects), "1"
+
+    def watch(self, kind, namespace, resource_version):
+        while True:
+            yield self.events.get()
+
+
+@pytest.fixture
+def fake_feed():
+    """Return a function that makes 'FakeFeed's from lists of objects."""
+    return FakeFeed
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeAPIServer(object):
+    """A plain-HTTP stand-in for the Kubernetes API, serving canned objects.
+
+    Set 'discovery_status' to make discovery requests fail with that status.
+    """
+
+    def __init__(self, objects=()):
+        self.objects = list(objects)
+        self.discovery_status = None
+        self.requests = []
+        self.connections = set()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                fake.requests.append(self.path)
+                fake.connections.add(self.client_address)
+                status, body = fake.respond(self.path)
+                body = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def respond(self, path):
+        path = path.split("?", 1)[0]
+        if self.discovery_status is not None and path in ("/api/v1", "/apis/apps/v1"):
+            return self.discovery_status, {"kind": "Status", "status": "Failure", "reason": "Forbidden",
+                                           "code": self.discovery_status, "message": "forbidden"}
+        if path == "/api/v1":
+            return 200, {"kind": "APIResourceList", "resources": [
+                {"name": "services", "kind": "Service", "namespaced": True},
+                {"name": "namespaces", "kind": "Namespace", "namespaced": False},
+            ]}
+        if path == "/apis/apps/v1":
+            return 200, {"kind": "APIResourceList", "resources": [
+                {"name": "deployments", "kind": "Deployment", "namespaced": True},
+                {"name": "deployments/status", "kind": "Deployment", "namespaced": True},
+            ]}
+        parts = path.strip("/").split("/")
+        if parts[:3] == ["apis", "apps", "v1"] and len(parts) >= 6 and parts[3] == "namespaces":
+            namespace = parts[4]
+            items = [obj for obj in self.objects if obj["metadata"]["namespace"] == namespace]
+            if len(parts) == 6:
+                return 200, {"apiVersion": "apps/v1", "kind": "DeploymentList", "items": [
+                    dict((k, v) for (k, v) in obj.items() if k not in ("apiVersion", "kind")) for obj in items]}
+            for obj in items:
+                if obj["metadata"]["name"] == parts[6]:
+                    return 200, obj
+            return 404, {"kind": "Status", "status": "Failure", "reason": "NotFound", "code": 404,
+                         "message": 'deployments.apps "%s" not found' % parts[6]}
+        return 404, {"kind": "Status", "status": "Failure", "reason": "NotFound", "code": 404,
+                     "message": "the server could not find the requested resource"}
+
+    def kubeconfig(self, tmpdir):
+        """Write a kubeconfig for this server and return its path."""
+        path = tmpdir.join("kubeconfig")
+        path.write(yaml.safe_dump({
+            "apiVersion": "v1",
+            "kind": "Config",
+            "current-context": "fake",
+            "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake"}}],
+            "clusters": [{"name": "fake", "cluster": {"server": self.url}}],
+            "users": [{"name": "fake", "user": {"token": "secret"}}],
+        }))
+        return str(path)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def apiserver():
+    """Run a 'FakeAPIServer' with no objects."""
+    fake = FakeAPIServer()
+    yield fake
+    fake.close()
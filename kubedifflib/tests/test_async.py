@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from kubedifflib import check_files_async, QuietTextPrinter
+
+
+FAKE_KUBECTL = """#!%(python)s
+import json
+import os
+import sys
+import time
+
+with open(%(state)r) as stream:
+    state = json.load(stream)
+with open(%(pids)r, "a") as stream:
+    stream.write("%%d\\n" %% os.getpid())
+args = sys.argv[2:]
+namespace = [arg for arg in args if arg.startswith("--namespace=")][0].split("=", 1)[1]
+[kind, name] = [arg for arg in args if not arg.startswith("-")]
+time.sleep(state["delays"].get(name, 0))
+for obj in state["objects"]:
+    if obj["metadata"]["namespace"] == namespace and obj["metadata"]["name"] == name:
+        print(json.dumps(obj))
+        sys.exit(0)
+print('Error from server (NotFound): deployments.apps "%%s" not found' %% name)
+sys.exit(1)
+"""
+
+
+@pytest.fixture
+def kubectl_command(tmpdir, monkeypatch):
+    """Put a kubectl on $PATH that serves objects, as 'FakeKubectl' does.
+
+    Returns a function taking the objects, and a dict mapping names to how
+    many seconds fetching them takes. Its 'pids' attribute returns the
+    process IDs of the kubectls started so far.
+    """
+    directory = tmpdir.mkdir("bin")
+    state = str(tmpdir.join("kubectl.json"))
+    pids = tmpdir.join("kubectl.pids")
+    pids.write("")
+    script = directory.join("kubectl")
+    script.write(FAKE_KUBECTL % {"python": sys.executable, "state": state, "pids": str(pids)})
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", "%s%s%s" % (directory, os.pathsep, os.environ.get("PATH", "")))
+
+    def serve(objects, delays=None):
+        with open(state, "w") as stream:
+            json.dump({"objects": objects, "delays": delays or {}}, stream)
+    serve.pids = lambda: [int(pid) for pid in pids.read().split()]
+    return serve
+
+
+def run(coroutine):
+    """Run 'coroutine' on an event loop of its own, and close the loop.
+
+    Unlike ``asyncio.run``, which needs Python 3.7, leaves tasks still
+    running when the coroutine returns as they are.
+    """
+    loop = asyncio.new_event_loop()
+    # Subprocesses need the loop to be the current one before Python 3.8.
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class AsyncPrinter(object):
+    """Collects what it is given, through coroutines."""
+
+    def __init__(self):
+        self.reported = []
+
+    async def add(self, path, kube_obj):
+        self.reported.append(kube_obj.name)
+
+    async def diff(self, path, difference):
+        self.reported.append(difference.to_text(""))
+
+    async def finish(self):
+        self.reported.append(None)
+
+
+def config(**options):
+    config = {"kubeconfig": None, "context": None, "namespace": "default"}
+    config.update(options)
+    return config
+
+
+def test_async_checks_match_sync_checks(kubectl, kubectl_command, deployment, write_manifests, run_check):
+    path = write_manifests(4)
+    kubectl.objects = [deployment("app-%d-a" % i, replicas=i) for i in range(3)] + [deployment("app-0-b")]
+    kubectl_command(kubectl.objects)
+    expected = run_check(path)
+    for jobs in (1, 3):
+        stream = io.StringIO()
+        failed = run(check_files_async([path], QuietTextPrinter(stream), config(jobs=jobs)))
+        assert (failed, stream.getvalue()) == expected
+    printer = AsyncPrinter()
+    assert run(check_files_async([path], printer, config(jobs=2)))
+    assert sum(1 for item in printer.reported if item and item.startswith("app-")) == 8
+    assert printer.reported[-1] is None
+
+
+def test_fetches_time_out_per_object(kubectl_command, deployment, write_manifests):
+    path = write_manifests(1)
+    kubectl_command([deployment("app-0-a"), deployment("app-0-b", replicas=2)], {"app-0-a": 30})
+    stream = io.StringIO()
+    started = time.time()
+    failed = run(check_files_async([path], QuietTextPrinter(stream), config(jobs=2), timeout=1))
+    assert time.time() - started < 10
+    assert failed
+    assert stream.getvalue() == (
+        "## default/app-0-a (Deployment.v1.apps)\n\n"
+        "Timed out fetching Deployment.v1.apps 'default/app-0-a' after 1 seconds\n\n")
+
+
+def test_cancelling_stops_the_fetches(kubectl_command, deployment, write_manifests):
+    path = write_manifests(3)
+    kubectl_command([], dict(("app-%d-%s" % (i, s), 30) for i in range(3) for s in "ab"))
+
+    async def cancel():
+        task = asyncio.ensure_future(check_files_async([path], AsyncPrinter(), config(jobs=4)))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # Killed and reaped by now, not only once the loop winds down.
+        assert kubectl_command.pids()
+        assert [pid for pid in kubectl_command.pids() if alive(pid)] == []
+
+    started = time.time()
+    run(cancel())
+    assert time.time() - started < 10
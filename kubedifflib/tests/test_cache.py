@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import datetime
+import os
+import pickle
+
+import yaml
+
+from kubedifflib import ParseCache, ResultCache
+from kubedifflib._diff import Difference, NOT_EQUAL
+from kubedifflib._kube import KubectlFetcher, KubeObject
+
+
+def parse_counter(path):
+    """Return a parse function for 'path' that counts its calls."""
+    calls = []
+
+    def parse():
+        calls.append(path)
+        with open(path, 'r') as stream:
+            for data in yaml.safe_load_all(stream):
+                for kube_obj in KubeObject.from_dict(data, "default"):
+                    yield kube_obj
+    return parse, calls
+
+
+def write(path, data, mtime):
+    with open(path, 'w') as stream:
+        stream.write(yaml.safe_dump(data))
+    os.utime(path, (mtime, mtime))
+
+
+def test_unchanged_files_are_not_parsed_again(tmpdir, deployment):
+    path = str(tmpdir.join("app.yaml"))
+    write(path, deployment("app"), 1000)
+    cache = ParseCache(str(tmpdir.join("cache")))
+    parse, calls = parse_counter(path)
+    first = cache.load(path, "default", parse)
+    assert cache.load(path, "default", parse) == first
+    assert len(calls) == 1
+
+    # Touched but unchanged: hashed, not parsed.
+    os.utime(path, (2000, 2000))
+    assert cache.load(path, "default", parse) == first
+    assert len(calls) == 1
+
+    write(path, deployment("app", replicas=2), 3000)
+    [kube_obj] = cache.load(path, "default", parse)
+    assert kube_obj.data["spec"]["replicas"] == 2
+    assert len(calls) == 2
+
+
+def test_files_that_log_errors_are_not_cached(tmpdir):
+    path = str(tmpdir.join("broken.yaml"))
+    write(path, {"kind": "Deployment", "metadata": {"name": "app"}}, 1000)
+    cache = ParseCache(str(tmpdir.join("cache")))
+    parse, calls = parse_counter(path)
+    assert cache.load(path, "default", parse) == []
+    assert cache.load(path, "default", parse) == []
+    assert len(calls) == 2
+
+
+def test_prune_keeps_most_recent_entries(tmpdir, deployment):
+    cache = ParseCache(str(tmpdir.join("cache")), max_entries=2)
+    for i in range(4):
+        path = str(tmpdir.join("app-%d.yaml" % i))
+        write(path, deployment("app-%d" % i), 1000)
+        cache.load(path, "default", parse_counter(path)[0])
+    cache.prune()
+    assert len(os.listdir(cache.directory)) == 2
+
+
+def test_check_files_with_cache_matches_without(tmpdir, kubectl, deployment, write_manifests, run_check):
+    path = write_manifests(5)
+    kubectl.objects = [deployment("app-1-a")]
+    expected = run_check(path)
+    cache_dir = str(tmpdir.join("cache"))
+    assert run_check(path, cache_dir=cache_dir) == expected
+    assert run_check(path, cache_dir=cache_dir) == expected
+
+
+def versioned(kube_obj, version):
+    kube_obj["metadata"]["resourceVersion"] = version
+    return kube_obj
+
+
+def test_result_cache_skips_unchanged_objects(tmpdir, kubectl, deployment, write_manifests, run_check):
+    path = write_manifests(3)
+    kubectl.objects = [versioned(deployment("app-%d-%s" % (i, suffix)), "1") for i in range(3) for suffix in "ab"]
+    kubectl.objects.append(deployment("unversioned"))
+    expected = run_check(path)
+    options = {"cache_dir": str(tmpdir.join("cache")), "result_cache": True}
+    assert run_check(path, **options) == expected
+    del kubectl.calls[:]
+    assert run_check(path, **options) == expected
+    # Only the metadata list: every object was unchanged.
+    assert len(kubectl.calls) == 1
+
+    # A running object changed.
+    kubectl.objects[1] = versioned(deployment("app-0-b", replicas=2), "2")
+    del kubectl.calls[:]
+    failed, output = run_check(path, **options)
+    assert output.count("## ") == expected[1].count("## ") - 1
+    assert len(kubectl.calls) == 2
+
+
+def test_result_cache_notices_changed_manifests_and_settings(tmpdir, kubectl, deployment):
+    [kube_obj] = KubeObject.from_dict(deployment("app"), "default")
+    kubectl.objects = [versioned(deployment("app"), "7")]
+    cache = ResultCache(str(tmpdir), "cluster", "settings")
+    fetcher = KubectlFetcher()
+    assert cache.lookup(fetcher, kube_obj) is None
+    cache.store(kube_obj, kubectl.objects[0], [Difference(NOT_EQUAL, ("spec", "replicas"), 1, 2)])
+    assert [repr(d) for d in cache.lookup(fetcher, kube_obj)] == [repr(Difference(NOT_EQUAL, ("spec", "replicas"), 1, 2))]
+
+    [changed] = KubeObject.from_dict(deployment("app", replicas=3), "default")
+    assert cache.lookup(fetcher, changed) is None
+    assert ResultCache(str(tmpdir), "cluster", "other settings").lookup(fetcher, kube_obj) is None
+    assert ResultCache(str(tmpdir), "other cluster", "settings").lookup(fetcher, kube_obj) is None
+    kubectl.objects = [versioned(deployment("app"), "8")]
+    assert ResultCache(str(tmpdir), "cluster", "settings").lookup(fetcher, kube_obj) is None
+
+
+def test_runs_go_on_without_a_cache_that_cant_be_created(tmpdir, kubectl, deployment, write_manifests, run_check,
+                                                         caplog):
+    path = write_manifests(1)
+    kubectl.objects = [deployment("app-0-a"), deployment("app-0-b", replicas=2)]
+    # A directory can't be created under a file, even by root.
+    blocker = tmpdir.join("not-a-directory")
+    blocker.write("")
+    cache_dir = str(blocker.join("kubediff"))
+    assert run_check(path, cache_dir=cache_dir, result_cache=True) == run_check(path)
+    assert len([r for r in caplog.records if "can't use the cache directory" in r.getMessage()]) == 2
+
+
+def test_result_cache_keeps_no_secret_values(tmpdir, kubectl, deployment, run_check):
+    def secret(password):
+        return {"apiVersion": "v1", "kind": "Secret", "data": {"password": password},
+                "metadata": {"name": "creds", "namespace": "default"}}
+    manifests = tmpdir.mkdir("manifests")
+    manifests.join("all.yaml").write(yaml.safe_dump_all([secret("bWFuaWZlc3Q="), deployment("app", replicas=2)]))
+    kubectl.objects = [versioned(secret("bGl2ZS1zZWNyZXQ="), "1"), versioned(deployment("app", replicas=7), "1")]
+    cache_dir = tmpdir.join("cache")
+    for _ in range(2):
+        failed, output = run_check(str(manifests), cache_dir=str(cache_dir), result_cache=True)
+        assert "bGl2ZS1zZWNyZXQ=" not in output
+        assert "'7'" in output
+    stored = b"".join(entry.read_binary() for entry in cache_dir.join("results").visit(lambda p: p.isfile()))
+    assert b"bGl2ZS1zZWNyZXQ=" not in stored
+    # The Deployment's differences are cached as before.
+    assert b"replicas" in stored
+
+
+class Planted(object):
+    """Unpickling this creates the file 'path'."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (open, (self.path, "w"))
+
+
+def test_cache_entries_are_never_unpickled(tmpdir, kubectl, deployment):
+    path = str(tmpdir.join("app.yaml"))
+    write(path, deployment("app"), 1000)
+    directory = tmpdir.join("cache")
+    parse, calls = parse_counter(path)
+    [kube_obj] = ParseCache(str(directory)).load(path, "default", parse)
+    kubectl.objects = [versioned(deployment("app"), "7")]
+    ResultCache(str(directory), "cluster", "settings").store(kube_obj, kubectl.objects[0], [])
+
+    planted = tmpdir.join("planted")
+    entries = directory.join("manifests").listdir() + directory.join("results").listdir()
+    assert len(entries) == 2
+    for entry in entries:
+        entry.write_binary(pickle.dumps(Planted(str(planted))))
+    assert ParseCache(str(directory)).load(path, "default", parse) == [kube_obj]
+    assert len(calls) == 2
+    assert ResultCache(str(directory), "cluster", "settings").lookup(KubectlFetcher(), kube_obj) is None
+    assert not planted.check()
+
+
+def test_objects_that_dont_survive_json_are_not_cached(tmpdir, deployment):
+    path = str(tmpdir.join("app.yaml"))
+    dated = dict(deployment("app"), spec={"since": datetime.date(2018, 1, 1), "ports": {80: "http"}})
+    write(path, dated, 1000)
+    cache = ParseCache(str(tmpdir.join("cache")))
+    parse, calls = parse_counter(path)
+    for _ in range(2):
+        [kube_obj] = cache.load(path, "default", parse)
+        assert kube_obj.data == dated
+    assert len(calls) == 2
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import io
+import json
+import os
+
+import pytest
+import yaml
+
+from kubedifflib import (_diff, _kube, check_contexts, check_files, expand_contexts, JSONPrinter, merge_json_reports,
+                         NDJSONPrinter, QuietTextPrinter)
+
+
+def test_concurrent_checks_keep_output_order(kubectl, deployment, write_manifests, run_check):
+    path = write_manifests(20)
+    kubectl.objects = [deployment("app-%d-%s" % (i, suffix)) for i in range(0, 20, 2) for suffix in "ab"]
+    serial = run_check(path)
+    assert serial[0]
+    assert run_check(path, jobs=8) == serial
+    assert run_check(path, jobs=8, batch=True) == serial
+
+
+def test_concurrent_checks_report_objects_before_parse_errors(kubectl, write_manifests, run_check):
+    path = write_manifests(3)
+    # os.walk yields a directory's files before its subdirectories.
+    os.mkdir(os.path.join(path, "broken"))
+    with open(os.path.join(path, "broken", "broken.yaml"), "w") as stream:
+        stream.write("kind: [unclosed\n")
+    for jobs in (1, 4):
+        output = io.StringIO()
+        with pytest.raises(yaml.YAMLError):
+            check_files([path], QuietTextPrinter(output),
+                        {"kubeconfig": None, "context": None, "namespace": "default", "jobs": jobs})
+        assert output.getvalue().count("## ") == 6
+
+
+def test_parallel_parsing_matches_serial(kubectl, deployment, write_manifests, run_check):
+    path = write_manifests(10)
+    kubectl.objects = [deployment("app-3-a")]
+    assert run_check(path, parse_jobs=3) == run_check(path)
+
+
+def test_ndjson_output_has_one_record_per_object_and_difference(kubectl, deployment, write_manifests):
+    path = write_manifests(1)
+    kubectl.objects = [deployment("app-0-a", replicas=3)]
+    output = io.StringIO()
+    failed = check_files([path], NDJSONPrinter(output),
+                         {"kubeconfig": None, "context": None, "namespace": "default"})
+    assert failed
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [(r["type"], r["name"]) for r in records] == [
+        ("object", "app-0-a"), ("difference", "app-0-a"),
+        ("object", "app-0-b"), ("difference", "app-0-b"),
+    ]
+    assert records[1]["path"] == ".spec.replicas"
+    assert records[1]["message"] == "'1' != '3'"
+
+
+def test_shards_partition_the_objects(kubectl, deployment, write_manifests):
+    path = write_manifests(10)
+    kubectl.objects = [deployment("app-%d-a" % i, replicas=2) for i in range(10)]
+    config = {"kubeconfig": None, "context": None, "namespace": "default"}
+    whole = JSONPrinter(io.StringIO())
+    check_files([path], whole, config)
+    shards = []
+    for index in range(3):
+        printer = JSONPrinter(io.StringIO())
+        check_files([path], printer, dict(config, shard=(index, 3)))
+        shards.append(json.loads(json.dumps(printer.data)))
+    assert all(shards)
+    merged = merge_json_reports(shards)
+    assert dict((path, sorted(found)) for (path, found) in merged.items()) == \
+        dict((path, sorted(found)) for (path, found) in whole.data.items())
+
+
+def test_contexts_are_checked_against_one_parse(deployment, write_manifests, fake_kubectl, monkeypatch):
+    path = write_manifests(3)
+    everything = [deployment("app-%d-%s" % (i, suffix), replicas=1 if suffix == "a" else 2)
+                  for i in range(3) for suffix in "ab"]
+    clusters = {"in-sync": fake_kubectl(everything), "drifted": fake_kubectl(everything[1:])}
+
+    def kubectl(command, stderr=None):
+        [context] = [arg.split("=", 1)[1] for arg in command if arg.startswith("--context=")]
+        return clusters[context](command, stderr)
+    monkeypatch.setattr(_kube.subprocess, "check_output", kubectl)
+    parsed, parse = [], _diff.iter_file_objects
+
+    def iter_file_objects(path, config):
+        parsed.append(path)
+        return parse(path, config)
+    monkeypatch.setattr(_diff, "iter_file_objects", iter_file_objects)
+
+    streams = dict((context, io.StringIO()) for context in clusters)
+    failed = check_contexts([path], lambda context: QuietTextPrinter(streams[context]),
+                            {"kubeconfig": None, "context": None, "namespace": "default", "jobs": 2},
+                            ["in-sync", "drifted"])
+    assert list(failed.items()) == [("in-sync", False), ("drifted", True)]
+    assert streams["in-sync"].getvalue() == ""
+    assert streams["drifted"].getvalue().count("## ") == 1
+    assert len(parsed) == 3
+
+
+def test_context_globs_match_kubeconfig_contexts(tmpdir):
+    kubeconfig = tmpdir.join("kubeconfig")
+    kubeconfig.write(yaml.safe_dump({
+        "contexts": [{"name": name, "context": {}} for name in ["prod-eu", "dev", "prod-us"]],
+    }))
+    assert expand_contexts(["prod-*", "dev", "prod-eu"], str(kubeconfig)) == ["prod-eu", "prod-us", "dev"]
+    assert expand_contexts(["anything"], str(tmpdir.join("missing"))) == ["anything"]
+    with pytest.raises(ValueError):
+        expand_contexts(["staging-*"], str(kubeconfig))
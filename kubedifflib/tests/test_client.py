@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import socket
+
+import pytest
+
+from kubedifflib._client import APIFetcher, KubeClient
+from kubedifflib._kube import BatchFetcher, FetchError, KubeObject
+
+
+def test_client_maps_kinds_to_paths(apiserver, tmpdir):
+    client = KubeClient.from_kubeconfig(apiserver.kubeconfig(tmpdir))
+    assert client.resource_path("Deployment.v1.apps", "prod", "web") == "/apis/apps/v1/namespaces/prod/deployments/web"
+    assert client.resource_path("Namespace.v1.", "prod", "prod") == "/api/v1/namespaces/prod"
+    with pytest.raises(FetchError):
+        client.resource_path("Widget.v1.example.com", "prod", "web")
+
+
+def test_client_reuses_connections_and_discovery(apiserver, deployment, tmpdir):
+    apiserver.objects = [deployment("app-%d" % i) for i in range(5)]
+    fetcher = APIFetcher(KubeClient.from_kubeconfig(apiserver.kubeconfig(tmpdir)))
+    for obj in apiserver.objects:
+        [kube_obj] = KubeObject.from_dict(obj)
+        assert fetcher.get(kube_obj) == obj
+    assert apiserver.requests.count("/apis/apps/v1") == 1
+    assert len(apiserver.connections) == 1
+
+
+def test_list_fills_in_kind_and_version(apiserver, deployment, tmpdir):
+    apiserver.objects = [deployment("a"), deployment("b")]
+    fetcher = BatchFetcher(APIFetcher(KubeClient.from_kubeconfig(apiserver.kubeconfig(tmpdir))))
+    assert fetcher.list("Deployment.v1.apps", "default") == {"a": deployment("a"), "b": deployment("b")}
+
+
+def test_versions_come_from_object_metadata(apiserver, deployment, tmpdir):
+    apiserver.objects = [deployment("a"), deployment("b")]
+    apiserver.objects[0]["metadata"]["resourceVersion"] = "42"
+    fetcher = BatchFetcher(APIFetcher(KubeClient.from_kubeconfig(apiserver.kubeconfig(tmpdir))))
+    assert fetcher.versions("Deployment.v1.apps", "default") == {"a": "42", "b": None}
+
+
+def test_discovery_errors_are_not_cached(apiserver, tmpdir):
+    client = KubeClient.from_kubeconfig(apiserver.kubeconfig(tmpdir))
+    apiserver.discovery_status = 403
+    with pytest.raises(FetchError) as error:
+        client.resource_path("Deployment.v1.apps", "prod", "web")
+    assert error.value.output == b"Error from server (Forbidden): forbidden\n"
+    apiserver.discovery_status = None
+    assert client.resource_path("Deployment.v1.apps", "prod", "web") == "/apis/apps/v1/namespaces/prod/deployments/web"
+
+
+def test_unreachable_server_is_a_difference(apiserver, write_manifests, run_check, tmpdir):
+    path = write_manifests(1)
+    kubeconfig = apiserver.kubeconfig(tmpdir)
+    apiserver.close()
+    unused = socket.socket()
+    unused.bind(("127.0.0.1", 0))
+    port = unused.getsockname()[1]
+    unused.close()
+    tmpdir.join("kubeconfig").write(tmpdir.join("kubeconfig").read().replace(apiserver.url, "http://127.0.0.1:%d" % port))
+    failed, output = run_check(path, backend="api", kubeconfig=kubeconfig)
+    assert failed
+    assert "Unable to connect to the server" in output
+
+
+def test_kubeconfig_files_are_merged(apiserver, tmpdir, monkeypatch):
+    kubeconfig = apiserver.kubeconfig(tmpdir)
+    monkeypatch.setenv("KUBECONFIG", "%s:%s" % (tmpdir.join("missing"), kubeconfig))
+    assert KubeClient.from_kubeconfig().pool.port == apiserver.server.server_address[1]
+
+
+def test_api_backend_matches_kubectl_backend(apiserver, kubectl, deployment, write_manifests, run_check, tmpdir):
+    path = write_manifests(6)
+    objects = [deployment("app-%d-%s" % (i, suffix)) for i in range(0, 6, 2) for suffix in "ab"]
+    apiserver.objects = kubectl.objects = objects
+    expected = run_check(path)
+    kubeconfig = apiserver.kubeconfig(tmpdir)
+    assert run_check(path, backend="api", kubeconfig=kubeconfig) == expected
+    assert run_check(path, backend="api", batch=True, jobs=4, kubeconfig=kubeconfig) == expected
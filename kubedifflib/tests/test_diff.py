@@ -3,20 +3,30 @@
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 from kubedifflib._kube import KubeObject
-from kubedifflib._diff import diff_lists, list_subtract, Difference
-from hypothesis.strategies import integers, lists, text, fixed_dictionaries, sampled_from, none, one_of
+from kubedifflib._diff import (diff, diff_lists, fingerprint, list_subtract, Difference, TolerationMatcher,
+                               register_toleration, set_text_diff_limits, text_diff_limits, toleration_matcher,
+                               tolerations, unified_diff, ERROR, MISSING, NOT_EQUAL)
+from hypothesis.strategies import (integers, lists, text, fixed_dictionaries, sampled_from, none, one_of,
+                                   dictionaries, recursive)
 from hypothesis import given, example
+from fnmatch import fnmatchcase
+import difflib
 import random
 import copy
 
 
-@given(path=text(), xs=lists(integers()))
+def paths():
+    """Generate paths of keys, as diff takes."""
+    return lists(text()).map(tuple)
+
+
+@given(path=paths(), xs=lists(integers()))
 def test_diff_lists_equal(path, xs):
     """No difference between a list and itself."""
     assert list(diff_lists(path, xs, xs)) == []
 
 
-@given(path=text(), xs=lists(integers()))
+@given(path=paths(), xs=lists(integers()))
 def test_same_list_shuffled_is_not_different(path, xs):
     """No difference between two lists with same values in different order."""
     ys = list(xs)
@@ -24,7 +34,7 @@ def test_same_list_shuffled_is_not_different(path, xs):
     assert list(diff_lists(path, xs, ys)) == []
 
 
-@given(path=text(), xs=lists(lists(integers())))
+@given(path=paths(), xs=lists(lists(integers())))
 def test_same_list_shuffled_is_not_different_nested(path, xs):
     """No difference between two lists with same values in different order.
 
@@ -36,7 +46,7 @@ def test_same_list_shuffled_is_not_different_nested(path, xs):
     assert list(diff_lists(path, xs, ys)) == []
 
 
-@given(path=text(), base=lists(integers()), extension=lists(integers()))
+@given(path=paths(), base=lists(integers()), extension=lists(integers()))
 def test_added_items_appear_in_diff(path, base, extension):
     xs = list(base)
     xs.extend([None] * len(extension))
@@ -61,6 +71,34 @@ def test_list_subtract_recover(xs, ys):
     assert list(list_subtract(xs, zs)) == []
 
 
+@given(xs=lists(integers()), ys=lists(integers()))
+def test_list_subtract_with_key_matches_without(xs, ys):
+    """Pairing items through a key index finds the same missing items."""
+    assert list(list_subtract(xs, ys, key=lambda x: x)) == list(list_subtract(xs, ys))
+
+
+def kube_values():
+    """Generate nested YAML-like values."""
+    return recursive(
+        one_of(none(), integers(), text(max_size=3)),
+        lambda children: one_of(lists(children, max_size=4), dictionaries(text(max_size=3), children, max_size=4)),
+        max_leaves=20)
+
+
+@given(path=paths(), xs=lists(kube_values()))
+def test_same_list_of_values_shuffled_is_not_different(path, xs):
+    ys = copy.deepcopy(xs)
+    random.shuffle(ys)
+    assert list(diff_lists(path, xs, ys)) == []
+
+
+@given(x=kube_values(), y=kube_values())
+def test_equal_fingerprints_have_no_differences(x, y):
+    if fingerprint(x) == fingerprint(y):
+        assert list(diff((), x, y)) == []
+    assert fingerprint(x) == fingerprint(copy.deepcopy(x))
+
+
 def two_lists_of_same_size(generator):
     """Generate two lists of the same length."""
     return lists(generator).map(split_list)
@@ -74,7 +112,7 @@ def split_list(xs):
     return xs[:midpoint], xs[midpoint:]
 
 
-@given(path=text(), items=two_lists_of_same_size(integers()))
+@given(path=paths(), items=two_lists_of_same_size(integers()))
 def test_diff_lists_doesnt_mutate_inputs(path, items):
     xs, ys = items
     orig_xs = list(xs)
@@ -83,7 +121,7 @@ def test_diff_lists_doesnt_mutate_inputs(path, items):
     assert xs == orig_xs and ys == orig_ys
 
 
-@given(path=text(), items=two_lists_of_same_size(lists(integers())))
+@given(path=paths(), items=two_lists_of_same_size(lists(integers())))
 def test_diff_lists_doesnt_mutate_inputs_nested_lists(path, items):
     xs, ys = items
     orig_xs = copy.deepcopy(xs)
@@ -140,16 +178,124 @@ def test_from_dict_kubernetes_obj_type(data):
     assert [kube_obj.data for kube_obj in KubeObject.from_dict(data)] == [data]
 
 
-@given(path=text(), kind=text())
-def test_difference_no_args(path, kind):
-    """Difference.to_text works as expected when no args passed."""
-    d = Difference("Message", path)
-    assert d.to_text(kind) == path + ": Message"
+@given(path=paths(), kind=text())
+def test_difference_missing_key(path, kind):
+    """Difference.to_text names the missing key after its container's path."""
+    d = Difference(MISSING, path + ("key",), "value")
+    assert d.to_text(kind) == "".join("." + key for key in path) + ": 'key' missing"
 
 
-@given(path=text(), kind=text(), arg1=text(), arg2=one_of(text(), none()))
-@example("somepath", "Secret", "foo", None)
-def test_difference_two_args(path, kind, arg1, arg2):
-    """Difference.to_text works when two args passed, that may be 'none'."""
-    d = Difference("Message %s %s", path, arg1, arg2)
+@given(path=paths(), kind=text(), want=text(), have=one_of(text(), none()))
+@example(("data", "password"), "Secret.v1.", "foo", None)
+def test_difference_not_equal(path, kind, want, have):
+    """Difference.to_text works for values that may be 'none', masking secrets."""
+    d = Difference(NOT_EQUAL, path, want, have)
     assert d.to_text(kind) != ""
+    if kind.startswith("Secret."):
+        assert d.message_text(kind) == "'%s' != '%s'" % ("*" * len(want), have and "*" * len(have))
+
+
+def test_difference_error_has_no_path():
+    assert Difference(ERROR, None, "Error from server").to_text() == "Error from server"
+
+
+def glob_patterns():
+    """Generate glob patterns over a small alphabet."""
+    return lists(sampled_from(["a", "b", ".", "*", "?", "[ab]", "[!a]", "["]), max_size=6).map("".join)
+
+
+@given(patterns=lists(glob_patterns(), max_size=4), keys=lists(text(alphabet="ab.", max_size=3), max_size=4))
+def test_toleration_matcher_agrees_with_fnmatch(patterns, keys):
+    """Walking a path key by key finds the patterns fnmatch would."""
+    checks = [object() for _ in patterns]
+    matcher = TolerationMatcher(list(zip(patterns, checks)))
+    state, path = matcher.root, ""
+    for key in [None] + keys:
+        if key is not None:
+            state, path = state.child(key), "%s.%s" % (path, key)
+        expected = [check for (pattern, check) in zip(patterns, checks) if fnmatchcase(path, pattern)]
+        assert sorted(map(id, state.checks)) == sorted(map(id, expected))
+        assert sorted(map(id, matcher.state(path).checks)) == sorted(map(id, expected))
+
+
+def test_registered_toleration_is_applied():
+    want = {"metadata": {"annotations": {"a": "1"}}}
+    have = {"metadata": {"annotations": {"a": "2"}}}
+    assert len(list(diff((), want, have))) == 1
+    register_toleration(".metadata.annotations", "ignore")
+    try:
+        assert list(diff((), want, have)) == []
+    finally:
+        del tolerations[".metadata.annotations"]
+    assert len(list(diff((), want, have))) == 1
+
+
+def test_equal_elements_are_compared_once_under_the_same_tolerations():
+    sidecar = {"name": "sidecar", "env": [{"name": "A", "value": "1"}], "resources": {"requests": {"cpu": "100m"}}}
+    running = dict(sidecar, imagePullPolicy="IfNotPresent", resources={"requests": {"cpu": "0.1"}})
+    want = {"containers": [{"name": "app"}, sidecar]}
+    have = {"containers": [dict(running), {"name": "app", "imagePullPolicy": "Always"}]}
+    assert list(diff((), want, have)) == []
+    equalities = toleration_matcher().equalities
+    assert equalities[(fingerprint(sidecar), fingerprint(running))] is True
+    compared = len(equalities)
+    assert list(diff((), copy.deepcopy(want), copy.deepcopy(have))) == []
+    assert len(equalities) == compared
+
+    # Results don't carry over to other tolerations.
+    register_toleration("*.env", "ignore")
+    try:
+        assert toleration_matcher().equalities == {}
+        changed = {"containers": [{"name": "app"}, dict(sidecar, env=[{"name": "B"}])]}
+        assert list(diff((), changed, have)) == []
+    finally:
+        del tolerations["*.env"]
+    assert len(list(diff((), changed, have))) == 1
+
+
+def test_equalities_keep_being_memoized_once_full(monkeypatch):
+    matcher = toleration_matcher()
+    monkeypatch.setattr(matcher, "max_equalities", 2)
+    matcher.equalities.clear()
+    for i in range(5):
+        element = {"name": "c", "image": "image:%d" % i}
+        running = dict(element, imagePullPolicy="Always")
+        assert list(diff((), {"containers": [{"name": "a"}, element]}, {"containers": [running, {"name": "a"}]})) == []
+        assert (fingerprint(element), fingerprint(running)) in matcher.equalities
+        assert len(matcher.equalities) <= 2
+
+
+def multi_line(lines):
+    return "".join("%s\n" % line for line in lines)
+
+
+def test_text_diff_pairs_changed_lines_in_place():
+    want = ["line %d" % i for i in range(100)]
+    have = list(want)
+    have[50] = "changed"
+    [d] = list(diff((), {"data": multi_line(want)}, {"data": multi_line(have)}))
+    assert d.message_text() == "Diff:\n" + "\n".join(difflib.unified_diff(
+        want, have, fromfile=".data", tofile="running", lineterm=""))
+
+
+def test_text_diff_keeps_line_numbers_after_common_prefix():
+    want = ["line %d" % i for i in range(100)]
+    have = want[:40] + want[41:] + ["appended"]
+    text = unified_diff(".data", multi_line(want), multi_line(have))
+    assert text.splitlines()[2:4] == ["@@ -38,7 +38,6 @@", " line 37"]
+    assert text.endswith("+appended")
+
+
+def test_text_diff_limits():
+    want = multi_line("line %d" % i for i in range(1000))
+    have = multi_line("other %d" % i for i in range(1000))
+    limits = dict(text_diff_limits)
+    try:
+        set_text_diff_limits(max_lines=10)
+        lines = unified_diff(".data", want, have).splitlines()
+        assert len(lines) == 11
+        assert lines[-1] == "... (diff truncated after 10 lines)"
+        set_text_diff_limits(max_size=100)
+        assert "(too large to diff)" in unified_diff(".data", want, have)
+    finally:
+        text_diff_limits.update(limits)
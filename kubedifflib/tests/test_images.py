@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import yaml
+
+from kubedifflib import (compare_image_indexes, environment_names, get_differing_images, image_matrix, index_images,
+                         load_config)
+from kubedifflib._images import Image
+
+
+def pod(name, *images):
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {"name": name},
+        "spec": {"containers": [{"name": "c%d" % i, "image": image} for (i, image) in enumerate(images)]},
+    }
+
+
+def write_environment(directory, documents):
+    directory.join("objects.yaml").write(yaml.safe_dump_all(documents))
+    return str(directory)
+
+
+def test_image_names_keep_registry_ports():
+    assert Image.parse("app") == Image("app", "latest")
+    assert Image.parse("quay.io/app:v1") == Image("quay.io/app", "v1")
+    assert Image.parse("localhost:5000/app") == Image("localhost:5000/app", "latest")
+    assert Image.parse("localhost:5000/app:v2") == Image("localhost:5000/app", "v2")
+    assert Image.parse("app:v1@sha256:abc") == Image("app", "sha256:abc")
+
+
+def test_changed_added_and_removed_images_across_documents(tmpdir):
+    source = write_environment(tmpdir.mkdir("dev"), [
+        pod("a", "app:v2", "sidecar:v1"),
+        {"apiVersion": "v1", "kind": "List", "items": [pod("b", "only-dev:v1")]},
+    ])
+    target = write_environment(tmpdir.mkdir("prod"), [
+        pod("a", "app:v1", "sidecar:v1"),
+        pod("c", "only-prod:v3"),
+    ])
+    expected = {
+        "app": ("v2", "v1"),
+        "only-dev": ("v1", None),
+        "only-prod": (None, "v3"),
+    }
+    assert compare_image_indexes(index_images(source), index_images(target, jobs=2)) == expected
+    assert get_differing_images(load_config(source), load_config(target)) == expected
+
+
+def test_image_matrix_has_a_column_per_environment(tmpdir):
+    envs = [index_images(write_environment(tmpdir.mkdir(name), [pod("a", *images)]))
+            for (name, images) in [("dev", ["app:v3", "db:v1"]), ("staging", ["app:v2", "db:v1"]),
+                                   ("prod", ["app:v1", "db:v1", "legacy:v9"])]]
+    assert image_matrix(envs) == {
+        "app": ("v3", "v2", "v1"),
+        "db": ("v1", "v1", "v1"),
+        "legacy": (None, None, "v9"),
+    }
+    assert sorted(image_matrix(envs, differing_only=True)) == ["app", "legacy"]
+
+
+def test_environment_names_tell_environments_apart():
+    assert environment_names(["k8s/dev/", "k8s/prod"]) == ["dev", "prod"]
+    assert environment_names(["eu/prod", "us/prod", "clusters/eu/staging", "prod"]) == [
+        "eu/prod", "us/prod", "staging", "prod"]
+    assert environment_names(["k8s/dev", "k8s/dev"]) == ["dev (1)", "dev (2)"]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import os
+import subprocess
+import sys
+
+import kubedifflib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir)
+
+
+def modules_after(code):
+    """Return the modules a fresh interpreter has imported after running 'code'."""
+    script = "%s\nimport sys\nprint('\\n'.join(sys.modules))" % (code,)
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=ROOT)
+    return set(output.decode('utf-8').split())
+
+
+def test_modules_are_imported_when_their_names_are_used():
+    modules = modules_after("import kubedifflib; kubedifflib.default_cache_dir")
+    if sys.version_info < (3, 7):
+        # Without module __getattr__, every module is imported up front.
+        assert {"kubedifflib._diff", "kubedifflib._kube", "kubedifflib._watch"} <= modules
+        return
+    assert not modules & {"yaml", "kubedifflib._diff", "kubedifflib._kube"}
+    modules = modules_after("import kubedifflib; kubedifflib.check_files")
+    assert "kubedifflib._diff" in modules
+    assert not modules & {"yaml", "difflib", "asyncio", "multiprocessing", "kubedifflib._images",
+                          "kubedifflib._watch", "kubedifflib._async"}
+
+
+def test_every_public_name_can_be_imported():
+    for name in kubedifflib.__all__:
+        assert getattr(kubedifflib, name) is not None
+    assert set(kubedifflib.__all__) <= set(dir(kubedifflib))
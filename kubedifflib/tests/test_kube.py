@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import subprocess
+
+import yaml
+
+from kubedifflib._kube import BatchFetcher, KubeObject, KubectlFetcher, load_all_yaml
+
+
+def test_batch_fetcher_lists_each_group_once(kubectl, deployment):
+    kubectl.objects = [deployment("a"), deployment("b"), deployment("c", "other")]
+    fetcher = BatchFetcher(KubectlFetcher())
+    for name, namespace in [("a", "default"), ("b", "default"), ("c", "other")]:
+        [kube_obj] = KubeObject.from_dict(deployment(name, namespace))
+        assert fetcher.get(kube_obj) == deployment(name, namespace)
+    assert len(kubectl.calls) == 2
+
+
+def test_batch_fetcher_missing_object_matches_single_fetch(kubectl, deployment):
+    kubectl.objects = [deployment("a")]
+    [kube_obj] = KubeObject.from_dict(deployment("missing"))
+    try:
+        BatchFetcher(KubectlFetcher()).get(kube_obj)
+    except subprocess.CalledProcessError as e:
+        batched = e.output
+    try:
+        kube_obj.get_from_cluster()
+    except subprocess.CalledProcessError as e:
+        single = e.output
+    assert batched == single
+
+
+def test_batch_fetcher_keeps_only_wanted_objects(kubectl, deployment):
+    kubectl.objects = [deployment("a"), deployment("b"), deployment("unrelated")]
+    fetcher = BatchFetcher(KubectlFetcher())
+    [kube_obj] = KubeObject.from_dict(deployment("a"))
+    fetcher.want(kube_obj)
+    listed = fetcher.list("Deployment.v1.apps", "default")
+    assert listed == {"a": deployment("a")}
+    assert fetcher.get(kube_obj) == deployment("a")
+    assert fetcher.list("Deployment.v1.apps", "default") == {}
+    # Lists are copies, which serving objects leaves alone.
+    assert listed == {"a": deployment("a")}
+    assert len(kubectl.calls) == 1
+
+
+def test_batch_fetcher_logs_failed_lists(kubectl, deployment, caplog):
+    kubectl.objects = [deployment("a")]
+    kubectl.list_error = "error: forbidden"
+    [kube_obj] = KubeObject.from_dict(deployment("a"))
+    assert BatchFetcher(KubectlFetcher()).get(kube_obj) == deployment("a")
+    assert "error: forbidden" in caplog.text
+
+
+def test_load_yaml_matches_pure_python_loader():
+    text = "a: 1\nb: [yes, 2018-01-01, '3', 4.5]\n---\n---\nc: |\n  multi\n  line\n"
+    assert list(load_all_yaml(text)) == list(yaml.safe_load_all(text))
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import os
+import stat
+from future.moves.urllib.request import urlopen
+
+from kubedifflib import LATENCY_BUCKETS, Metrics, Watcher, serve_report
+from kubedifflib._kube import KubectlFetcher
+
+
+def samples(text):
+    """Return the samples in Prometheus text 'text', by name and labels."""
+    found = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            found[series] = float(value)
+    return found
+
+
+def test_checks_are_recorded(kubectl, deployment, write_manifests, run_check):
+    path = write_manifests(2)
+    kubectl.objects = [deployment("app-0-a"), deployment("app-0-b", replicas=3), deployment("app-1-a")]
+    metrics = Metrics()
+    run_check(path, metrics=metrics, jobs=2)
+    found = samples(metrics.render())
+
+    def differences(name):
+        return found['kubediff_object_differences{kind="Deployment.v1.apps",namespace="default",name="%s"}' % name]
+    assert [differences(name) for name in ["app-0-a", "app-0-b", "app-1-a", "app-1-b"]] == [0, 1, 0, 1]
+    assert found['kubediff_fetch_errors_total{kind="Deployment.v1.apps",namespace="default"}'] == 1
+    assert found["kubediff_parsed_files_total"] == 2
+    assert found["kubediff_parsed_documents_total"] == 4
+    assert found['kubediff_fetch_duration_seconds_count{kind="Deployment.v1.apps"}'] == 4
+    assert found['kubediff_fetch_duration_seconds_bucket{kind="Deployment.v1.apps",le="+Inf"}'] == 4
+    # Only the objects that could be fetched are diffed.
+    assert found['kubediff_diff_duration_seconds_count{kind="Deployment.v1.apps"}'] == 3
+    assert len([s for s in found if s.startswith("kubediff_diff_duration_seconds_bucket")]) == len(LATENCY_BUCKETS) + 1
+
+    run_check(path, metrics=metrics, context="prod")
+    found = samples(metrics.render())
+    assert found['kubediff_fetch_errors_total{context="prod",kind="Deployment.v1.apps",namespace="default"}'] == 1
+    assert found["kubediff_parsed_files_total"] == 4
+
+
+def test_label_values_are_escaped(tmpdir):
+    metrics = Metrics()
+    metrics.observe("diff", 'Odd"Kind\\\n', 0.002)
+    metrics.observe("print", "Deployment.v1.apps", 1.0)
+    text = metrics.render()
+    assert 'kubediff_diff_duration_seconds_bucket{kind="Odd\\"Kind\\\\\\n",le="0.0025"} 1' in text
+    assert 'kubediff_diff_duration_seconds_bucket{kind="Odd\\"Kind\\\\\\n",le="0.001"} 0' in text
+    assert "Deployment" not in text
+
+    path = str(tmpdir.join("kubediff.prom"))
+    # Readable by collectors running as other users, as the umask allows.
+    for (umask, mode) in [(0o022, 0o644), (0o027, 0o640)]:
+        umask = os.umask(umask)
+        try:
+            metrics.write(path)
+        finally:
+            os.umask(umask)
+        with open(path) as stream:
+            assert stream.read() == text
+        assert os.listdir(str(tmpdir)) == ["kubediff.prom"]
+        assert stat.S_IMODE(os.stat(path).st_mode) == mode
+
+
+def test_watcher_serves_metrics_of_current_manifests(kubectl, deployment, write_manifests, fake_feed):
+    path = write_manifests(2)
+    feed = fake_feed([deployment("app-0-a"), deployment("app-0-b"), deployment("app-1-a"), deployment("app-1-b")])
+    config = {"kubeconfig": None, "context": None, "namespace": "default", "metrics": Metrics()}
+    watcher = Watcher([path], config, feed, KubectlFetcher())
+    server = serve_report(watcher, "127.0.0.1:0")
+    url = "http://127.0.0.1:%d/metrics" % (server.server_address[1],)
+    try:
+        watcher.scan()
+        found = samples(urlopen(url).read().decode('utf-8'))
+        assert sum(v for (s, v) in found.items() if s.startswith("kubediff_object_differences")) == 2
+        assert found['kubediff_diff_duration_seconds_count{kind="Deployment.v1.apps"}'] == 4
+
+        os.remove(os.path.join(path, "app-001.yaml"))
+        watcher.scan()
+        found = samples(urlopen(url).read().decode('utf-8'))
+        assert sorted(s for s in found if s.startswith("kubediff_object_differences")) == [
+            'kubediff_object_differences{kind="Deployment.v1.apps",namespace="default",name="app-0-%s"}' % name
+            for name in "ab"]
+    finally:
+        server.shutdown()
+        watcher.stop()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+from fnmatch import fnmatchcase
+
+import yaml
+
+from kubedifflib import DEFAULT_ORPHAN_IGNORES, find_orphans
+
+
+def identities(orphans):
+    return [(o.kind, o.namespace, o.name) for o in orphans]
+
+
+def test_running_objects_without_manifests_are_orphans(kubectl, deployment, write_manifests):
+    path = write_manifests(2)
+    kubectl.objects = [deployment("app-0-a"), deployment("app-1-b"), deployment("by-hand"), deployment("old-app"),
+                       deployment("by-hand", "elsewhere")]
+    config = {"kubeconfig": None, "context": None, "namespace": "default"}
+    orphans, errors = find_orphans([path], config)
+    assert identities(orphans) == [("Deployment.v1.apps", "default", "by-hand"),
+                                   ("Deployment.v1.apps", "default", "old-app")]
+    assert errors == {}
+    # One list of names for the one kind and namespace.
+    [call] = kubectl.calls
+    assert any(arg.startswith("-o=custom-columns=") for arg in call)
+
+    orphans, _ = find_orphans([path], config, DEFAULT_ORPHAN_IGNORES + ("Deployment.*/default/old-*",))
+    assert identities(orphans) == [("Deployment.v1.apps", "default", "by-hand")]
+
+    shards = [find_orphans([path], dict(config, shard=(i, 2)))[0] for i in range(2)]
+    assert sorted(identities(shards[0] + shards[1])) == identities(find_orphans([path], config)[0])
+
+
+def test_orphans_through_the_api(apiserver, deployment, write_manifests, tmpdir):
+    path = write_manifests(1)
+    apiserver.objects = [deployment("app-0-a"), deployment("app-0-b"), deployment("by-hand")]
+    config = {"kubeconfig": apiserver.kubeconfig(tmpdir), "context": None, "namespace": "default", "backend": "api"}
+    orphans, errors = find_orphans([path], config)
+    assert identities(orphans) == [("Deployment.v1.apps", "default", "by-hand")]
+
+
+def test_failed_lists_are_reported(kubectl, write_manifests):
+    kubectl.list_error = "error: forbidden\n"
+    orphans, errors = find_orphans([write_manifests(1)], {"kubeconfig": None, "context": None, "namespace": "default"})
+    assert orphans == []
+    assert errors == {("Deployment.v1.apps", "default"): b"error: forbidden\n"}
+
+
+def test_built_in_roles_are_not_orphans(kubectl, tmpdir):
+    def cluster_role(name):
+        return {"apiVersion": "rbac.authorization.k8s.io/v1", "kind": "ClusterRole",
+                "metadata": {"name": name, "namespace": "default"}}
+    tmpdir.join("roles.yaml").write(yaml.safe_dump({"apiVersion": "rbac.authorization.k8s.io/v1",
+                                                    "kind": "ClusterRole", "metadata": {"name": "mine"}}))
+    kubectl.objects = [cluster_role(name) for name in
+                       ["mine", "cluster-admin", "admin", "edit", "view", "system:node", "hand-made"]]
+    orphans, _ = find_orphans([str(tmpdir)], {"kubeconfig": None, "context": None, "namespace": "default"})
+    assert identities(orphans) == [("ClusterRole.v1.rbac.authorization.k8s.io", "default", "hand-made")]
+    assert any(fnmatchcase("ClusterRoleBinding.v1.rbac.authorization.k8s.io/default/cluster-admin", pattern)
+               for pattern in DEFAULT_ORPHAN_IGNORES)
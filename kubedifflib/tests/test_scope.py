@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import os
+
+import pytest
+import yaml
+
+from kubedifflib import LabelSelector, Scope, find_orphans
+from kubedifflib._kube import iter_files
+
+
+def test_label_selectors_follow_kubectl_syntax():
+    labels = {"app": "web", "tier": "frontend", "canary": "true"}
+    for text in ["app=web", "app==web", "app!=db", "tier in (frontend, backend)", "tier notin (db)",
+                 "canary", "!legacy", "app=web, tier in (frontend),!legacy", ""]:
+        assert LabelSelector(text).matches(labels), text
+    for text in ["app=db", "app!=web", "tier in (backend)", "tier notin (frontend)", "legacy", "!canary",
+                 "app=web,legacy"]:
+        assert not LabelSelector(text).matches(labels), text
+    for text in ["app=web=x", "tier in (frontend", "app=web,,tier", "(x)"]:
+        with pytest.raises(ValueError):
+            LabelSelector(text)
+
+
+def test_only_objects_in_scope_are_fetched(kubectl, deployment, run_check, tmpdir):
+    docs = [dict(deployment("web"), metadata={"name": "web", "namespace": "team-a", "labels": {"tier": "frontend"}}),
+            deployment("db", "team-a"), deployment("web", "team-b"),
+            {"apiVersion": "v1", "kind": "Service", "metadata": {"name": "web", "namespace": "team-a"}}]
+    tmpdir.join("all.yaml").write(yaml.safe_dump_all(docs))
+
+    def fetched(scope):
+        del kubectl.calls[:]
+        run_check(str(tmpdir), scope=scope)
+        return sorted((call[-2], call[-1]) for call in kubectl.calls)
+
+    assert fetched(Scope(kinds=["deployment"])) == [("Deployment.v1.apps", "db"), ("Deployment.v1.apps", "web"),
+                                                    ("Deployment.v1.apps", "web")]
+    assert fetched(Scope(namespaces=["team-*"], kinds=["Service.v1."])) == [("Service.v1.", "web")]
+    assert fetched(Scope(selector="tier=frontend")) == [("Deployment.v1.apps", "web")]
+    assert fetched(Scope(namespaces=["team-b"])) == [("Deployment.v1.apps", "web")]
+
+
+def test_path_globs_skip_whole_directories(tmpdir, monkeypatch):
+    for path in ["prod/eu/app.yaml", "prod/eu/notes.txt", "prod/app.yml", "staging/app.yaml", "prod/eu/old/app.yaml"]:
+        tmpdir.join(path).write("", ensure=True)
+    walked = set()
+    walk = os.walk
+
+    def recording_walk(*args, **kwargs):
+        # Python 2's os.walk recurses through os.walk, passing every argument,
+        # so the directories below the top are seen more than once there.
+        for (root, dirnames, filenames) in walk(*args, **kwargs):
+            walked.add(os.path.relpath(root, str(tmpdir)))
+            yield root, dirnames, filenames
+    monkeypatch.setattr(os, "walk", recording_walk)
+
+    def found(*globs):
+        walked.clear()
+        return sorted(os.path.relpath(path, str(tmpdir))
+                      for path in iter_files([str(tmpdir)], [glob.split("/") for glob in globs]))
+
+    assert found("prod/*/*.yaml") == ["prod/eu/app.yaml"]
+    assert sorted(walked) == [".", "prod", "prod/eu"]
+    assert found("**/*.yaml") == ["prod/eu/app.yaml", "prod/eu/old/app.yaml", "staging/app.yaml"]
+    assert found("prod/**", "*/*.yml") == ["prod/app.yml", "prod/eu/app.yaml", "prod/eu/notes.txt", "prod/eu/old/app.yaml"]
+    assert "staging" in walked
+    assert found("prod/**") == ["prod/app.yml", "prod/eu/app.yaml", "prod/eu/notes.txt", "prod/eu/old/app.yaml"]
+    assert "staging" not in walked
+    # Files given by path are checked whatever the globs.
+    assert list(iter_files([str(tmpdir.join("staging/app.yaml"))], [["prod", "**"]])) == [
+        str(tmpdir.join("staging/app.yaml"))]
+
+
+def test_orphans_are_only_listed_for_kinds_and_namespaces_in_scope(kubectl, deployment, write_manifests):
+    path = write_manifests(1)
+    kubectl.objects = [deployment("app-0-a"), deployment("by-hand")]
+    config = {"kubeconfig": None, "context": None, "namespace": "default"}
+    orphans, _ = find_orphans([path], dict(config, scope=Scope(kinds=["Deployment"])))
+    assert [o.name for o in orphans] == ["by-hand"]
+    del kubectl.calls[:]
+    assert find_orphans([path], dict(config, scope=Scope(namespaces=["kube-*"]))) == ([], {})
+    assert kubectl.calls == []
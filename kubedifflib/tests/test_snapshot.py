@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import pickle
+import sqlite3
+import zlib
+
+import pytest
+import yaml
+
+from kubedifflib import SnapshotError, SnapshotFetcher, take_snapshot
+from kubedifflib._kube import FetchError, KubeObject
+
+
+def test_checks_against_a_snapshot_match_live_checks(kubectl, deployment, write_manifests, run_check, tmpdir):
+    path = write_manifests(5)
+    kubectl.objects = [deployment("app-%d-a" % i, replicas=i) for i in range(5)]
+    live = run_check(path)
+    del kubectl.calls[:]
+    snapshot = str(tmpdir.join("cluster.snapshot"))
+    config = {"kubeconfig": None, "context": None, "namespace": "default"}
+    assert take_snapshot([path], config, snapshot) == 5
+    # One list call per kind and namespace.
+    assert len(kubectl.calls) == 1
+    kubectl.objects = []
+    failed, output = run_check(path, snapshot=snapshot)
+    assert failed == live[0]
+    assert output.count("## ") == live[1].count("## ")
+    assert output.count("not found") == 5
+    assert len(kubectl.calls) == 1
+
+
+def test_snapshot_reports_failed_lists(kubectl, deployment, tmpdir):
+    kubectl.list_error = "error: forbidden\n"
+    manifest = tmpdir.join("app.yaml")
+    manifest.write("kind: Deployment\napiVersion: apps/v1\nmetadata: {name: app}\n")
+    snapshot = str(tmpdir.join("cluster.snapshot"))
+    take_snapshot([str(manifest)], {"kubeconfig": None, "context": None, "namespace": "default"}, snapshot)
+    fetcher = SnapshotFetcher(snapshot)
+    [kube_obj] = KubeObject.from_dict(deployment("app"))
+    with pytest.raises(FetchError) as error:
+        fetcher.get(kube_obj)
+    assert error.value.output == b"error: forbidden\n"
+    [other] = KubeObject.from_dict(deployment("app", "elsewhere"))
+    with pytest.raises(FetchError) as error:
+        fetcher.get(other)
+    assert b"not in snapshot" in error.value.output
+
+
+def test_snapshot_fetcher_rejects_other_files(tmpdir):
+    path = tmpdir.join("not-a-snapshot")
+    path.write("hello")
+    with pytest.raises(SnapshotError):
+        SnapshotFetcher(str(path))
+    with pytest.raises(SnapshotError):
+        SnapshotFetcher(str(tmpdir.join("missing")))
+
+
+class Planted(object):
+    """Unpickling this creates the file 'path'."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (open, (self.path, "w"))
+
+
+def test_snapshot_objects_are_never_unpickled(kubectl, deployment, tmpdir):
+    manifest = tmpdir.join("app.yaml")
+    manifest.write(yaml.safe_dump(deployment("app")))
+    kubectl.objects = [deployment("app")]
+    snapshot = str(tmpdir.join("cluster.snapshot"))
+    take_snapshot([str(manifest)], {"kubeconfig": None, "context": None, "namespace": "default"}, snapshot)
+    [kube_obj] = KubeObject.from_dict(deployment("app"))
+    assert SnapshotFetcher(snapshot).get(kube_obj) == deployment("app")
+
+    planted = tmpdir.join("planted")
+    connection = sqlite3.connect(snapshot)
+    connection.execute("UPDATE objects SET data = ?", (
+        sqlite3.Binary(zlib.compress(pickle.dumps(Planted(str(planted))))),))
+    connection.commit()
+    connection.close()
+    with pytest.raises(SnapshotError):
+        SnapshotFetcher(snapshot).get(kube_obj)
+    assert not planted.check()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import json
+import pstats
+
+from kubedifflib import format_timings, Timings
+from kubedifflib._timings import percentile
+
+
+def test_percentile_is_nearest_rank():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 0.5) == 50
+    assert percentile(ordered, 0.99) == 99
+    assert percentile([7], 0.9) == 7
+    assert percentile([], 0.5) is None
+
+
+def test_timings_cover_every_phase(kubectl, deployment, write_manifests, run_check):
+    path = write_manifests(4)
+    kubectl.objects = [deployment("app-0-a", replicas=3)]
+    timings = Timings(slowest=3)
+    assert run_check(path, jobs=2, timings=timings) == run_check(path)
+    report = timings.report()
+    json.dumps(report)
+    assert report["phases"]["discover"]["calls"] == 4
+    assert report["phases"]["parse"]["calls"] == 4
+    assert report["phases"]["fetch"]["calls"] == 8
+    # Only the object that exists is diffed.
+    assert report["kinds"]["Deployment.v1.apps"]["diff"]["calls"] == 1
+    assert report["fetch_latency"]["count"] == 8
+    assert len(report["slowest_objects"]) == 3
+    assert len(report["slowest_files"]) == 3
+    seconds = [entry["seconds"] for entry in report["slowest_objects"]]
+    assert seconds == sorted(seconds, reverse=True)
+    assert "Slowest files (parse):" in format_timings(report)
+
+
+def test_timings_profile_the_diff_engine(kubectl, deployment, write_manifests, run_check, tmpdir):
+    path = write_manifests(1)
+    kubectl.objects = [deployment("app-0-a"), deployment("app-0-b")]
+    timings = Timings(profile=True)
+    run_check(path, timings=timings)
+    profile = str(tmpdir.join("diff.prof"))
+    timings.dump_profile(profile)
+    functions = [name for (_, _, name) in pstats.Stats(profile).stats]
+    assert "diff_dicts" in functions
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import (division, absolute_import, print_function,
+                        unicode_literals)
+import io
+import os
+import time
+
+import yaml
+
+from kubedifflib import QuietTextPrinter, Watcher
+from kubedifflib._watch import Informer, PollingFeed
+from kubedifflib._kube import KubectlFetcher
+
+
+def report(watcher):
+    stream = io.StringIO()
+    differences = watcher.report(QuietTextPrinter(stream))
+    return differences, stream.getvalue()
+
+
+def test_watcher_diffs_only_changed_objects(kubectl, deployment, write_manifests, fake_feed):
+    path = write_manifests(1)
+    feed = fake_feed([deployment("app-0-a"), deployment("app-0-b", replicas=3)])
+    config = {"kubeconfig": None, "context": None, "namespace": "default"}
+    watcher = Watcher([path], config, feed, KubectlFetcher())
+    try:
+        assert watcher.scan()
+        assert watcher.diffs == 2
+        assert report(watcher)[0] == 1
+
+        feed.events.put(("MODIFIED", deployment("app-0-b", replicas=2)))
+        assert watcher.update(timeout=10)
+        assert watcher.diffs == 3
+        assert report(watcher) == (0, "")
+        assert not watcher.scan()
+
+        manifest = os.path.join(path, "app-000.yaml")
+        with open(manifest, "w") as stream:
+            stream.write(yaml.safe_dump(deployment("app-0-a", replicas=5)))
+        os.utime(manifest, (0, 0))
+        assert watcher.scan()
+        assert watcher.diffs == 4
+        assert "'5' != '1'" in report(watcher)[1]
+        assert feed.lists == 1
+    finally:
+        watcher.stop()
+
+
+def test_watcher_reports_missing_objects_like_check_files(kubectl, deployment, write_manifests, run_check, fake_feed):
+    path = write_manifests(2)
+    kubectl.objects = [deployment("app-0-a")]
+    watcher = Watcher([path], {"kubeconfig": None, "context": None, "namespace": "default"},
+                      fake_feed(kubectl.objects), KubectlFetcher())
+    try:
+        watcher.scan()
+        assert report(watcher)[1] == run_check(path)[1]
+    finally:
+        watcher.stop()
+
+
+class CountingFetcher(object):
+    """A fetcher that counts its lists, the first 'failures' of which fail with 'error'."""
+
+    def __init__(self, objects, failures=0, error=ValueError("truncated")):
+        self.objects = objects
+        self.failures = failures
+        self.error = error
+        self.lists = 0
+
+    def list(self, kind, namespace):
+        self.lists += 1
+        if self.lists <= self.failures:
+            raise self.error
+        return dict((obj["metadata"]["name"], obj) for obj in self.objects)
+
+
+def test_polled_groups_are_listed_once_per_period(deployment):
+    fetcher = CountingFetcher([deployment("a")])
+    changed = []
+    informer = Informer(PollingFeed(fetcher, period=0.3), "Deployment.v1.apps", "default", changed.append).start()
+    try:
+        assert informer.synced.wait(5)
+        fetcher.objects = [deployment("a", replicas=2)]
+        time.sleep(0.45)
+        assert fetcher.lists == 2
+        assert changed == ["a"]
+    finally:
+        informer.stop()
+    informer._thread.join(5)
+    assert not informer._thread.is_alive()
+
+
+def test_informers_survive_unexpected_errors(deployment):
+    fetcher = CountingFetcher([deployment("a")], failures=1)
+    informer = Informer(PollingFeed(fetcher, period=60), "Deployment.v1.apps", "default", lambda name: None,
+                        retry=0.05).start()
+    try:
+        # Checks waiting for the group go on, and the list is retried.
+        assert informer.synced.wait(5)
+        for _ in range(100):
+            if informer.objects:
+                break
+            time.sleep(0.05)
+        assert list(informer.objects) == ["a"]
+        assert fetcher.lists == 2
+    finally:
+        informer.stop()